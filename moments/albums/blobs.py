@@ -0,0 +1,63 @@
+"""
+Reference counting for the content-addressed photo store in ``albums.storage``
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Blob
+from .renditions import RENDITION_FORMATS, RENDITION_SIZES, rendition_name
+from .storage import blob_digest
+
+
+def acquire(name, storage, count=1):
+    """
+    Records ``count`` more photos referencing the blob stored as ``name``
+    """
+    digest = blob_digest(name)
+    if digest is None:
+        return
+
+    if Blob.objects.filter(digest=digest).update(references=F('references') + count):
+        return
+
+    try:
+        with transaction.atomic():
+            Blob.objects.create(digest=digest, name=name, size=storage.size(name), references=count)
+            # The insert waits for a delete_files() that claimed the digest meanwhile, which then deletes the file
+            # before committing. Only checked once the row is in: no deletion can start after that.
+            if not storage.exists(name):
+                raise FileNotFoundError(f"{name} was deleted while it was being recorded")
+    except IntegrityError:
+        # Another request created it first
+        Blob.objects.filter(digest=digest).update(references=F('references') + count)
+
+
+def release(name, storage):
+    """
+    Records one photo fewer referencing the blob stored as ``name``, deleting the blob once nothing references it
+    """
+    digest = blob_digest(name)
+    if digest is None:
+        return
+
+    Blob.objects.filter(digest=digest, references__gt=0).update(references=F('references') - 1)
+    if Blob.objects.filter(digest=digest, references=0).delete()[0]:
+        transaction.on_commit(lambda: delete_files(digest, name, storage))
+
+
+def delete_files(digest, name, storage):
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                # Claims the digest: an upload reusing the blob meanwhile holds its own, possibly uncommitted, row,
+                # which this waits for and then fails against. An upload recording the blob after this waits for
+                # the claim instead, and then fails in acquire() on the missing file rather than referencing it.
+                Blob.objects.create(digest=digest, name=name, size=0, references=0)
+        except IntegrityError:
+            return
+
+        storage.delete(name)
+        for size in RENDITION_SIZES:
+            for fmt in RENDITION_FORMATS:
+                storage.delete(rendition_name(name, size, fmt))
+        Blob.objects.filter(digest=digest).delete()
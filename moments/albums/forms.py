@@ -1,12 +1,14 @@
+from django import forms
 from django.forms import ModelForm, inlineformset_factory
 
+from . import search
 from .models import Album, Photo
 
 
 class AlbumForm(ModelForm):
     class Meta:
-        exclude = ['owner']
         model = Album
+        fields = ['name', 'public']
 
     def clean(self):
         cleaned_data = super(AlbumForm, self).clean()
@@ -32,3 +34,21 @@ class PhotoForm(ModelForm):
 
 total_photo_fields = 5
 AlbumPhotosFormSet = inlineformset_factory(Album, Photo, form=PhotoForm, extra=total_photo_fields)
+
+
+class SearchForm(forms.Form):
+    q = forms.CharField(label='Search', min_length=search.MIN_QUERY_LENGTH, max_length=search.MAX_QUERY_LENGTH)
+    kind = forms.ChoiceField(choices=[('albums', 'Albums'), ('photos', 'Photos')], required=False)
+    page = forms.IntegerField(min_value=1, max_value=search.MAX_PAGES, required=False)
+
+    def results(self, user, per_page):
+        """
+        The requested page of results; call once the form is valid
+        """
+        query = self.cleaned_data['q']
+        if self.cleaned_data['kind'] == 'photos':
+            results = search.search_photos(query, user)
+        else:
+            results = search.search_albums(query, user)
+
+        return search.page(results, self.cleaned_data['page'] or 1, per_page)
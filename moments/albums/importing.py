@@ -0,0 +1,115 @@
+"""
+Bulk import of photo libraries from a directory tree or a zip archive.
+
+Each folder becomes an album and each image in it a photo titled after the file. Decoding, validation, blob writes,
+renditions and metadata run in worker processes; the parent process only talks to the database.
+"""
+import io
+import os
+import pathlib
+import posixpath
+import zipfile
+
+from django.core.files.base import ContentFile
+from django.core.validators import get_available_image_extensions
+from PIL import Image
+
+from . import metadata
+from .renditions import generate_renditions
+
+TITLE_MAX_LENGTH = 140
+ALBUM_NAME_MAX_LENGTH = 140
+# Album names are URL path segments, which cannot contain a slash
+ALBUM_PATH_SEPARATOR = ' - '
+
+# Worker processes keep their archives open between files
+_archives = {}
+
+
+class ImportedFile:
+    """
+    The result of processing one source file: where its blob and renditions were stored, or why it was rejected
+    """
+
+    def __init__(self, album, title, name=None, renditions=None, size=0, metadata=None, error=None):
+        self.album = album
+        self.title = title
+        self.name = name
+        self.renditions = renditions
+        self.size = size
+        self.metadata = metadata
+        self.error = error
+
+
+def image_extensions():
+    return {f".{ext.lower()}" for ext in get_available_image_extensions()}
+
+
+def collect(source, root_album):
+    """
+    Lists ``(album name, title, member)`` for every image file under ``source``, in a stable order.
+
+    Files directly in ``source`` go to the album ``root_album``; everything else goes to an album named after the
+    folder it is in, relative to ``source``, with the folder names joined by ``ALBUM_PATH_SEPARATOR``.
+    """
+    extensions = image_extensions()
+
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            members = [info.filename for info in archive.infolist() if not info.is_dir()]
+        split = posixpath.split
+    else:
+        members = [os.path.relpath(os.path.join(directory, filename), source)
+                   for directory, _, filenames in os.walk(source) for filename in filenames]
+        split = os.path.split
+
+    files = []
+    for member in sorted(members):
+        folder, filename = split(member)
+        path = pathlib.PurePath(filename)
+        if filename.startswith('.') or path.suffix.lower() not in extensions:
+            continue
+
+        album = ALBUM_PATH_SEPARATOR.join(pathlib.PurePath(folder).parts) if folder else root_album
+        files.append((album[:ALBUM_NAME_MAX_LENGTH], path.stem[:TITLE_MAX_LENGTH], member))
+
+    return files
+
+
+def read_member(source, member):
+    if os.path.isdir(source):
+        with open(os.path.join(source, member), 'rb') as file:
+            return file.read()
+
+    if source not in _archives:
+        _archives[source] = zipfile.ZipFile(source)
+    return _archives[source].read(member)
+
+
+def process_file(source, album, title, member, max_size=None):
+    """
+    Validates one image and writes it and its renditions to the photo store. Runs in a worker process.
+    """
+    from .models import Photo
+
+    try:
+        data = read_member(source, member)
+        if max_size is not None and len(data) > max_size:
+            return ImportedFile(album, title, error=f"larger than {max_size} bytes")
+
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+
+        field = Photo._meta.get_field('image')
+        name = field.storage.save(pathlib.PurePath(member).name, ContentFile(data))
+        image = field.attr_class(None, field, name)
+        renditions = generate_renditions(image)
+        fields = metadata.read(image)
+    except Exception as e:
+        return ImportedFile(album, title, error=str(e) or e.__class__.__name__)
+
+    return ImportedFile(album, title, name, renditions, len(data), fields)
+
+
+def process_file_star(args):
+    return process_file(*args)
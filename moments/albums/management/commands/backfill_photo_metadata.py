@@ -0,0 +1,76 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from albums.metadata import METADATA_FIELDS, read_stored
+from albums.models import Album, Photo
+from moments import processes
+from profiles import cache
+
+
+class Command(BaseCommand):
+    help = ("Reads the dimensions, size, type, capture time and orientation and makes the placeholder of photos "
+            "saved without them, or of every photo with --all")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Read every photo again, not only those missing data")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Processes reading files; 0 reads them in this one (default: %(default)s)")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Photos read and updated per batch (default: %(default)s)")
+
+    def handle(self, *args, workers, batch_size, **options):
+        started = time.monotonic()
+        photos = Photo.objects.exclude(image='').exclude(image__isnull=True).order_by('pk')
+        if not options['all']:
+            photos = photos.filter(Q(width__isnull=True) | Q(placeholder=''))
+
+        updated = failed = 0
+        albums = set()
+        executor = processes.pool(workers) if workers > 0 else None
+        try:
+            last_pk = 0
+            while True:
+                # Keyset batches, as updated photos drop out of the pending filter
+                batch = list(photos.filter(pk__gt=last_pk).only('pk', 'album', 'image')[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+
+                # Identical uploads share a stored file, which only needs reading once
+                names = list(dict.fromkeys(photo.image.name for photo in batch))
+                results = dict(executor.map(read_stored, names) if executor else map(read_stored, names))
+
+                for name, result in results.items():
+                    if isinstance(result, str):
+                        self.stderr.write(f"{name}: {result}")
+                readable = []
+                for photo in batch:
+                    fields = results[photo.image.name]
+                    if isinstance(fields, str):
+                        failed += 1
+                        continue
+                    for field, value in fields.items():
+                        setattr(photo, field, value)
+                    readable.append(photo)
+                    albums.add(photo.album_id)
+
+                Photo.objects.bulk_update(readable, METADATA_FIELDS)
+                updated += len(readable)
+                if options['verbosity'] > 1:
+                    self.stdout.write(f"Updated {updated} photo(s)")
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        # bulk_update() sends no signals, and album pages lay their photos out by these dimensions
+        if cache.is_enabled():
+            for username, name in Album.objects.filter(pk__in=albums).values_list('owner__username', 'name'):
+                cache.invalidate_album(username, name)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Updated {updated} photo(s) in {time.monotonic() - started:.1f}s"))
+        if failed:
+            self.stdout.write(f"Could not read {failed} photo(s)")
@@ -0,0 +1,68 @@
+import hashlib
+import pathlib
+
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from albums.models import Blob, Photo
+from albums.storage import BLOB_DIR, blob_digest
+
+
+class Command(BaseCommand):
+    help = ("Moves photos stored under their upload_to path into the content-addressed blob store, "
+            "deleting the originals and their renditions")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report how much space deduplication would reclaim")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Photos fetched from the database at a time (default: %(default)s)")
+
+    def handle(self, *args, dry_run=False, batch_size, **options):
+        storage = Photo._meta.get_field('image').storage
+        photos = (Photo.objects.exclude(image='').exclude(image__startswith=f"{BLOB_DIR}/")
+                  .select_related('album__owner').order_by('pk'))
+
+        converted = duplicates = reclaimed = 0
+        seen = set()
+        for photo in photos.iterator(chunk_size=batch_size):
+            old_name = photo.image.name
+            if not storage.exists(old_name):
+                self.stderr.write(f"Photo {photo.pk}: {old_name} is missing, skipping")
+                continue
+            size = storage.size(old_name)
+
+            if dry_run:
+                digest = self.hash_file(storage, old_name)
+                duplicate = digest in seen or Blob.objects.filter(digest=digest).exists()
+                seen.add(digest)
+            else:
+                old_renditions = [name for formats in photo.renditions.values() for name in formats.values()]
+                with storage.open(old_name) as original:
+                    photo.image.save(pathlib.PurePosixPath(old_name).name, original, save=False)
+                # The blob already has a row if another photo holds the same content
+                duplicate = Blob.objects.filter(digest=blob_digest(photo.image.name)).exists()
+                # Saving runs the Photo signal handlers: blob references, renditions and page cache invalidation
+                photo.save()
+
+                storage.delete(old_name)
+                for name in old_renditions:
+                    storage.delete(name)
+
+            converted += 1
+            if duplicate:
+                duplicates += 1
+                reclaimed += size
+
+        verb = "Would convert" if dry_run else "Converted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {converted} photo(s), {duplicates} duplicate(s), reclaiming {filesizeformat(reclaimed)}"))
+
+    @staticmethod
+    def hash_file(storage, name):
+        digest = hashlib.sha256()
+        with storage.open(name) as file:
+            for chunk in file.chunks():
+                digest.update(chunk)
+
+        return digest.hexdigest()
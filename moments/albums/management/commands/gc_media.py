@@ -0,0 +1,163 @@
+import collections
+import os
+import posixpath
+import time
+from functools import reduce
+from operator import or_
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.template.defaultfilters import filesizeformat
+
+from albums.models import Blob, Photo
+from albums.renditions import RENDITION_FORMATS, RENDITION_SIZES, is_rendition
+from albums.storage import blob_digest
+
+
+def walk(root):
+    """
+    Yields ``(directory, [(filename, size, mtime)], has_subdirectories)`` for each directory under ``root``, with
+    ``directory`` relative to it. Only the directories still to be listed are held, so memory use is bounded by the
+    largest directory rather than the number of files.
+    """
+    pending = ['']
+    while pending:
+        directory = pending.pop()
+        files = []
+        has_subdirectories = False
+        with os.scandir(os.path.join(root, directory)) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(posixpath.join(directory, entry.name))
+                    has_subdirectories = True
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    files.append((entry.name, stat.st_size, stat.st_mtime))
+        yield directory, files, has_subdirectories
+
+
+def upload_prefix(name):
+    """
+    What the names of an upload stored as ``name`` and of its renditions start with: its directory and name up to the
+    first dot. Uploads whose titles differ only after a dot share one, which keeps more renditions rather than fewer.
+    """
+    directory, filename = posixpath.split(name)
+    return posixpath.join(directory, f"{filename.split('.', 1)[0]}.")
+
+
+class Command(BaseCommand):
+    help = ("Deletes files under MEDIA_ROOT that are neither the image of a photo nor one of its renditions, such as "
+            "those of deleted albums and interrupted uploads, and reports the space reclaimed")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be deleted")
+        parser.add_argument('--min-age', type=float, default=24,
+                            help="Hours since a file was last modified before it may be deleted, so that uploads "
+                                 "still being saved are left alone (default: %(default)s)")
+        parser.add_argument('--rate', type=float, default=0,
+                            help="Files deleted per second at most; 0 for no limit (default: %(default)s)")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Files checked against the database at a time (default: %(default)s)")
+
+    def handle(self, *args, dry_run=False, min_age, rate, batch_size, **options):
+        if batch_size < 1 or min_age < 0 or rate < 0:
+            raise CommandError("--batch-size must be at least 1, and --min-age and --rate not negative")
+
+        self.root = Photo._meta.get_field('image').storage.location
+        if not os.path.isdir(self.root):
+            raise CommandError(f"{self.root} does not exist")
+        self.dry_run = dry_run
+        self.interval = 1 / rate if rate else 0
+        self.next_deletion = time.monotonic()
+        self.verbosity = options['verbosity']
+        self.garbage = self.reclaimed = 0
+
+        scanned = young = 0
+        cutoff = time.time() - min_age * 60 * 60
+        # Old enough files as (name, size), and the directories holding nothing else: (directory, file count)
+        batch, directories = [], []
+        for directory, files, has_subdirectories in walk(self.root):
+            old = [(posixpath.join(directory, filename), size) for filename, size, mtime in files if mtime < cutoff]
+            scanned += len(files)
+            young += len(files) - len(old)
+            # Whole directories at a time, so that renditions are checked along with their upload
+            batch.extend(old)
+            if directory and old and len(old) == len(files) and not has_subdirectories:
+                directories.append((directory, len(old)))
+
+            if len(batch) >= batch_size:
+                self.collect(batch, directories)
+                batch, directories = [], []
+        if batch:
+            self.collect(batch, directories)
+
+        verb = "would reclaim" if dry_run else "reclaimed"
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {scanned} file(s), {self.garbage} unused: {verb} {filesizeformat(self.reclaimed)}"))
+        if young:
+            self.stdout.write(f"Left {young} file(s) modified within the last {min_age:g} hour(s)")
+
+    def collect(self, batch, directories):
+        """
+        Deletes the files of ``batch`` that no photo uses, with four queries at most whatever its size
+        """
+        names = [name for name, _ in batch]
+        referenced = set(Photo.objects.filter(image__in=names).values_list('image', flat=True))
+
+        # A rendition is in use if its upload is, which is normally in the same directory and so in this batch
+        listed = {upload_prefix(name) for name in names if not is_rendition(name)}
+        in_use = {upload_prefix(name) for name in referenced}
+        renditions = {name: upload_prefix(name) for name in names if name not in referenced and is_rendition(name)}
+        unlisted = {prefix for prefix in renditions.values() if prefix not in listed}
+        if unlisted:
+            # The upload's file is gone, but a photo may still show its renditions
+            uploads = Photo.objects.filter(reduce(or_, (Q(image__startswith=prefix) for prefix in unlisted)))
+            in_use.update(upload_prefix(name) for name in uploads.values_list('image', flat=True))
+        referenced.update(name for name, prefix in renditions.items() if prefix in in_use)
+
+        garbage = [(name, size) for name, size in batch if name not in referenced]
+        # An upload of the same content may have reused an unreferenced blob since; it records the blob first
+        digests = {blob_digest(name) for name, _ in garbage} - {None}
+        if digests:
+            reused = set(Blob.objects.filter(digest__in=digests).values_list('digest', flat=True))
+            garbage = [(name, size) for name, size in garbage if blob_digest(name) not in reused]
+
+        if garbage:
+            # Renditions are used under the names recorded for them, which for those of uploads from before the blob
+            # store may be blob names of their own
+            names = [name for name, _ in garbage]
+            lookups = reduce(or_, (Q(**{f'renditions__{size}__{fmt}__in': names})
+                                   for size in RENDITION_SIZES for fmt in RENDITION_FORMATS))
+            recorded = {name for renditions in Photo.objects.filter(lookups).values_list('renditions', flat=True)
+                        for formats in renditions.values() for name in formats.values()}
+            garbage = [(name, size) for name, size in garbage if name not in recorded]
+
+        for name, size in garbage:
+            if self.verbosity > 1:
+                self.stdout.write(name)
+            if not self.dry_run:
+                self.delete(name)
+            self.garbage += 1
+            self.reclaimed += size
+
+        if not self.dry_run:
+            deleted = collections.Counter(posixpath.dirname(name) for name, _ in garbage)
+            # Deepest first, so that nothing else is in the way
+            for directory, count in sorted(directories, key=lambda item: len(item[0]), reverse=True):
+                if deleted[directory] == count:
+                    try:
+                        os.rmdir(os.path.join(self.root, directory))
+                    except OSError:
+                        # Something was written to it meanwhile
+                        pass
+
+    def delete(self, name):
+        if self.interval:
+            delay = self.next_deletion - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_deletion = max(self.next_deletion, time.monotonic()) + self.interval
+        try:
+            os.remove(os.path.join(self.root, name))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,116 @@
+import os
+import pathlib
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.template.defaultfilters import filesizeformat
+
+from albums import blobs
+from albums.importing import collect, process_file_star
+from albums.models import Album, Photo
+from moments import processes
+from profiles import cache
+
+
+class Command(BaseCommand):
+    help = ("Imports a directory tree or zip archive of photos for a user, creating an album for each folder "
+            "and a photo for each image")
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="Directory or zip archive to import")
+        parser.add_argument('--user', required=True, help="Username that will own the albums")
+        parser.add_argument('--private', action='store_true', help="Make newly created albums private")
+        parser.add_argument('--album', help="Album for files at the top level of the source (default: its name)")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Processes decoding images; 0 processes them in this one (default: %(default)s)")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Photos inserted per INSERT statement (default: %(default)s)")
+
+    def handle(self, *args, source, user, private=False, album=None, workers, batch_size, **options):
+        self.verbosity = options['verbosity']
+        if not os.path.exists(source):
+            raise CommandError(f"{source} does not exist")
+        try:
+            owner = User.objects.get(username=user)
+        except User.DoesNotExist:
+            raise CommandError(f"User {user} does not exist")
+
+        started = time.monotonic()
+        source = os.path.abspath(source)
+        files = collect(source, album or pathlib.PurePath(source).stem)
+
+        albums = {}
+        for name in dict.fromkeys(album_name for album_name, _, _ in files):
+            albums[name], _ = Album.objects.get_or_create(owner=owner, name=name, defaults={'public': not private})
+        existing = set(Photo.objects.filter(album__in=albums.values()).values_list('album__name', 'title'))
+
+        # Titles are unique within an album, so only the first file with a given name is imported
+        tasks = []
+        self.skipped = Counter()
+        for album_name, title, member in files:
+            if (album_name, title) in existing:
+                self.skipped['title already in album'] += 1
+                continue
+            existing.add((album_name, title))
+            tasks.append((source, album_name, title, member, getattr(settings, 'UPLOAD_MAX_SIZE', None)))
+
+        self.imported = self.imported_bytes = 0
+        batch = []
+        for result in self.process(tasks, workers, batch_size):
+            if result.error:
+                self.skipped['invalid image'] += 1
+                self.stderr.write(f"{result.album}/{result.title}: {result.error}")
+                continue
+
+            batch.append(result)
+            if len(batch) >= batch_size:
+                self.insert(batch, albums)
+                batch = []
+        if batch:
+            self.insert(batch, albums)
+
+        if cache.is_enabled():
+            for name in albums:
+                cache.invalidate_album(owner.username, name)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.imported} photo(s) ({filesizeformat(self.imported_bytes)}) into {len(albums)} album(s) "
+            f"in {elapsed:.1f}s: {self.imported / elapsed:.1f} photos/s, "
+            f"{filesizeformat(self.imported_bytes / elapsed)}/s"))
+        for reason, count in self.skipped.items():
+            self.stdout.write(f"Skipped {count} file(s): {reason}")
+
+    def process(self, tasks, workers, batch_size):
+        if workers <= 0:
+            yield from map(process_file_star, tasks)
+            return
+
+        # Results come back in submission order, so imports are reproducible whatever the number of workers
+        chunksize = max(1, min(batch_size, len(tasks) // (workers * 4)))
+        with processes.pool(workers) as executor:
+            yield from executor.map(process_file_star, tasks, chunksize=chunksize)
+
+    def insert(self, results, albums):
+        photos = []
+        for result in results:
+            # As with uploads, the same picture may appear twice in an album under different titles
+            photos.append(Photo(album=albums[result.album], title=result.title, image=result.name,
+                                renditions=result.renditions, **result.metadata))
+            self.imported_bytes += result.size
+
+        storage = Photo._meta.get_field('image').storage
+        # bulk_create() does not send the signals that maintain blob references and album stats
+        with transaction.atomic():
+            Photo.objects.bulk_create(photos)
+            for name, count in Counter(photo.image.name for photo in photos).items():
+                blobs.acquire(name, storage, count)
+            Album.objects.filter(pk__in={photo.album_id for photo in photos}).refresh_photo_stats()
+
+        self.imported += len(photos)
+        if self.verbosity > 1:
+            self.stdout.write(f"Imported {self.imported} photo(s)")
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from albums.models import Album
+
+
+class Command(BaseCommand):
+    help = "Recomputes each album's cover photo, photo count and last photo timestamp from its photos"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Albums updated per UPDATE statement (default: %(default)s)")
+        parser.add_argument('--user', help="Only rebuild albums owned by this username")
+
+    def handle(self, *args, batch_size, user=None, **options):
+        albums = Album.objects.order_by('pk')
+        if user:
+            albums = albums.filter(owner__username=user)
+
+        updated = 0
+        last_pk = 0
+        while True:
+            batch = list(albums.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                break
+            updated += Album.objects.filter(pk__in=batch).refresh_photo_stats()
+            last_pk = batch[-1]
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt photo stats for {updated} album(s)"))
@@ -0,0 +1,177 @@
+"""
+Serving of photo files under ``MEDIA_URL``.
+
+A file is served when it is, or is a rendition of, the image of a photo the requesting user may see. Responses honour
+conditional and single-range requests. With ``MEDIA_OFFLOAD`` set, the file itself is sent by the front-end web server
+(``X-Accel-Redirect`` for nginx, ``X-Sendfile`` for Apache and lighttpd) once the privacy check has passed.
+"""
+import mimetypes
+import os
+import pathlib
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+
+from .models import Photo
+from .renditions import RENDITION_FORMATS, RENDITION_SIZES, rendition_name
+from .storage import BLOB_DIR, blob_digest
+
+X_ACCEL_REDIRECT = 'x-accel-redirect'
+X_SENDFILE = 'x-sendfile'
+
+# Blob names change with their content, so they can be cached for as long as browsers allow
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+RANGE = re.compile(r'^bytes=(?P<start>\d*)-(?P<end>\d*)$')
+
+
+def photos_for(name):
+    """
+    Photos whose image is ``name`` or has a rendition named ``name``
+    """
+    digest = blob_digest(name)
+    if digest is not None:
+        # Every photo with this content shares the blob and its renditions
+        return Photo.objects.filter(image__startswith=f"{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}")
+
+    directory, filename = posixpath.split(name)
+    stem = filename.split('.', 1)[0]
+    candidates = Photo.objects.filter(Q(image=name) | Q(image__startswith=posixpath.join(directory, f"{stem}.")))
+    pks = [photo.pk for photo in candidates.only('pk', 'image') if name in _files_of(photo.image.name)]
+
+    return Photo.objects.filter(pk__in=pks)
+
+
+def _files_of(image_name):
+    yield image_name
+    for size in RENDITION_SIZES:
+        for fmt in RENDITION_FORMATS:
+            yield rendition_name(image_name, size, fmt)
+
+
+def visible_photos(photos, user):
+    """
+    Applies the album page's rule: public albums are visible to everyone, private ones only to their owner
+    """
+    visible = Q(album__public=True)
+    if user.is_authenticated:
+        visible |= Q(album__owner=user)
+
+    return photos.filter(visible)
+
+
+def parse_range(header, size):
+    """
+    The ``(start, end)`` byte positions, inclusive, of a single-range ``Range`` header.
+
+    Returns None when the header should be ignored and the whole file served, and raises ValueError when the range is
+    not satisfiable.
+    """
+    match = RANGE.match(header or '')
+    if not match or not (match['start'] or match['end']):
+        # Multiple ranges and other units are not supported; serving the whole file is always allowed
+        return None
+
+    if not match['start']:
+        # The last N bytes
+        length = int(match['end'])
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+
+    start = int(match['start'])
+    end = min(int(match['end']), size - 1) if match['end'] else size - 1
+    if start > end:
+        raise ValueError(header)
+
+    return start, end
+
+
+class RangeFile:
+    """
+    Reads at most ``length`` bytes of ``file`` from its current position
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def serve(request, name, storage, public):
+    """
+    Responds with the file ``name`` from ``storage``, which the request has already been allowed to see
+    """
+    path = storage.path(name)
+    stat = os.stat(path)
+    digest = blob_digest(name)
+    # Blob names are derived from their content, so the name is as strong a validator as a hash of the file
+    etag = f'"{pathlib.PurePosixPath(name).name}"' if digest else f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        response = _file_response(request, name, path, stat.st_size, etag, int(stat.st_mtime))
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    if public:
+        max_age = IMMUTABLE_MAX_AGE if digest else 0
+        patch_cache_control(response, public=True, max_age=max_age, immutable=bool(digest))
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+
+    return response
+
+
+def _file_response(request, name, path, size, etag, last_modified):
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    offload = getattr(settings, 'MEDIA_OFFLOAD', None)
+    if offload == X_ACCEL_REDIRECT:
+        # nginx handles Range itself for internal redirects
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = quote(f"{settings.MEDIA_OFFLOAD_PREFIX.rstrip('/')}/{name}")
+        return response
+    if offload == X_SENDFILE:
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+        return response
+
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range or if_range == etag or parse_http_date_safe(if_range) == last_modified:
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{size}"
+            return response
+
+    file = open(path, 'rb')
+    if byte_range is None:
+        # A real file lets the WSGI server send it with sendfile()
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, end = byte_range
+        file.seek(start)
+        response = FileResponse(RangeFile(file, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = f"bytes {start}-{end}/{size}"
+        response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+
+    return response
@@ -0,0 +1,125 @@
+"""
+Dimensions, size, type, capture time and orientation of a photo's original file, and a tiny placeholder image.
+
+Reading them means opening the file, so uploads do not wait for it: ``schedule`` enqueues an ``extract_metadata`` job,
+which ``manage.py run_workers`` runs once the saving transaction commits. The ``backfill_photo_metadata`` command fills
+in photos saved before these columns existed.
+"""
+import datetime
+
+from django.conf import settings
+from django.utils import timezone
+from PIL import Image
+
+from jobs.queue import task
+from .renditions import generate_placeholder
+
+METADATA_FIELDS = ('width', 'height', 'byte_size', 'mime_type', 'taken_at', 'orientation', 'placeholder')
+EMPTY = {'width': None, 'height': None, 'byte_size': None, 'mime_type': '', 'taken_at': None, 'orientation': None,
+         'placeholder': ''}
+
+# EXIF tags
+ORIENTATION = 0x0112
+DATE_TIME = 0x0132
+EXIF_IFD = 0x8769
+DATE_TIME_ORIGINAL = 0x9003
+OFFSET_TIME_ORIGINAL = 0x9011
+
+# Orientations turning the image a quarter, so that it is displayed as wide as it is stored tall
+QUARTER_TURNS = {5, 6, 7, 8}
+
+
+def taken_at(exif):
+    """
+    When the photo was taken according to its EXIF data, in its recorded UTC offset or else the current time zone
+    """
+    exif_ifd = exif.get_ifd(EXIF_IFD)
+    value = exif_ifd.get(DATE_TIME_ORIGINAL) or exif.get(DATE_TIME)
+    try:
+        taken = datetime.datetime.strptime(str(value).strip('\x00 '), '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+
+    try:
+        return taken.replace(tzinfo=datetime.datetime.strptime(exif_ifd.get(OFFSET_TIME_ORIGINAL), '%z').tzinfo)
+    except (TypeError, ValueError):
+        return timezone.make_aware(taken) if settings.USE_TZ else taken
+
+
+def extract(file, byte_size):
+    """
+    The metadata fields of the image in ``file``, which is ``byte_size`` bytes long
+    """
+    with Image.open(file) as image:
+        width, height = image.size
+        mime_type = Image.MIME.get(image.format, '')
+        exif = image.getexif()
+
+    orientation = exif.get(ORIENTATION)
+    if orientation not in range(1, 9):
+        orientation = None
+    if orientation in QUARTER_TURNS:
+        width, height = height, width
+
+    return {
+        'width': width,
+        'height': height,
+        'byte_size': byte_size,
+        'mime_type': mime_type,
+        'taken_at': taken_at(exif),
+        'orientation': orientation,
+    }
+
+
+def read(image):
+    """
+    The metadata fields of an image field file. The placeholder is made from the renditions when they exist.
+    """
+    with image.open('rb'):
+        fields = extract(image, image.size)
+    fields['placeholder'] = generate_placeholder(image)
+
+    return fields
+
+
+def read_stored(name):
+    """
+    ``(name, fields)`` for the photo file stored as ``name``, or ``(name, error message)``. Runs in worker processes.
+    """
+    from .models import Photo
+
+    field = Photo._meta.get_field('image')
+    try:
+        return name, read(field.attr_class(None, field, name))
+    except Exception as e:
+        return name, str(e) or e.__class__.__name__
+
+
+def update(pk):
+    """
+    Reads photo ``pk``'s file and stores its metadata
+    """
+    from profiles import cache
+    from .models import Photo
+
+    photo = Photo.objects.filter(pk=pk).select_related('album__owner').first()
+    if photo is None or not photo.image:
+        return
+
+    fields = read(photo.image)
+    # A save replacing the image meanwhile has scheduled its own update
+    if Photo.objects.filter(pk=pk, image=photo.image.name).update(**fields) and photo.album_id is not None:
+        # The album page lays its photos out by their dimensions
+        cache.invalidate_album(photo.album.owner.username, photo.album.name)
+
+
+@task
+def extract_metadata(pk):
+    update(pk)
+
+
+def schedule(pk):
+    """
+    Extracts photo ``pk``'s metadata in the background once the current transaction commits
+    """
+    extract_metadata.enqueue(pk)
@@ -0,0 +1,49 @@
+# Generated by Django 3.1.5 on 2026-10-18 17:08
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def populate_photo_stats(apps, schema_editor):
+    Album = apps.get_model('albums', 'Album')
+    Photo = apps.get_model('albums', 'Photo')
+
+    photos = Photo.objects.filter(album=OuterRef('pk')).order_by()
+    photo_count = photos.values('album').annotate(count=Count('pk')).values('count')
+    Album.objects.update(
+        cover_photo=Subquery(photos.order_by('pk').values('pk')[:1]),
+        photo_count=Coalesce(Subquery(photo_count), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0005_add_photo_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='cover_photo',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='albums.photo'),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='last_photo_added',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='photo_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, null=True),
+        ),
+        migrations.RunPython(populate_photo_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.5 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0006_add_album_photo_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['public', '-created', '-id'], name='album_public_created_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.1.5 on 2026-10-18 17:16
+
+import albums.models
+import albums.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0007_add_album_public_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100)),
+                ('size', models.PositiveBigIntegerField()),
+                ('references', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='photo',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=albums.storage.ContentAddressedStorage(), upload_to=albums.models.upload_to),
+        ),
+    ]
@@ -0,0 +1,68 @@
+from django.db import migrations
+
+# PostgreSQL GIN indexes, on trigrams when the pg_trgm extension is available and on the text vector otherwise
+SEARCH_INDEXES = [
+    ('albums_album', 'name', 'album_name_trgm_idx', 'album_name_tsv_idx'),
+    ('albums_photo', 'title', 'photo_title_trgm_idx', 'photo_title_tsv_idx'),
+    ('auth_user', 'username', 'user_username_trgm_idx', 'user_username_tsv_idx'),
+]
+
+# External content FTS5 tables, kept current by triggers. SQLite rebuilds a table for most schema changes, which drops
+# its triggers, so a migration altering one of these tables must recreate them.
+FTS_TABLES = [
+    ('albums_album_search', 'albums_album', 'name'),
+    ('albums_photo_search', 'albums_photo', 'title'),
+    ('albums_user_search', 'auth_user', 'username'),
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+            trigram = cursor.fetchone() is not None
+        if trigram:
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+        for table, column, trigram_index, vector_index in SEARCH_INDEXES:
+            if trigram:
+                schema_editor.execute(
+                    f'CREATE INDEX "{trigram_index}" ON "{table}" USING gin ("{column}" gin_trgm_ops)')
+            else:
+                schema_editor.execute(
+                    f'CREATE INDEX "{vector_index}" ON "{table}" USING gin (to_tsvector(\'simple\', "{column}"))')
+    elif schema_editor.connection.vendor == 'sqlite':
+        for fts, table, column in FTS_TABLES:
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {fts} USING fts5({column}, content='{table}', content_rowid='id')")
+            delete = f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column});"
+            insert = f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column});"
+            schema_editor.execute(f"CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN {insert} END")
+            schema_editor.execute(f"CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN {delete} END")
+            schema_editor.execute(
+                f"CREATE TRIGGER {fts}_update AFTER UPDATE OF {column} ON {table} BEGIN {delete} {insert} END")
+            schema_editor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for table, column, *indexes in SEARCH_INDEXES:
+            for index in indexes:
+                schema_editor.execute(f'DROP INDEX IF EXISTS "{index}"')
+    elif schema_editor.connection.vendor == 'sqlite':
+        for fts, table, column in FTS_TABLES:
+            for trigger in ('insert', 'delete', 'update'):
+                schema_editor.execute(f"DROP TRIGGER IF EXISTS {fts}_{trigger}")
+            schema_editor.execute(f"DROP TABLE IF EXISTS {fts}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('albums', '0008_add_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
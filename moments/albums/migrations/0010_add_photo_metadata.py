@@ -0,0 +1,56 @@
+# Generated by Django 3.1.5 on 2026-10-18 17:44
+
+from django.db import migrations, models
+
+from ._search_triggers import restore_photo_search_triggers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0009_add_search_indexes'),
+    ]
+
+    # Both ways, the change rebuilds the table on SQLite, dropping its search triggers
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_photo_search_triggers),
+        migrations.AddField(
+            model_name='photo',
+            name='byte_size',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='mime_type',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='orientation',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='taken_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['album', 'taken_at', 'id'], name='photo_album_taken_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(condition=models.Q(width__isnull=True), fields=['id'], name='photo_metadata_pending_idx'),
+        ),
+        migrations.RunPython(restore_photo_search_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.5 on 2026-10-18 17:48
+
+from django.db import migrations, models
+
+from ._search_triggers import restore_photo_search_triggers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0010_add_photo_metadata'),
+    ]
+
+    # Both ways, the change rebuilds the table on SQLite, dropping its search triggers
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_photo_search_triggers),
+        migrations.AddField(
+            model_name='photo',
+            name='placeholder',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(restore_photo_search_triggers, migrations.RunPython.noop),
+    ]
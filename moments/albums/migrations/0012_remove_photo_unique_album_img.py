@@ -0,0 +1,22 @@
+# Generated by Django 3.1.5 on 2026-10-18 18:29
+
+from django.db import migrations
+
+from ._search_triggers import restore_photo_search_triggers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0011_add_photo_placeholder'),
+    ]
+
+    # Both ways, the change rebuilds the table on SQLite, dropping its search triggers
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_photo_search_triggers),
+        migrations.RemoveConstraint(
+            model_name='photo',
+            name='unique_album_img',
+        ),
+        migrations.RunPython(restore_photo_search_triggers, migrations.RunPython.noop),
+    ]
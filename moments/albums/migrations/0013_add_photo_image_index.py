@@ -0,0 +1,17 @@
+# Generated by Django 3.1.5 on 2026-10-18 18:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0012_remove_photo_unique_album_img'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['image'], name='photo_image_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
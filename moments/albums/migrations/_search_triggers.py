@@ -0,0 +1,20 @@
+"""
+The triggers of migration 0009 keeping the SQLite FTS5 table of photo titles current, frozen as they were then.
+
+SQLite drops a table's triggers when a schema change rebuilds it, as most changes to ``albums_photo`` do. Migrations
+making one recreate them after it, and before it too, for when the migration is unapplied.
+"""
+
+
+def restore_photo_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    delete = "INSERT INTO albums_photo_search(albums_photo_search, rowid, title) VALUES ('delete', old.id, old.title);"
+    insert = "INSERT INTO albums_photo_search(rowid, title) VALUES (new.id, new.title);"
+    for trigger in ('insert', 'delete', 'update'):
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS albums_photo_search_{trigger}")
+    schema_editor.execute(f"CREATE TRIGGER albums_photo_search_insert AFTER INSERT ON albums_photo BEGIN {insert} END")
+    schema_editor.execute(f"CREATE TRIGGER albums_photo_search_delete AFTER DELETE ON albums_photo BEGIN {delete} END")
+    schema_editor.execute(
+        f"CREATE TRIGGER albums_photo_search_update AFTER UPDATE OF title ON albums_photo BEGIN {delete} {insert} END")
@@ -2,6 +2,27 @@ import pathlib
 
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .renditions import RENDITION_FORMATS, RENDITION_SIZES, rendition_name, rendition_urls
+from .storage import ContentAddressedStorage
+
+
+class AlbumQuerySet(models.QuerySet):
+
+    def refresh_photo_stats(self):
+        """
+        Recomputes the denormalized photo columns of every album in the queryset with a single UPDATE
+        """
+        photos = Photo.objects.filter(album=OuterRef('pk')).order_by()
+        photo_count = photos.values('album').annotate(count=Count('pk')).values('count')
+
+        return self.update(
+            cover_photo=Subquery(photos.order_by('pk').values('pk')[:1]),
+            photo_count=Coalesce(Subquery(photo_count), 0),
+            last_photo_added=Subquery(photos.order_by('-created').values('created')[:1]),
+        )
 
 
 class Album(models.Model):
@@ -10,11 +31,22 @@ class Album(models.Model):
     public = models.BooleanField(default=True)
     created = models.DateTimeField(auto_now_add=True, null=True)
 
+    # Denormalized from `photos`, kept current by the signal handlers in albums.signals
+    cover_photo = models.ForeignKey('Photo', related_name='+', on_delete=models.SET_NULL, null=True, blank=True)
+    photo_count = models.PositiveIntegerField(default=0)
+    last_photo_added = models.DateTimeField(null=True, blank=True)
+
+    objects = AlbumQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['name', 'owner'],
                                     name='unique_user_album')
         ]
+        indexes = [
+            # Serves the keyset-paginated public album list
+            models.Index(fields=['public', '-created', '-id'], name='album_public_created_idx'),
+        ]
 
 
 def upload_to(instance, filename):
@@ -28,12 +60,62 @@ def upload_to(instance, filename):
 class Photo(models.Model):
     title = models.CharField(max_length=140)
     album = models.ForeignKey(Album, related_name='photos', on_delete=models.CASCADE, null=True)
-    image = models.ImageField(upload_to=upload_to, null=True, blank=True)
+    image = models.ImageField(upload_to=upload_to, storage=ContentAddressedStorage(), null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True, null=True)
+    renditions = models.JSONField(default=dict, blank=True)
+
+    # Read from the image after upload by albums.metadata; empty until then. The dimensions are those of the upright
+    # image, as the renditions are drawn.
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    byte_size = models.PositiveBigIntegerField(null=True, blank=True)
+    mime_type = models.CharField(max_length=50, blank=True)
+    taken_at = models.DateTimeField(null=True, blank=True)
+    orientation = models.PositiveSmallIntegerField(null=True, blank=True)
+    # A tiny image as a data: URI, painted while the renditions load
+    placeholder = models.TextField(blank=True)
 
     class Meta:
         constraints = [
+            # The same picture may appear twice under different titles, which now share one stored blob
             models.UniqueConstraint(fields=['title', 'album'],
                                     name='unique_album_title'),
-            models.UniqueConstraint(fields=['album', 'image'],
-                                    name='unique_album_img')
-        ]
\ No newline at end of file
+        ]
+        indexes = [
+            # Serves an album's photos in capture order
+            models.Index(fields=['album', 'taken_at', 'id'], name='photo_album_taken_idx'),
+            # Finds photos still waiting for metadata
+            models.Index(fields=['id'], name='photo_metadata_pending_idx', condition=models.Q(width__isnull=True)),
+            # Finds the photos of a media file by name or name prefix; the pattern operator class lets PostgreSQL serve
+            # LIKE 'prefix%' with it as well as equality
+            models.Index(fields=['image'], name='photo_image_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
+    @property
+    def has_current_renditions(self):
+        """
+        Whether ``renditions`` were generated from the file currently in ``image``
+        """
+        expected = {size: {fmt: rendition_name(self.image.name, size, fmt) for fmt in RENDITION_FORMATS}
+                    for size in RENDITION_SIZES}
+        return self.renditions == expected
+
+    @property
+    def rendition_urls(self):
+        """
+        ``{size: {format: url}}`` for templates, falling back to the original upload until renditions exist
+        """
+        if not self.image:
+            return {}
+
+        return rendition_urls(self.image.storage, self.image.name, self.renditions)
+
+
+class Blob(models.Model):
+    """
+    A file in the content-addressed photo store and the number of photos referencing it
+    """
+    digest = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=100)
+    size = models.PositiveBigIntegerField()
+    references = models.PositiveIntegerField(default=0)
@@ -0,0 +1,128 @@
+"""
+Keyset (cursor) pagination.
+
+A page is selected with a WHERE clause on the ordering columns of the last row of the previous page, so any page costs
+the same index range scan as the first one and no COUNT(*) over the table is needed.
+"""
+import base64
+import binascii
+import json
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+class KeysetPaginator:
+    """
+    Paginates ``queryset`` on ``ordering``, which must end in a unique field (normally ``id``).
+
+    NULLs compare greater than every value, matching PostgreSQL's default so that an index on the ordering columns
+    serves both the ORDER BY and the cursor condition.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+        self.fields = [queryset.model._meta.get_field(name) for name, _ in self.ordering]
+
+    def encode_cursor(self, obj):
+        values = [None if field.value_from_object(obj) is None else field.value_to_string(obj)
+                  for field in self.fields]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(values) != len(self.fields):
+                raise InvalidCursor(cursor)
+            return [None if value is None else field.to_python(value) for field, value in zip(self.fields, values)]
+        except (binascii.Error, UnicodeError, ValueError, TypeError, ValidationError) as e:
+            raise InvalidCursor(cursor) from e
+
+    def page(self, cursor=None):
+        queryset = self.queryset.order_by(*[f"-{name}" if descending else name for name, descending in self.ordering])
+        if cursor:
+            queryset = queryset.filter(self.after(self.decode_cursor(cursor)))
+
+        # One extra row tells us whether there is a next page without counting
+        rows = list(queryset[:self.per_page + 1])
+        next_cursor = self.encode_cursor(rows[self.per_page - 1]) if len(rows) > self.per_page else None
+
+        return KeysetPage(rows[:self.per_page], next_cursor)
+
+    def after(self, values):
+        """
+        Rows strictly after ``values`` in the paginator's ordering
+        """
+        branches = []
+        equal = Q()
+        for field, (name, descending), value in zip(self.fields, self.ordering, values):
+            beyond = self._beyond(field, name, descending, value)
+            if beyond is not None:
+                branches.append(equal & beyond)
+            equal &= Q(**{f"{name}__isnull": True}) if value is None else Q(**{name: value})
+
+        if not branches:
+            return Q(pk__in=[])
+
+        condition = reduce(or_, branches)
+
+        # Repeat the leading column as a plain range so the database can seek the index instead of filtering from
+        # the start of it
+        field, (name, descending), value = self.fields[0], self.ordering[0], values[0]
+        if value is not None and (descending or not field.null):
+            condition &= Q(**{f"{name}__{'lte' if descending else 'gte'}": value})
+
+        return condition
+
+    @staticmethod
+    def _beyond(field, name, descending, value):
+        if descending:
+            return Q(**{f"{name}__isnull": False}) if value is None else Q(**{f"{name}__lt": value})
+        if value is None:
+            return None
+
+        beyond = Q(**{f"{name}__gt": value})
+        return beyond | Q(**{f"{name}__isnull": True}) if field.null else beyond
+
+
+class KeysetPaginationMixin:
+    """
+    Swaps a ListView's page-number pagination for keyset pagination on the view's ``ordering``.
+
+    The template receives ``page_obj.next_cursor``, to be passed back in the ``cursor_kwarg`` query parameter.
+    """
+    cursor_kwarg = 'after'
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, self.get_ordering(), page_size)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404("Invalid page cursor")
+
+        return paginator, page, page.object_list, page.has_next() or self.cursor_kwarg in self.request.GET
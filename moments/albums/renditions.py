@@ -0,0 +1,142 @@
+"""
+Fixed-size renditions of a photo, written next to the original upload.
+
+Every rendition is stored in each of ``RENDITION_FORMATS`` under
+``{upload dir}/{stem}.{size}.{ext}`` so a template can pick the smallest file
+that fits the box it is drawing instead of shipping the original.
+"""
+import base64
+import io
+import pathlib
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+# name: (bounding box, crop to fill the box)
+RENDITION_SIZES = {
+    'full': ((1920, 1920), False),
+    'medium': ((800, 800), False),
+    'card': ((320, 180), True),
+    'thumb': ((160, 160), True),
+}
+
+# name: (Pillow format, file extension)
+RENDITION_FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+
+RENDITION_EXTENSIONS = {ext for _, ext in RENDITION_FORMATS.values()}
+
+RENDITION_QUALITY = 80
+
+# The placeholder is a WebP this many pixels across at most, about 200 bytes as a data URI. Browsers smooth it when
+# scaling it up, which is all the blur it needs.
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 40
+
+
+def rendition_name(name, size, fmt):
+    path = pathlib.PurePosixPath(name)
+    ext = RENDITION_FORMATS[fmt][1]
+
+    return str(path.with_name(f"{path.stem}.{size}.{ext}"))
+
+
+def is_rendition(name):
+    """
+    Whether ``name`` is named as a rendition of some upload
+    """
+    parts = pathlib.PurePosixPath(name).name.split('.')
+    return len(parts) >= 3 and parts[-2] in RENDITION_SIZES and parts[-1] in RENDITION_EXTENSIONS
+
+
+def rendition_urls(storage, name, renditions):
+    """
+    ``{size: {format: url}}`` for the image stored as ``name``, falling back to the original until renditions exist
+    """
+    urls = {}
+    for size in RENDITION_SIZES:
+        names = renditions.get(size)
+        if names:
+            urls[size] = {fmt: storage.url(rendition) for fmt, rendition in names.items()}
+        else:
+            urls[size] = {'webp': None, 'jpeg': storage.url(name)}
+
+    return urls
+
+
+def open_image(image):
+    """
+    Decodes an image field file to an upright RGB image no larger than the biggest rendition
+    """
+    with image.open('rb'):
+        source = Image.open(image)
+        # JPEG can decode at 1/2, 1/4 or 1/8 scale for a fraction of the cost of a full decode
+        source.draft('RGB', max(box for box, _ in RENDITION_SIZES.values()))
+        source = ImageOps.exif_transpose(source)
+
+        return source.convert('RGB')
+
+
+def generate_renditions(image):
+    """
+    Writes every size and format of ``image`` to its storage and returns ``{size: {format: name}}``
+    """
+    storage = image.storage
+    names = {size: {fmt: rendition_name(image.name, size, fmt) for fmt in RENDITION_FORMATS}
+             for size in RENDITION_SIZES}
+
+    # In content-addressed storage a rendition's name identifies the original it was made from, so existing
+    # renditions of a duplicate upload can be reused as they are
+    if getattr(storage, 'content_addressed', False) and all(
+            storage.exists(name) for formats in names.values() for name in formats.values()):
+        return names
+
+    working = open_image(image)
+    renditions = {}
+
+    # Sizes run largest first so each one is resampled from the previous one rather than the original
+    for size, (box, crop) in RENDITION_SIZES.items():
+        if crop:
+            resized = ImageOps.fit(working, box, Image.LANCZOS)
+        else:
+            resized = working.copy()
+            resized.thumbnail(box, Image.LANCZOS)
+            working = resized
+
+        renditions[size] = {}
+        for fmt, (pil_format, _) in RENDITION_FORMATS.items():
+            buffer = io.BytesIO()
+            resized.save(buffer, pil_format, quality=RENDITION_QUALITY)
+
+            name = names[size][fmt]
+            if storage.exists(name):
+                storage.delete(name)
+            renditions[size][fmt] = storage.save(name, ContentFile(buffer.getvalue()))
+
+    return renditions
+
+
+def generate_placeholder(image):
+    """
+    A tiny ``data:`` URI of an image field file, for pages to paint while the image downloads
+    """
+    medium = rendition_name(image.name, 'medium', 'jpeg')
+    if image.storage.exists(medium):
+        # Already upright, and decoding it at 1/8 scale reads little more than the file
+        with image.storage.open(medium) as file:
+            source = Image.open(file)
+            source.draft('RGB', (PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+            source = source.convert('RGB')
+    else:
+        source = open_image(image)
+
+    # reduce() averages whole blocks of pixels at once, then the box filter takes the rest of the way
+    factor = max(1, min(source.size) // (PLACEHOLDER_SIZE * 2))
+    small = source.reduce(factor)
+    small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.BOX)
+
+    buffer = io.BytesIO()
+    small.save(buffer, 'WEBP', quality=PLACEHOLDER_QUALITY)
+    return f"data:image/webp;base64,{base64.b64encode(buffer.getvalue()).decode()}"
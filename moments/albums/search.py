@@ -0,0 +1,203 @@
+"""
+Ranked search over album names, owner usernames and photo titles.
+
+On PostgreSQL with the pg_trgm extension a query matches when it is similar to some run of words in the searched
+column (word similarity), so partial words and small typos match too. The GIN trigram indexes created by migration 0009
+serve these conditions, so a search reads only the index entries sharing trigrams with the query rather than every row.
+
+Without pg_trgm, that migration indexes the columns' ``to_tsvector('simple', ...)`` instead, and each word of the query
+must start a word of the column. Install the extension before migrating, or migrate ``albums`` back to 0008 and
+forward again once it is installed. On SQLite the same prefix matching uses the migration's FTS5 tables, ranked with
+bm25.
+
+Results are ranked, so they are paginated with LIMIT/OFFSET rather than keysets, up to ``MAX_PAGES``.
+"""
+import functools
+import re
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Func, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Album, Photo
+
+MIN_QUERY_LENGTH = 2
+MAX_QUERY_LENGTH = 100
+MAX_PAGES = 20
+
+
+class WordSimilar(Func):
+    """
+    ``expression %> string``, the condition a GIN trigram index on ``expression`` serves
+    """
+    arg_joiner = ' %%> '
+    template = '%(expressions)s'
+    output_field = BooleanField()
+
+    def __init__(self, expression, string):
+        super().__init__(expression, Value(string))
+
+
+class WordSimilarity(Func):
+    function = 'WORD_SIMILARITY'
+    output_field = FloatField()
+
+    def __init__(self, expression, string):
+        super().__init__(Value(string), expression)
+
+
+class TextMatch(Func):
+    """
+    ``to_tsvector('simple', expression) @@ to_tsquery('simple', query)``, served by a GIN index on the vector
+    """
+    template = "to_tsvector('simple', %(expressions)s) @@ to_tsquery('simple', %%s)"
+    output_field = BooleanField()
+
+    def __init__(self, expression, query):
+        super().__init__(expression)
+        self.query = query
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = super().as_sql(compiler, connection, **extra_context)
+        return sql, [*params, self.query]
+
+
+class TextRank(Func):
+    template = "ts_rank(to_tsvector('simple', %(expressions)s), to_tsquery('simple', %%s))"
+    output_field = FloatField()
+
+    def __init__(self, expression, query):
+        super().__init__(expression)
+        self.query = query
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = super().as_sql(compiler, connection, **extra_context)
+        return sql, [*params, self.query]
+
+
+@functools.lru_cache(maxsize=None)
+def has_trigram():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def terms(query):
+    # Only word characters, which need no quoting in either tsquery or FTS5 syntax
+    return re.findall(r'\w+', query)
+
+
+def operators(query):
+    """
+    PostgreSQL's match and rank expressions for ``query``, and the argument they take
+    """
+    if has_trigram():
+        return WordSimilar, WordSimilarity, query
+    return TextMatch, TextRank, ' & '.join(f'{term}:*' for term in terms(query))
+
+
+def fts_match(query):
+    """
+    An FTS5 query for rows with a word starting with each term of ``query``
+    """
+    return ' '.join(f'"{term}"*' for term in terms(query))
+
+
+def fts_rank(table, rowid, query):
+    # bm25() is lower for better matches
+    return Coalesce(RawSQL(f"SELECT -bm25({table}) FROM {table} WHERE {table} MATCH %s AND rowid = {rowid}",
+                           [fts_match(query)], output_field=FloatField()), 0.0)
+
+
+def fts_rowids(table, query):
+    return RawSQL(f"SELECT rowid FROM {table} WHERE {table} MATCH %s", [fts_match(query)])
+
+
+def visible(user, album='album__'):
+    """
+    The album page's rule: public albums are visible to everyone, private ones only to their owner
+    """
+    condition = Q(**{f'{album}public': True})
+    if user.is_authenticated:
+        condition |= Q(**{f'{album}owner': user})
+
+    return condition
+
+
+def search_albums(query, user):
+    """
+    Albums visible to ``user`` whose name or owner's username matches ``query``, best first
+    """
+    albums = Album.objects.filter(visible(user, album='')).select_related('owner')
+    if not terms(query):
+        return albums.none()
+
+    if connection.vendor == 'postgresql':
+        match, rank, argument = operators(query)
+        owners = User.objects.filter(match('username', argument)).values('pk')
+        albums = albums.filter(Q(match('name', argument)) | Q(owner__in=owners)).annotate(
+            rank=Greatest(rank('name', argument), rank('owner__username', argument)))
+    else:
+        owners = fts_rowids('albums_user_search', query)
+        albums = albums.filter(Q(pk__in=fts_rowids('albums_album_search', query)) | Q(owner__in=owners)).annotate(
+            rank=Greatest(fts_rank('albums_album_search', 'albums_album.id', query),
+                          fts_rank('albums_user_search', 'albums_album.owner_id', query)))
+
+    return albums.order_by('-rank', '-id')
+
+
+def search_photos(query, user):
+    """
+    Photos in albums visible to ``user`` whose title matches ``query``, best first
+    """
+    photos = Photo.objects.filter(visible(user)).select_related('album__owner')
+    if not terms(query):
+        return photos.none()
+
+    if connection.vendor == 'postgresql':
+        match, rank, argument = operators(query)
+        photos = photos.filter(match('title', argument)).annotate(rank=rank('title', argument))
+    else:
+        photos = photos.filter(pk__in=fts_rowids('albums_photo_search', query)).annotate(
+            rank=fts_rank('albums_photo_search', 'albums_photo.id', query))
+
+    return photos.order_by('-rank', '-id')
+
+
+class SearchPage:
+
+    def __init__(self, object_list, number, has_next):
+        self.object_list = object_list
+        self.number = number
+        self._has_next = has_next
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self.number > 1
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+
+def page(results, number, per_page):
+    """
+    Page ``number`` (from 1) of ``results``, without counting them
+    """
+    offset = (number - 1) * per_page
+    # One extra row tells us whether there is a next page
+    rows = list(results[offset:offset + per_page + 1])
+
+    return SearchPage(rows[:per_page], number, len(rows) > per_page and number < MAX_PAGES)
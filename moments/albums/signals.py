@@ -0,0 +1,151 @@
+import collections
+import threading
+import weakref
+
+from django.db.models import F, IntegerField, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import blobs, metadata
+from .models import Album, Photo
+from .renditions import generate_renditions
+
+
+class Deletions(threading.local):
+    """
+    The albums and photos being deleted by this thread, from their pre_delete to their post_delete signal. A deletion
+    sends every pre_delete signal before deleting anything. References are weak, so that whatever a failed deletion
+    leaves here goes away with its instances.
+    """
+
+    def __init__(self):
+        self.albums = weakref.WeakValueDictionary()
+        self.photos = collections.defaultdict(weakref.WeakSet)
+
+
+deletions = Deletions()
+
+
+@receiver(post_save, sender=Photo)
+def update_renditions(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    if not instance.image:
+        renditions = {}
+    elif instance.has_current_renditions:
+        return
+    else:
+        renditions = generate_renditions(instance.image)
+
+    if renditions != instance.renditions:
+        instance.renditions = renditions
+        # Update rather than save so the signal does not fire again
+        Photo.objects.filter(pk=instance.pk).update(renditions=renditions)
+
+
+@receiver(pre_save, sender=Photo)
+def remember_previous_values(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or instance._state.adding:
+        return
+
+    if update_fields is not None and not {'album', 'album_id', 'image'}.intersection(update_fields):
+        # Neither is written, so neither changes
+        instance._previous_album_id, instance._previous_image = instance.album_id, instance.image.name
+        return
+
+    previous = Photo.objects.filter(pk=instance.pk).values_list('album_id', 'image').first()
+    if previous is not None:
+        instance._previous_album_id, instance._previous_image = previous
+
+
+@receiver(post_save, sender=Photo)
+def add_photo_to_album_stats(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+
+    if created:
+        # A new photo always has the highest id, so it only becomes the cover of an empty album
+        if instance.album_id is None:
+            return
+        Album.objects.filter(pk=instance.album_id).update(
+            cover_photo=Coalesce(F('cover_photo'), Value(instance.pk), output_field=IntegerField()),
+            photo_count=F('photo_count') + 1,
+            last_photo_added=instance.created,
+        )
+        return
+
+    previous_album_id = getattr(instance, '_previous_album_id', instance.album_id)
+    if previous_album_id != instance.album_id:
+        Album.objects.filter(pk__in=[previous_album_id, instance.album_id]).refresh_photo_stats()
+
+
+@receiver(pre_delete, sender=Album)
+def remember_deleted_album(sender, instance, **kwargs):
+    deletions.albums[instance.pk] = instance
+
+
+@receiver(post_delete, sender=Album)
+def forget_deleted_album(sender, instance, **kwargs):
+    # Its photos may be deleted after it, and forget it themselves
+    if not deletions.photos.get(instance.pk):
+        deletions.albums.pop(instance.pk, None)
+
+
+@receiver(pre_delete, sender=Photo)
+def remember_deleted_photo(sender, instance, **kwargs):
+    if instance.album_id is not None:
+        deletions.photos[instance.album_id].add(instance)
+
+
+@receiver(post_delete, sender=Photo)
+def remove_photo_from_album_stats(sender, instance, **kwargs):
+    if instance.album_id is None:
+        return
+
+    pending = deletions.photos.get(instance.album_id)
+    if pending is not None:
+        pending.discard(instance)
+        if pending:
+            # Refreshed once, after the last of the album's photos in this deletion
+            return
+        del deletions.photos[instance.album_id]
+
+    # An album deleted along with its photos needs no stats
+    if deletions.albums.pop(instance.album_id, None) is None:
+        Album.objects.filter(pk=instance.album_id).refresh_photo_stats()
+
+
+@receiver(post_save, sender=Photo)
+def update_blob_references(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+
+    previous_image = None if created else getattr(instance, '_previous_image', instance.image.name)
+    if previous_image != instance.image.name:
+        blobs.acquire(instance.image.name, instance.image.storage)
+        blobs.release(previous_image, instance.image.storage)
+
+
+@receiver(post_delete, sender=Photo)
+def release_blob(sender, instance, **kwargs):
+    blobs.release(instance.image.name, instance.image.storage)
+
+
+@receiver(post_save, sender=Photo)
+def update_metadata(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+
+    previous_image = None if created else getattr(instance, '_previous_image', instance.image.name)
+    if previous_image == instance.image.name:
+        return
+
+    if not created:
+        # Whatever was read from the previous image no longer applies
+        Photo.objects.filter(pk=instance.pk).update(**metadata.EMPTY)
+        for name, value in metadata.EMPTY.items():
+            setattr(instance, name, value)
+    if instance.image:
+        metadata.schedule(instance.pk)
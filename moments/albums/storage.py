@@ -0,0 +1,164 @@
+"""
+Content-addressed photo storage.
+
+Uploads are hashed while they are copied to disk and stored once under ``blobs/{aa}/{bb}/{sha256}{ext}``, so the same
+file uploaded to several albums takes the space of one. ``albums.models.Blob`` counts the photos referencing each
+blob; the blob and its renditions are deleted when the count drops to zero.
+
+Inside ``staged_writes()`` files are saved as temporary files instead, and only moved to their names once the
+transaction commits, so a rolled back upload leaves no files behind. Until then the storage reads staged files from
+their temporary copies, so renditions and sizes can still be taken from them within the transaction.
+"""
+import contextlib
+import hashlib
+import os
+import pathlib
+import re
+import tempfile
+import threading
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils.deconstruct import deconstructible
+
+from .renditions import is_rendition
+
+BLOB_DIR = 'blobs'
+BLOB_NAME = re.compile(rf'^{BLOB_DIR}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/(?P<digest>[0-9a-f]{{64}})(?P<suffix>\.[^/]*)?$')
+
+# Different spellings of an extension would otherwise store the same content twice
+EXTENSION_ALIASES = {
+    '.jpeg': '.jpg',
+    '.jpe': '.jpg',
+    '.tif': '.tiff',
+}
+
+
+def blob_name(digest, ext):
+    ext = ext.lower()
+    return f"{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{EXTENSION_ALIASES.get(ext, ext)}"
+
+
+_local = threading.local()
+
+
+def staged():
+    """
+    ``{path: temporary path}`` of the files staged by the ``staged_writes()`` block this thread is in, or None
+    """
+    return getattr(_local, 'staged', None)
+
+
+@contextlib.contextmanager
+def staged_writes(using=None):
+    """
+    A ``transaction.atomic()`` block whose saves to content-addressed storage are published when it commits.
+
+    Files saved within the block are moved to their names once the transaction commits, and deleted if the block
+    raises. A nested block joins the outermost one. Within an enclosing transaction that rolls back after the block,
+    they are left behind as ``*.tmp`` files.
+    """
+    if staged() is not None:
+        with transaction.atomic(using=using):
+            yield
+        return
+
+    files = _local.staged = {}
+    try:
+        with transaction.atomic(using=using):
+            # Registered first, so that the files are in place for the transaction's other callbacks
+            transaction.on_commit(lambda: publish(files), using=using)
+            yield
+    except BaseException:
+        discard(files)
+        raise
+    finally:
+        _local.staged = None
+
+
+def publish(files):
+    # Emptied as it goes, so that reads find the published files
+    while files:
+        path, temp_path = files.popitem()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+
+
+def discard(files):
+    for temp_path in files.values():
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+
+
+def blob_digest(name):
+    """
+    The digest of the blob that ``name`` is, or is a rendition of, or None for names outside the blob store
+    """
+    match = BLOB_NAME.match(name or '')
+    return match['digest'] if match else None
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    content_addressed = True
+
+    def get_available_name(self, name, max_length=None):
+        # Names under the blob store identify their content, so an existing file is the same file
+        return name
+
+    def path(self, name):
+        path = super().path(name)
+        files = staged()
+        return files.get(path, path) if files else path
+
+    def _save(self, name, content):
+        if blob_digest(name) or is_rendition(name):
+            # Renditions are named after their original, in or outside the blob store, and replace any previous copy
+            temp_path, _ = self._write_temp(content)
+        else:
+            temp_path, digest = self._write_temp(content)
+            name = blob_name(digest, pathlib.PurePosixPath(name).suffix)
+            if self.exists(name):
+                os.remove(temp_path)
+                return name
+
+        # mkstemp() creates files readable by their owner only
+        os.chmod(temp_path, self.file_permissions_mode or 0o644)
+        full_path = super().path(name)
+        files = staged()
+        if files is not None:
+            previous = files.get(full_path)
+            files[full_path] = temp_path
+            if previous is not None:
+                os.remove(previous)
+            return name
+
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        os.replace(temp_path, full_path)
+
+        return name
+
+    def delete(self, name):
+        files = staged()
+        temp_path = files.pop(super().path(name), None) if files else None
+        if temp_path is not None:
+            os.remove(temp_path)
+        super().delete(name)
+
+    def _write_temp(self, content):
+        """
+        Copies ``content`` to a temporary file inside the blob store, hashing it on the way
+        """
+        os.makedirs(self.path(BLOB_DIR), exist_ok=True)
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.path(BLOB_DIR), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp.write(chunk)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        return temp_path, digest.hexdigest()
@@ -1,11 +1,44 @@
-from django.contrib.auth.models import User
-from django.db import IntegrityError
+import base64
+import contextlib
+import hashlib
+import io
+import itertools
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.template.defaultfilters import filesizeformat
+from django.db import IntegrityError, connection
 from django.db.utils import DataError
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+
+from PIL import Image
 
+from jobs.models import Job
+from . import blobs, media, metadata, search
 from .forms import total_photo_fields
-from .models import Album
+from .models import Album, Blob, Photo
+from .renditions import RENDITION_FORMATS, RENDITION_SIZES, rendition_name
+from .storage import blob_digest, blob_name, staged_writes
+from .views import AlbumPublicListView
+
+TEST_MEDIA_ROOT = os.path.join(tempfile.gettempdir(), 'moments-test-media')
 
 
 class AlbumModelTestCase(TestCase):
@@ -55,6 +88,694 @@ class AlbumModelTestCase(TestCase):
         self.assertListEqual(expected_owners, actual_owners)
 
 
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class PhotoRenditionTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user("test_user")
+        cls.album = Album.objects.create(owner=cls.user, name="test_album")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def create_photo(self, title="Tuckie"):
+        image = SimpleUploadedFile(name='test_image.jpg', content=open('profiles/data/tuckie.jpg', 'rb').read(),
+                                   content_type='image/jpeg')
+        return Photo.objects.create(title=title, album=self.album, image=image)
+
+    def test_renditions_generated_on_save(self):
+        photo = self.create_photo()
+        photo.refresh_from_db()
+
+        self.assertTrue(photo.has_current_renditions)
+        for size, (box, crop) in RENDITION_SIZES.items():
+            for fmt in RENDITION_FORMATS:
+                name = photo.renditions[size][fmt]
+                self.assertTrue(photo.image.storage.exists(name))
+                with Image.open(photo.image.storage.path(name)) as rendition:
+                    if crop:
+                        self.assertEqual(box, rendition.size)
+                    else:
+                        self.assertLessEqual(max(rendition.size), max(box))
+
+    def test_rendition_urls_fall_back_to_original(self):
+        photo = self.create_photo(title="No renditions")
+        photo.renditions = {}
+
+        self.assertEqual(photo.image.url, photo.rendition_urls['card']['jpeg'])
+        self.assertIsNone(photo.rendition_urls['card']['webp'])
+
+    def test_no_renditions_without_image(self):
+        photo = Photo.objects.create(title="Empty", album=self.album)
+        self.assertDictEqual({}, photo.renditions)
+        self.assertDictEqual({}, photo.rendition_urls)
+
+
+image_colors = ((i % 256, i // 256 % 256, i // 65536) for i in itertools.count(0, 997))
+
+
+@contextlib.contextmanager
+def spawned_workers():
+    """
+    Starts child processes as on macOS and Windows, without the parent's setup
+    """
+    start_method = multiprocessing.get_start_method()
+    multiprocessing.set_start_method('spawn', force=True)
+    try:
+        yield
+    finally:
+        multiprocessing.set_start_method(start_method, force=True)
+
+
+def make_image(name='test_image.jpg', size=(32, 32), exif=None):
+    # Photos are stored by content, so every generated image needs to be different
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color=next(image_colors)).save(buffer, 'JPEG', exif=exif or Image.Exif())
+    return SimpleUploadedFile(name=name, content=buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class AlbumPhotoStatsTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user("test_user")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self) -> None:
+        self.album = Album.objects.create(owner=self.user, name="test_album")
+
+    def assertStats(self, album, cover_photo, photo_count, last_photo_added):
+        album.refresh_from_db()
+        self.assertEqual(cover_photo, album.cover_photo)
+        self.assertEqual(photo_count, album.photo_count)
+        self.assertEqual(last_photo_added, album.last_photo_added)
+
+    def test_empty_album(self):
+        self.assertStats(self.album, None, 0, None)
+
+    def test_add_photos(self):
+        first = Photo.objects.create(title="first", album=self.album, image=make_image())
+        second = Photo.objects.create(title="second", album=self.album, image=make_image())
+        self.assertStats(self.album, first, 2, second.created)
+
+    def test_delete_cover_photo(self):
+        first = Photo.objects.create(title="first", album=self.album, image=make_image())
+        second = Photo.objects.create(title="second", album=self.album, image=make_image())
+        first.delete()
+        self.assertStats(self.album, second, 1, second.created)
+
+        second.delete()
+        self.assertStats(self.album, None, 0, None)
+
+    def refreshes(self, queries):
+        return [query['sql'] for query in queries
+                if query['sql'].startswith('UPDATE "albums_album"') and '"photo_count"' in query['sql']]
+
+    def test_delete_photos_refreshes_once_per_album(self):
+        other_album = Album.objects.create(owner=self.user, name="other_album")
+        for index in range(3):
+            Photo.objects.create(title=f"photo {index}", album=self.album, image=make_image())
+            Photo.objects.create(title=f"photo {index}", album=other_album, image=make_image())
+        kept = Photo.objects.create(title="kept", album=self.album, image=make_image())
+
+        with CaptureQueriesContext(connection) as queries:
+            Photo.objects.exclude(pk=kept.pk).delete()
+
+        self.assertEqual(2, len(self.refreshes(queries)))
+        self.assertStats(self.album, kept, 1, kept.created)
+        self.assertStats(other_album, None, 0, None)
+
+    def test_delete_album_skips_refresh(self):
+        for index in range(3):
+            Photo.objects.create(title=f"photo {index}", album=self.album, image=make_image())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.album.delete()
+
+        self.assertEqual([], self.refreshes(queries))
+        self.assertFalse(Photo.objects.exists())
+
+        # Photos deleted on their own afterwards still refresh their album
+        album = Album.objects.create(owner=self.user, name="next_album")
+        Photo.objects.create(title="only", album=album, image=make_image()).delete()
+        self.assertStats(album, None, 0, None)
+
+    def test_move_photo(self):
+        other_album = Album.objects.create(owner=self.user, name="other_album")
+        photo = Photo.objects.create(title="moved", album=self.album, image=make_image())
+        photo.album = other_album
+        photo.save()
+
+        self.assertStats(self.album, None, 0, None)
+        self.assertStats(other_album, photo, 1, photo.created)
+
+    def test_save_other_fields(self):
+        photo = Photo.objects.create(title="renamed", album=self.album, image=make_image())
+        photo.title = "renamed again"
+
+        # Neither the album nor the image is written, so their previous values are not looked up
+        with self.assertNumQueries(1):
+            photo.save(update_fields=['title'])
+        self.assertStats(self.album, photo, 1, photo.created)
+
+    def test_rebuild_album_stats(self):
+        first = Photo.objects.create(title="first", album=self.album, image=make_image())
+        second = Photo.objects.create(title="second", album=self.album, image=make_image())
+        Album.objects.update(cover_photo=None, photo_count=0, last_photo_added=None)
+
+        call_command('rebuild_album_stats', stdout=open(os.devnull, 'w'))
+        self.assertStats(self.album, first, 2, second.created)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class BlobStorageTestCase(TransactionTestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("test_user")
+        self.albums = [Album.objects.create(owner=self.user, name=f"album_{i}") for i in range(3)]
+        self.content = open('profiles/data/tuckie.jpg', 'rb').read()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def create_photo(self, album, title="Tuckie"):
+        image = SimpleUploadedFile(name='tuckie.jpeg', content=self.content, content_type='image/jpeg')
+        return Photo.objects.create(title=title, album=album, image=image)
+
+    def test_duplicates_stored_once(self):
+        photos = [self.create_photo(album) for album in self.albums]
+
+        digest = hashlib.sha256(self.content).hexdigest()
+        self.assertEqual(1, len({photo.image.name for photo in photos}))
+        self.assertEqual(blob_name(digest, '.jpg'), photos[0].image.name)
+        self.assertEqual(3, Blob.objects.get(digest=digest).references)
+
+    def test_blob_deleted_with_last_reference(self):
+        photos = [self.create_photo(album) for album in self.albums[:2]]
+        storage = photos[0].image.storage
+        name = photos[0].image.name
+        card = Photo.objects.get(pk=photos[0].pk).renditions['card']['jpeg']
+
+        photos[0].delete()
+        self.assertEqual(1, Blob.objects.get(digest=blob_digest(name)).references)
+        self.assertTrue(storage.exists(name))
+
+        photos[1].delete()
+        self.assertFalse(Blob.objects.filter(digest=blob_digest(name)).exists())
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(storage.exists(card))
+
+    def test_files_kept_for_reuse(self):
+        photo = self.create_photo(self.albums[0])
+        name, storage = photo.image.name, photo.image.storage
+
+        # Another photo has recorded the blob again by the time the deletion of the last one runs
+        blobs.delete_files(blob_digest(name), name, storage)
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(1, Blob.objects.get().references)
+
+    def test_reuse_after_deletion_fails(self):
+        photo = self.create_photo(self.albums[0])
+        name, storage = photo.image.name, photo.image.storage
+        Blob.objects.all().delete()
+
+        blobs.delete_files(blob_digest(name), name, storage)
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(Blob.objects.exists())
+        # An upload that found the file before it was deleted cannot record it
+        with self.assertRaises(FileNotFoundError):
+            blobs.acquire(name, storage)
+
+    @skipUnless(connection.vendor == 'postgresql', "Needs inserts that wait for a conflicting uncommitted row")
+    def test_reuse_during_deletion_fails(self):
+        photo = self.create_photo(self.albums[0])
+        name, storage = photo.image.name, photo.image.storage
+        Blob.objects.all().delete()
+        claimed = threading.Event()
+        delete = storage.delete
+
+        def delete_once_acquire_waits(name):
+            # Runs with the digest claimed; deletes once the upload's insert waits for the claim
+            claimed.set()
+            with connection.cursor() as cursor:
+                for _ in range(500):
+                    cursor.execute("SELECT 1 FROM pg_locks WHERE NOT granted")
+                    if cursor.fetchone():
+                        break
+                    time.sleep(0.01)
+            delete(name)
+
+        def delete_files():
+            try:
+                blobs.delete_files(blob_digest(name), name, storage)
+            finally:
+                connection.close()
+
+        with mock.patch.object(storage, 'delete', delete_once_acquire_waits):
+            deletion = threading.Thread(target=delete_files)
+            deletion.start()
+            try:
+                self.assertTrue(claimed.wait(5))
+                # The file is still there when the upload reads its size, but gone once its row can be inserted
+                with self.assertRaises(FileNotFoundError):
+                    blobs.acquire(name, storage)
+            finally:
+                deletion.join()
+
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(Blob.objects.exists())
+
+    def test_convert_to_blobs(self):
+        legacy_storage = FileSystemStorage()
+        names = [legacy_storage.save(f"{self.user.username}/albums/{album.name}/Tuckie.jpg", ContentFile(self.content))
+                 for album in self.albums[:2]]
+        Photo.objects.bulk_create(Photo(title="Tuckie", album=album, image=name)
+                                  for album, name in zip(self.albums, names))
+
+        call_command('convert_to_blobs', stdout=open(os.devnull, 'w'))
+
+        digest = hashlib.sha256(self.content).hexdigest()
+        for photo in Photo.objects.all():
+            self.assertEqual(blob_name(digest, '.jpg'), photo.image.name)
+            self.assertTrue(photo.has_current_renditions)
+        self.assertEqual(2, Blob.objects.get(digest=digest).references)
+        for name in names:
+            self.assertFalse(legacy_storage.exists(name))
+
+    def test_renditions_of_legacy_upload(self):
+        name = FileSystemStorage().save(f"{self.user.username}/albums/old.jpg", ContentFile(self.content))
+        photo = Photo.objects.create(title="old", album=self.albums[0], image=name)
+
+        renditions = Photo.objects.get(pk=photo.pk).renditions
+        self.assertEqual(rendition_name(name, 'card', 'jpeg'), renditions['card']['jpeg'])
+        self.assertTrue(photo.image.storage.exists(renditions['card']['jpeg']))
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, JOBS_EAGER=True)
+class PhotoMetadataTestCase(TransactionTestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("test_user")
+        self.album = Album.objects.create(owner=self.user, name="test_album")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def make_photo_image(self):
+        exif = Image.Exif()
+        exif[metadata.ORIENTATION] = 6
+        exif.get_ifd(metadata.EXIF_IFD).update({metadata.DATE_TIME_ORIGINAL: "2020:07:14 18:30:05",
+                                                metadata.OFFSET_TIME_ORIGINAL: "+02:00"})
+        return make_image(size=(40, 30), exif=exif)
+
+    def assertMetadata(self, photo):
+        photo.refresh_from_db()
+        self.assertEqual((30, 40), (photo.width, photo.height))
+        self.assertEqual(photo.image.size, photo.byte_size)
+        self.assertEqual('image/jpeg', photo.mime_type)
+        self.assertEqual(6, photo.orientation)
+        self.assertEqual(datetime(2020, 7, 14, 16, 30, 5, tzinfo=timezone.utc), photo.taken_at)
+
+        prefix = 'data:image/webp;base64,'
+        self.assertTrue(photo.placeholder.startswith(prefix))
+        with Image.open(io.BytesIO(base64.b64decode(photo.placeholder[len(prefix):]))) as placeholder:
+            # Upright, like the renditions it is made from
+            self.assertEqual((12, 16), placeholder.size)
+
+    def test_read_after_commit(self):
+        photo = Photo.objects.create(title="Rotated", album=self.album, image=self.make_photo_image())
+        self.assertMetadata(photo)
+
+    @override_settings(JOBS_EAGER=False)
+    def test_read_in_background(self):
+        photo = Photo.objects.create(title="Rotated", album=self.album, image=self.make_photo_image())
+        photo.refresh_from_db()
+        self.assertIsNone(photo.width)
+
+        call_command('run_workers', burst=True, stdout=open(os.devnull, 'w'))
+        self.assertMetadata(photo)
+        self.assertFalse(Job.objects.exists())
+
+    def test_replaced_image_read_again(self):
+        photo = Photo.objects.create(title="Plain", album=self.album, image=make_image(size=(20, 10)))
+        photo.refresh_from_db()
+        self.assertIsNone(photo.taken_at)
+        self.assertEqual((20, 10), (photo.width, photo.height))
+
+        photo.image = self.make_photo_image()
+        photo.save()
+        self.assertMetadata(photo)
+
+    def test_unreadable_image(self):
+        Photo.objects.bulk_create([Photo(title="Broken", album=self.album, image='broken.jpg')])
+        metadata.extract_metadata.enqueue(Photo.objects.get().pk)
+
+        # Left for a retry, with the reason
+        job = Job.objects.get()
+        self.assertEqual(Job.QUEUED, job.status)
+        self.assertEqual(1, job.attempts)
+        self.assertIn('broken.jpg', job.last_error)
+        self.assertIsNone(Photo.objects.get().width)
+
+    def test_backfill(self):
+        photo = Photo.objects.create(title="Rotated", album=self.album, image=self.make_photo_image())
+        Photo.objects.update(**metadata.EMPTY)
+        # Shares the stored file of the first photo
+        Photo.objects.bulk_create([Photo(title="Copy", album=Album.objects.create(owner=self.user, name="copies"),
+                                         image=photo.image.name)])
+
+        for workers, spawn in ((0, False), (2, False), (2, True)):
+            with self.subTest(workers=workers, spawn=spawn):
+                with spawned_workers() if spawn else contextlib.nullcontext():
+                    call_command('backfill_photo_metadata', workers=workers, stdout=open(os.devnull, 'w'))
+                for photo in Photo.objects.all():
+                    self.assertMetadata(photo)
+                Photo.objects.update(**metadata.EMPTY)
+
+    def test_layout_in_album_page(self):
+        photo = Photo.objects.create(title="Rotated", album=self.album, image=self.make_photo_image())
+        photo.refresh_from_db()
+        response = Client().get(reverse('album-detail', args=[self.user.username, self.album.name]))
+        self.assertContains(response, 'width="30" height="40"')
+        self.assertContains(response, f"background-image: url('{photo.placeholder}')")
+
+    def test_placeholder_in_profile_page(self):
+        photo = Photo.objects.create(title="Cover", album=self.album, image=self.make_photo_image())
+        photo.refresh_from_db()
+        response = Client().get(reverse('user-detail', args=[self.user.username]))
+        self.assertContains(response, f"url('{photo.placeholder}')")
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class GcMediaTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("test_user")
+        self.album = Album.objects.create(owner=self.user, name="test_album")
+        self.photo = Photo.objects.create(title="kept", album=self.album, image=make_image())
+        self.storage = Photo._meta.get_field('image').storage
+
+        # A blob nothing references any more, and the files of a deleted album from before the blob store
+        self.orphan_blob = self.storage.save('orphan.jpg', make_image())
+        legacy = FileSystemStorage()
+        self.legacy = [legacy.save(f"{self.user.username}/albums/deleted/{name}", make_image())
+                       for name in ('Tuckie.jpg', 'Tuckie.card.jpg', 'Tuckie.thumb.webp')]
+        with open(self.storage.path('blobs/interrupted.tmp'), 'wb') as file:
+            file.write(b'partial')
+
+        # Old enough to collect
+        for directory, _, filenames in os.walk(settings.MEDIA_ROOT):
+            for filename in filenames:
+                os.utime(os.path.join(directory, filename), (0, 0))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def kept_files(self):
+        return [self.photo.image.name, *(name for formats in self.photo.renditions.values()
+                                         for name in formats.values())]
+
+    def gc(self, **options):
+        stdout = io.StringIO()
+        call_command('gc_media', stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_unused_files_deleted(self):
+        output = self.gc()
+
+        for name in self.kept_files():
+            self.assertTrue(self.storage.exists(name), name)
+        for name in [self.orphan_blob, *self.legacy, 'blobs/interrupted.tmp']:
+            self.assertFalse(self.storage.exists(name), name)
+        # Emptied directories go too
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, self.user.username, 'albums', 'deleted')))
+        self.assertIn("5 unused", output)
+
+    def test_dry_run(self):
+        reclaimable = sum(self.storage.size(name) for name in [self.orphan_blob, *self.legacy, 'blobs/interrupted.tmp'])
+
+        output = self.gc(dry_run=True)
+        self.assertIn(f"would reclaim {filesizeformat(reclaimable)}", output)
+        for name in [*self.kept_files(), self.orphan_blob, *self.legacy]:
+            self.assertTrue(self.storage.exists(name), name)
+
+    def test_recent_files_kept(self):
+        recent = self.storage.save('recent.jpg', make_image())
+
+        self.gc(min_age=1)
+        self.assertTrue(self.storage.exists(recent))
+        self.assertFalse(self.storage.exists(self.orphan_blob))
+
+    def test_renditions_of_missing_upload_kept(self):
+        # The photo still shows its renditions when its original is gone
+        os.remove(self.storage.path(self.photo.image.name))
+
+        self.gc()
+        for name in self.kept_files()[1:]:
+            self.assertTrue(self.storage.exists(name), name)
+
+    def test_reused_blob_kept(self):
+        Blob.objects.create(digest=blob_digest(self.orphan_blob), name=self.orphan_blob, size=1, references=1)
+
+        self.gc()
+        self.assertTrue(self.storage.exists(self.orphan_blob))
+
+    def test_recorded_renditions_kept(self):
+        # Renditions of an upload from before the blob store, saved under blob names of their own
+        renditions = {size: {fmt: self.storage.save(f'old.{fmt}', make_image(f'{size}.jpg', size=(8 + i, 8)))
+                             for fmt in RENDITION_FORMATS} for i, size in enumerate(RENDITION_SIZES)}
+        os.utime(self.storage.path(renditions['card']['jpeg']), (0, 0))
+        Photo.objects.bulk_create([Photo(title="old", album=self.album, image=f"{self.user.username}/albums/old.jpg",
+                                         renditions=renditions)])
+
+        self.gc()
+        for formats in renditions.values():
+            for name in formats.values():
+                self.assertTrue(self.storage.exists(name), name)
+        self.assertFalse(self.storage.exists(self.orphan_blob))
+
+    def test_batched_queries(self):
+        for i in range(20):
+            self.storage.save(f'orphan_{i}.jpg', make_image())
+
+        with self.assertNumQueries(3):
+            self.gc(batch_size=1000, min_age=0)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ImportPhotosTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user("test_user")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self) -> None:
+        self.source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source)
+        self.files = {
+            'beach.jpg': make_image().read(),
+            'Holiday/sunset.jpg': make_image().read(),
+            'Holiday/dunes.jpeg': make_image().read(),
+            'Holiday/2020/snow.jpg': make_image().read(),
+            'Holiday/broken.jpg': b'not an image',
+            'Holiday/notes.txt': b'not a photo either',
+        }
+        for name, content in self.files.items():
+            path = os.path.join(self.source, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(content)
+
+    def import_photos(self, source, **options):
+        call_command('import_photos', source, user=self.user.username, stdout=open(os.devnull, 'w'),
+                     stderr=open(os.devnull, 'w'), **options)
+
+    def assertImported(self):
+        albums = {album.name: album for album in Album.objects.filter(owner=self.user)}
+        self.assertSetEqual({'Library', 'Holiday', 'Holiday - 2020'}, set(albums))
+        self.assertSetEqual({'sunset', 'dunes'}, set(albums['Holiday'].photos.values_list('title', flat=True)))
+        self.assertEqual(2, albums['Holiday'].photo_count)
+        self.assertEqual(1, albums['Holiday - 2020'].photo_count)
+
+        beach = albums['Library'].photos.get()
+        self.assertEqual(beach, albums['Library'].cover_photo)
+        self.assertEqual(blob_name(hashlib.sha256(self.files['beach.jpg']).hexdigest(), '.jpg'), beach.image.name)
+        self.assertTrue(beach.has_current_renditions)
+        self.assertTrue(beach.image.storage.exists(beach.renditions['thumb']['webp']))
+        self.assertEqual(1, Blob.objects.get(digest=blob_digest(beach.image.name)).references)
+        self.assertEqual((32, 32, len(self.files['beach.jpg'])), (beach.width, beach.height, beach.byte_size))
+
+    def test_import_directory(self):
+        self.import_photos(self.source, album='Library', workers=2)
+        self.assertImported()
+        # Nested album names still make valid album URLs
+        self.assertEqual(200, self.client.get(reverse('user-detail', args=[self.user.username])).status_code)
+
+    def test_import_with_spawned_workers(self):
+        with spawned_workers():
+            self.import_photos(self.source, album='Library', workers=2)
+        self.assertImported()
+
+    def test_import_zip(self):
+        archive = os.path.join(self.source, 'Library.zip')
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            for name, content in self.files.items():
+                zip_file.writestr(name, content)
+
+        self.import_photos(archive, workers=0)
+        self.assertImported()
+
+    def test_same_image_under_two_titles(self):
+        with open(os.path.join(self.source, 'Holiday', 'sunset again.jpg'), 'wb') as file:
+            file.write(self.files['Holiday/sunset.jpg'])
+        self.import_photos(self.source, album='Library', workers=0)
+
+        holiday = Album.objects.get(owner=self.user, name='Holiday')
+        sunsets = holiday.photos.filter(title__in=['sunset', 'sunset again'])
+        self.assertEqual(2, sunsets.count())
+        self.assertEqual(1, len({photo.image.name for photo in sunsets}))
+        self.assertEqual(3, holiday.photo_count)
+        self.assertEqual(2, Blob.objects.get(digest=blob_digest(sunsets[0].image.name)).references)
+
+    def test_import_again_skips_existing_titles(self):
+        self.import_photos(self.source, album='Library', workers=0)
+        self.import_photos(self.source, album='Library', workers=0)
+
+        self.assertEqual(4, Photo.objects.filter(album__owner=self.user).count())
+        self.assertEqual(1, Album.objects.get(owner=self.user, name='Library').photo_count)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class MediaServingTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user("test_user")
+        cls.public_photo = Photo.objects.create(title="public", image=make_image(),
+                                                album=Album.objects.create(owner=cls.user, name="public"))
+        cls.private_photo = Photo.objects.create(title="private", image=make_image(),
+                                                 album=Album.objects.create(owner=cls.user, name="private",
+                                                                            public=False))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def get(self, name, **headers):
+        return self.client.get(reverse('media', args=[name]), **headers)
+
+    def content(self, name):
+        with self.public_photo.image.storage.open(name) as file:
+            return file.read()
+
+    @skipUnless(connection.vendor == 'postgresql', "The pattern operator class is PostgreSQL only")
+    def test_image_index_used(self):
+        legacy = f"{self.user.username}/albums/public/old.card.jpg"
+        for name in (self.public_photo.renditions['card']['jpeg'], legacy):
+            with CaptureQueriesContext(connection) as queries:
+                list(media.photos_for(name))
+            self.assertTrue(queries.captured_queries)
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                for query in queries.captured_queries:
+                    cursor.execute(f"EXPLAIN {query['sql']}")
+                    plan = '\n'.join(row[0] for row in cursor.fetchall())
+                    self.assertIn('photo_image_idx', plan, query['sql'])
+
+    def test_serve_public_photo(self):
+        name = self.public_photo.image.name
+        response = self.get(name)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.content(name), b''.join(response.streaming_content))
+        self.assertEqual('image/jpeg', response['Content-Type'])
+        self.assertEqual('bytes', response['Accept-Ranges'])
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_serve_rendition(self):
+        name = Photo.objects.get(pk=self.public_photo.pk).renditions['thumb']['webp']
+        response = self.get(name)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.content(name), b''.join(response.streaming_content))
+
+    def test_range_requests(self):
+        name = self.public_photo.image.name
+        content = self.content(name)
+
+        response = self.get(name, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(f"bytes 10-19/{len(content)}", response['Content-Range'])
+        self.assertEqual(content[10:20], b''.join(response.streaming_content))
+
+        response = self.get(name, HTTP_RANGE='bytes=-5')
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(content[-5:], b''.join(response.streaming_content))
+
+        response = self.get(name, HTTP_RANGE=f"bytes={len(content)}-")
+        self.assertEqual(416, response.status_code)
+        self.assertEqual(f"bytes */{len(content)}", response['Content-Range'])
+
+        response = self.get(name, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(200, response.status_code)
+
+    def test_conditional_request(self):
+        response = self.get(self.public_photo.image.name)
+        response = self.get(self.public_photo.image.name, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(304, response.status_code)
+
+    def test_private_photo(self):
+        name = self.private_photo.image.name
+        self.assertEqual(404, self.get(name).status_code)
+
+        self.client.force_login(User.objects.create_user("other_user"))
+        self.assertEqual(404, self.get(name).status_code)
+
+        self.client.force_login(self.user)
+        response = self.get(name)
+        self.assertEqual(200, response.status_code)
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_unknown_file(self):
+        self.assertEqual(404, self.get('blobs/00/00/missing.jpg').status_code)
+        self.assertEqual(404, self.get('../settings.py').status_code)
+
+    @override_settings(MEDIA_OFFLOAD='x-accel-redirect')
+    def test_x_accel_redirect(self):
+        name = self.private_photo.image.name
+        self.client.force_login(self.user)
+        response = self.get(name)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(f"/protected-media/{name}", response['X-Accel-Redirect'])
+        self.assertEqual(b'', response.content)
+
+    @override_settings(MEDIA_OFFLOAD='x-sendfile')
+    def test_x_sendfile(self):
+        name = self.public_photo.image.name
+        response = self.get(name)
+
+        self.assertEqual(self.public_photo.image.path, response['X-Sendfile'])
+
+
 class CreateAlbumViewTestCase(TestCase):
 
     @classmethod
@@ -113,6 +834,108 @@ class CreateAlbumViewTestCase(TestCase):
         self.assertIsNotNone(test_album)
 
 
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class CreateAlbumTransactionTestCase(TransactionTestCase):
+    # The files are only written once the transaction commits, which TestCase never does
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test_user")
+        self.client.force_login(self.user)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def post(self, name, *images, titles=()):
+        data = {
+            'name': name,
+            'public': 'on',
+            'photos-TOTAL_FORMS': total_photo_fields,
+            'photos-INITIAL_FORMS': 0,
+        }
+        for i, image in enumerate(images):
+            data[f'photos-{i}-title'] = titles[i] if titles else f"photo_{i}"
+            data[f'photos-{i}-image'] = image
+        return self.client.post(reverse('create-album'), data=data)
+
+    def stored_files(self):
+        return sorted(os.path.relpath(os.path.join(directory, filename), settings.MEDIA_ROOT)
+                      for directory, _, filenames in os.walk(settings.MEDIA_ROOT) for filename in filenames)
+
+    def test_files_written_on_commit(self):
+        response = self.post("album", make_image(), make_image())
+        self.assertEqual(f"/{self.user.username}/albums/album", response['Location'])
+
+        photos = Photo.objects.filter(album__name="album")
+        self.assertEqual(2, len(photos))
+        files = self.stored_files()
+        for photo in photos:
+            self.assertTrue(photo.has_current_renditions)
+            self.assertIn(photo.image.name, files)
+            self.assertTrue(set(photo.renditions['card'].values()) <= set(files))
+        self.assertFalse([name for name in files if name.endswith('.tmp')])
+
+    def test_duplicate_album(self):
+        Album.objects.create(owner=self.user, name="album")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post("album", make_image())
+        self.assertContains(response, "An album already exists for user")
+        self.assertFalse(any('SELECT 1 AS "a"' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(1, Album.objects.count())
+        self.assertEqual([], self.stored_files())
+
+    def test_same_image_twice(self):
+        image = make_image()
+        copy = SimpleUploadedFile(name='copy.jpg', content=image.read(), content_type='image/jpeg')
+        image.seek(0)
+
+        response = self.post("album", image, copy)
+        self.assertEqual(302, response.status_code)
+        photos = Photo.objects.filter(album__name="album")
+        self.assertEqual(2, photos.count())
+        self.assertEqual(1, len({photo.image.name for photo in photos}))
+        self.assertEqual(2, Blob.objects.get().references)
+
+    def test_duplicate_titles(self):
+        response = self.post("album", make_image(), make_image(), titles=["photo", "photo"])
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(Album.objects.exists())
+        self.assertEqual([], self.stored_files())
+
+    def test_failed_photo_rolls_back(self):
+        save = Photo.save
+
+        def save_once(photo, *args, **kwargs):
+            # As when a concurrent request saves a photo under the same title first
+            if Photo.objects.exists():
+                raise IntegrityError
+            return save(photo, *args, **kwargs)
+
+        with mock.patch.object(Photo, 'save', save_once):
+            response = self.post("album", make_image(), make_image())
+        self.assertContains(response, "Each photo of an album needs a title of its own")
+        self.assertFalse(Album.objects.exists())
+        self.assertFalse(Photo.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual([], self.stored_files())
+
+    def test_staged_writes(self):
+        storage = Photo._meta.get_field('image').storage
+        with staged_writes():
+            name = storage.save('photo.jpg', make_image())
+            # Readable under its name, but not written there yet
+            self.assertTrue(storage.exists(name))
+            self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, name)))
+        self.assertTrue(os.path.exists(os.path.join(settings.MEDIA_ROOT, name)))
+
+        with self.assertRaises(ValueError):
+            with staged_writes():
+                name = storage.save('photo.jpg', make_image())
+                raise ValueError
+        self.assertFalse(storage.exists(name))
+        self.assertFalse([name for name in self.stored_files() if name.endswith('.tmp')])
+
+
 class AlbumListTestCase(TestCase):
 
     def populate_albums(self):
@@ -151,6 +974,139 @@ class AlbumListTestCase(TestCase):
         self.assertQuerysetEqual(values=self.expected_albums, qs=response.context['album_list'])
 
 
+class AlbumListPaginationTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.client = Client()
+        cls.user = User.objects.create_user("test_user")
+        cls.album_page = reverse('album-list')
+        cls.page_size = AlbumPublicListView.paginate_by
+
+    def setUp(self) -> None:
+        # Enough albums for three pages, some sharing a timestamp so the id tie-breaker is exercised
+        created = timezone.now()
+        for i in range(self.page_size * 3):
+            album = Album.objects.create(owner=self.user, name=f"test_album_{i}", public=i % 7 != 0)
+            Album.objects.filter(pk=album.pk).update(created=created - timedelta(minutes=i // 3))
+        self.expected_albums = list(Album.objects.filter(public=True).order_by('-created', '-id'))
+
+    def get_all_pages(self):
+        albums, query_counts = [], []
+        url = self.album_page
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            query_counts.append(len(queries))
+            albums += response.context['album_list']
+
+            page = response.context['page_obj']
+            url = f"{self.album_page}?after={page.next_cursor}" if page.has_next() else None
+
+        return albums, query_counts
+
+    def test_pages_cover_all_public_albums_in_order(self):
+        albums, query_counts = self.get_all_pages()
+        self.assertListEqual(self.expected_albums, albums)
+        self.assertEqual(math.ceil(len(self.expected_albums) / self.page_size), len(query_counts))
+
+    def test_page_cost_constant(self):
+        _, query_counts = self.get_all_pages()
+        self.assertEqual(1, len(set(query_counts)))
+
+    def test_owner_joined(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.album_page)
+            for album in response.context['album_list']:
+                album.owner.username
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.album_page, data={'after': 'not-a-cursor'})
+        self.assertEqual(404, response.status_code)
+
+
+class SearchTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.client = Client()
+        cls.search_page = reverse('search')
+        cls.owner = User.objects.create_user("test_user")
+        cls.photographer = User.objects.create_user("sunset_chaser")
+        if connection.vendor == 'postgresql':
+            # Looked up once per process, outside the query counts below
+            search.has_trigram()
+        cls.sunset_beach = Album.objects.create(owner=cls.owner, name="Sunset beach")
+        cls.private = Album.objects.create(owner=cls.owner, name="Sunset private", public=False)
+        cls.beach = Album.objects.create(owner=cls.owner, name="Beach")
+        cls.chaser_album = Album.objects.create(owner=cls.photographer, name="Mountains")
+        Photo.objects.bulk_create([
+            Photo(album=cls.beach, title="Sunset over the pier", image="pier.jpg"),
+            Photo(album=cls.beach, title="Lighthouse", image="lighthouse.jpg"),
+            Photo(album=cls.private, title="Sunset from the balcony", image="balcony.jpg"),
+        ])
+
+    def test_album_names_and_owners(self):
+        albums = list(search.search_albums("sunset", AnonymousUser()))
+        self.assertSetEqual({self.sunset_beach, self.chaser_album}, set(albums))
+
+    def test_prefix(self):
+        self.assertIn(self.sunset_beach, search.search_albums("sunse", AnonymousUser()))
+
+    def test_best_match_first(self):
+        self.assertEqual(self.sunset_beach, search.search_albums("sunset beach", AnonymousUser())[0])
+
+    def test_private_albums_only_for_owner(self):
+        self.assertNotIn(self.private, search.search_albums("sunset", self.photographer))
+        self.assertIn(self.private, search.search_albums("sunset", self.owner))
+
+        photos = {photo.title for photo in search.search_photos("sunset", AnonymousUser())}
+        self.assertSetEqual({"Sunset over the pier"}, photos)
+        photos = {photo.title for photo in search.search_photos("sunset", self.owner)}
+        self.assertSetEqual({"Sunset over the pier", "Sunset from the balcony"}, photos)
+
+    def test_related_rows_joined(self):
+        with self.assertNumQueries(1):
+            for photo in search.search_photos("sunset", AnonymousUser()):
+                photo.album.owner.username
+
+    def test_pages(self):
+        results = search.search_albums("sunset", self.owner)
+        first, second = search.page(results, 1, 2), search.page(results, 2, 2)
+        self.assertTrue(first.has_next())
+        self.assertFalse(second.has_next())
+        self.assertListEqual(list(results), [*first, *second])
+
+    def test_search_page(self):
+        response = self.client.get(self.search_page, data={'q': "sunset", 'kind': 'photos'})
+        self.assertEqual(200, response.status_code)
+        self.assertListEqual(["Sunset over the pier"], [photo.title for photo in response.context['page_obj']])
+        self.assertContains(response, "Sunset over the pier")
+
+    def test_invalid_query(self):
+        response = self.client.get(self.search_page, data={'q': "s"})
+        self.assertEqual(200, response.status_code)
+        self.assertNotIn('page_obj', response.context)
+        self.assertTrue(response.context['form'].errors)
+
+    @skipUnless(connection.vendor == 'postgresql', "The GIN indexes are PostgreSQL only")
+    def test_index_used(self):
+        with CaptureQueriesContext(connection) as queries:
+            list(search.page(search.search_photos("sunset", self.owner), 1, 24))
+        self.assertEqual(1, len(queries.captured_queries))
+
+        # Left to itself, the planner may as well reach photos through their album in a table this small. With plain
+        # scans and nested loops off, the photos can only be read by a bitmap scan, which needs the title index.
+        with connection.cursor() as cursor:
+            for setting in ('enable_seqscan', 'enable_indexscan', 'enable_indexonlyscan', 'enable_nestloop'):
+                cursor.execute(f"SET LOCAL {setting} = off")
+            cursor.execute(f"EXPLAIN {queries.captured_queries[0]['sql']}")
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        self.assertIn('photo_title_trgm_idx' if search.has_trigram() else 'photo_title_tsv_idx', plan)
+
+
 class AlbumFormTestCase(TestCase):
     # TODO: Need tests for validators
     pass
@@ -1,8 +1,9 @@
 from django.urls import path
 
-from .views import CreateAlbum, AlbumPublicListView
+from .views import CreateAlbum, AlbumPublicListView, SearchView
 
 urlpatterns = [
     path('', AlbumPublicListView.as_view(), name='album-list'),
     path('new', CreateAlbum.as_view(), name='create-album'),
+    path('search', SearchView.as_view(), name='search'),
 ]
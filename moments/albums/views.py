@@ -1,10 +1,14 @@
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.shortcuts import render
+from django.db import IntegrityError
+from django.http import Http404, HttpResponseRedirect
 from django.urls import reverse
-from django.views.generic import edit, ListView
+from django.views.generic import edit, ListView, TemplateView
 
-from .forms import AlbumForm, AlbumPhotosFormSet
-from .models import Album
+from .forms import AlbumForm, AlbumPhotosFormSet, SearchForm
+from . import media
+from .models import Album, Photo
+from .pagination import KeysetPaginationMixin
+from .storage import staged_writes
 
 
 class CreateAlbum(LoginRequiredMixin, edit.CreateView):
@@ -16,10 +20,12 @@ class CreateAlbum(LoginRequiredMixin, edit.CreateView):
 
         data = super(CreateAlbum, self).get_context_data(**kwargs)
 
-        if self.request.POST:
-            data['photos'] = AlbumPhotosFormSet(self.request.POST, self.request.FILES)
-        else:
-            data['photos'] = AlbumPhotosFormSet()
+        # form_invalid() passes the formset it has already validated
+        if 'photos' not in data:
+            if self.request.POST:
+                data['photos'] = AlbumPhotosFormSet(self.request.POST, self.request.FILES)
+            else:
+                data['photos'] = AlbumPhotosFormSet()
 
         data['breadcrumbs'] = {
             'Home': reverse('Home'),
@@ -30,34 +36,38 @@ class CreateAlbum(LoginRequiredMixin, edit.CreateView):
 
     def form_valid(self, form):
         form.instance.owner = self.request.user
-        context = self.get_context_data()
-        photos = context['photos']
-
-        self.success_url = reverse('album-detail', args=[form.instance.owner, form.instance.name])
-
-        name = form.instance.name
-        owner = form.instance.owner
-        existing_album = Album.objects.filter(name=name, owner=owner).exists()
-        if existing_album:
-            form.add_error('name', f"An album already exists for user '{owner}' with name '{name}'")
-
-        if not form.errors:
-            self.object = form.save()
-
-            if photos.is_valid():
-                photos.instance = self.object
+        photos = AlbumPhotosFormSet(self.request.POST, self.request.FILES, instance=form.instance)
+        if not photos.is_valid():
+            return self.form_invalid(form, photos)
+
+        # One transaction, whose files are only written once it commits; the constraints catch duplicates
+        saving = 'album'
+        try:
+            with staged_writes():
+                self.object = form.save()
+                saving = 'photos'
                 photos.save()
-                return super().form_valid(form)
-
-        if not existing_album:
-            Album.objects.get(name=name).delete()
-
-        return render(self.request, self.template_name, {'form': form, 'photos': photos})
-
-
-class AlbumPublicListView(ListView):
-    queryset = Album.objects.filter(public=True).all()
-    ordering = '-created'
+        except IntegrityError:
+            if saving == 'album':
+                owner, name = form.instance.owner, form.instance.name
+                form.add_error('name', f"An album already exists for user '{owner}' with name '{name}'")
+            else:
+                form.add_error(None, "Each photo of an album needs a title of its own")
+            return self.form_invalid(form, photos)
+
+        return HttpResponseRedirect(reverse('album-detail', args=[self.object.owner, self.object.name]))
+
+    def form_invalid(self, form, photos=None):
+        context = {'form': form}
+        if photos is not None:
+            context['photos'] = photos
+        return self.render_to_response(self.get_context_data(**context))
+
+
+class AlbumPublicListView(KeysetPaginationMixin, ListView):
+    queryset = Album.objects.filter(public=True).select_related('owner')
+    ordering = ('-created', '-id')
+    paginate_by = 24
     allow_empty = True
 
     def get_context_data(self, *, object_list=None, **kwargs):
@@ -68,3 +78,35 @@ class AlbumPublicListView(ListView):
                 'All Albums': None
             }
         }
+
+
+class SearchView(TemplateView):
+    template_name = "albums/search.html"
+    paginate_by = 24
+
+    def get_context_data(self, **kwargs):
+        form = SearchForm(self.request.GET or None)
+        context = {
+            **super(SearchView, self).get_context_data(**kwargs),
+            'form': form,
+            'breadcrumbs': {
+                'Home': reverse('Home'),
+                'Search': None
+            }
+        }
+        if form.is_valid():
+            context['kind'] = form.cleaned_data['kind'] or 'albums'
+            context['page_obj'] = form.results(self.request.user, self.paginate_by)
+
+        return context
+
+
+def serve_media(request, path):
+    # Files the user may not see are indistinguishable from missing ones
+    albums_public = set(media.visible_photos(media.photos_for(path), request.user)
+                        .values_list('album__public', flat=True))
+    storage = Photo._meta.get_field('image').storage
+    if not albums_public or not storage.exists(path):
+        raise Http404("No such photo")
+
+    return media.serve(request, path, storage, public=True in albums_public)
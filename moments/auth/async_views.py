@@ -0,0 +1,33 @@
+"""
+Async entry points for the login and sign-up views, used when ``AUTH_ASYNC_VIEWS`` is on, as it is under
+``moments/asgi.py``.
+
+An ASGI server runs every sync view on a single shared thread, so each PBKDF2 password hash, tens of milliseconds of
+CPU, would hold up every other sync request of the process. These views run in the default thread pool instead, where
+hashlib releases the GIL while hashing, so concurrent logins use as many cores as the pool has threads.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+
+def respond(view, request, *args, **kwargs):
+    try:
+        return view(request, *args, **kwargs)
+    finally:
+        # Pool threads keep their own connections; release them as request_finished would
+        close_old_connections()
+
+
+def pooled_view(view):
+    """
+    Wraps a sync view in an async view that runs it on the thread pool
+    """
+    pooled = sync_to_async(respond, thread_sensitive=False)
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await pooled(view, request, *args, **kwargs)
+
+    return wrapper
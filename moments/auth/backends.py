@@ -0,0 +1,44 @@
+"""
+``CachedModelBackend`` keeps the users that requests are authenticated as in a short-lived cache.
+
+``AuthenticationMiddleware`` loads the user of each authenticated request with ``get_user()``; with the sessions
+cached too (``cached_db``), a repeat page view makes no authentication queries. Entries are deleted when a user is
+saved or deleted, which covers password changes, so the session hash check still logs out other sessions at once. The
+cache is normally per process (``USER_CACHE_ALIAS``), so other processes see a change when their entry expires after
+``USER_CACHE_TIMEOUT`` seconds; updates bypassing ``save()`` are seen then too.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+
+def get_cache():
+    return caches[getattr(settings, 'USER_CACHE_ALIAS', 'default')]
+
+
+def user_key(user_id):
+    return f"moments.user:{user_id}"
+
+
+class CachedModelBackend(ModelBackend):
+
+    def get_user(self, user_id):
+        cache = get_cache()
+        key = user_key(user_id)
+        # Cache backends store copies, so permissions cached on one request's user never reach another's
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, getattr(settings, 'USER_CACHE_TIMEOUT', 60))
+
+        return user
+
+
+@receiver(post_save, sender=User, dispatch_uid='invalidate_cached_user_on_save')
+@receiver(post_delete, sender=User, dispatch_uid='invalidate_cached_user_on_delete')
+def invalidate_cached_user(sender, instance, **kwargs):
+    get_cache().delete(user_key(instance.pk))
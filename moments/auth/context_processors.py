@@ -1,5 +1,9 @@
+from functools import partial
+
 from django.contrib.auth.forms import AuthenticationForm
 
 
 def get_login_form(request):
-    return dict(login_nav_form=AuthenticationForm(request))
+    # Templates call callables when they resolve them, so the form is only built where the navbar renders it, which
+    # is on anonymous pages whose navbar fragment is not cached yet
+    return dict(login_nav_form=partial(AuthenticationForm, request))
@@ -1,7 +1,18 @@
-from django.contrib.auth.models import User
-from django.test import TestCase, Client
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.contrib.auth.forms import AuthenticationForm
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache, caches
+from django.test import RequestFactory, TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
 
+from . import views
+from .async_views import pooled_view
+
 
 class HomeTestCase(TestCase):
     @classmethod
@@ -26,6 +37,34 @@ class HomeTestCase(TestCase):
             self.client.get(self.home_page)
 
 
+class NavbarLoginFormTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="test_user", password="test_password")
+        cls.page = reverse('album-list')
+
+    def setUp(self) -> None:
+        cache.clear()
+        patcher = mock.patch('auth.context_processors.AuthenticationForm', wraps=AuthenticationForm)
+        self.form_class = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_logged_in_does_not_build_form(self):
+        self.client.force_login(self.user)
+        self.client.get(self.page)
+        self.form_class.assert_not_called()
+
+    def test_anonymous_form_rendered_once(self):
+        for _ in range(2):
+            response = self.client.get(self.page)
+            self.assertContains(response, 'id="id_username"')
+            self.assertContains(response, 'name="csrfmiddlewaretoken"')
+
+        self.assertEqual(1, self.form_class.call_count)
+
+
 class UserSignUpTestCase(TestCase):
 
     @classmethod
@@ -193,3 +232,97 @@ class UserLoginTestCase(TestCase):
         with self.assertTemplateUsed(self.user_home_template):
             self.client.post(self.login_page, data=dict(username=self.username, password=self.password), follow=True)
             self.assertTemplateNotUsed(self.login_template)
+
+
+# As with a shared session cache configured
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db', CACHES={
+    **settings.CACHES,
+    'sessions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+class CachedAuthenticationTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.home_page = reverse('Home')
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test_user", password="test_password")
+        self.client.force_login(self.user)
+        # Loads the session and the user into their caches
+        self.client.get(self.home_page)
+
+    def test_no_authentication_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(self.home_page)
+        self.assertEqual(self.user, response.wsgi_request.user)
+
+    def test_password_change_logs_out(self):
+        self.user.set_password("new_password")
+        self.user.save()
+
+        response = self.client.get(self.home_page)
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
+
+    def test_deactivated_user_logged_out(self):
+        self.user.is_active = False
+        self.user.save()
+
+        response = self.client.get(self.home_page)
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
+
+    def test_logged_out_session_not_reused(self):
+        session_key = self.client.session.session_key
+        self.client.logout()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session_key
+
+        response = self.client.get(self.home_page)
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
+
+    def test_session_survives_cache_loss(self):
+        caches[settings.SESSION_CACHE_ALIAS].clear()
+        caches[settings.USER_CACHE_ALIAS].clear()
+
+        response = self.client.get(self.home_page)
+        self.assertEqual(self.user, response.wsgi_request.user)
+
+
+class PasswordHashingTestCase(TestCase):
+
+    def setUp(self) -> None:
+        patcher = mock.patch.object(hashers, 'pbkdf2', wraps=hashers.pbkdf2)
+        self.addCleanup(patcher.stop)
+        self.pbkdf2 = patcher.start()
+
+    def test_login_hashes_once(self):
+        User.objects.create_user(username="test_user", password="test_password")
+        self.pbkdf2.reset_mock()
+
+        response = self.client.post(reverse('login'), data=dict(username="test_user", password="test_password"))
+        self.assertEqual(302, response.status_code)
+        self.assertEqual(1, self.pbkdf2.call_count)
+
+    def test_failed_login_hashes_once(self):
+        self.client.post(reverse('login'), data=dict(username="nobody", password="test_password"))
+        self.assertEqual(1, self.pbkdf2.call_count)
+
+    def test_sign_up_hashes_once(self):
+        response = self.client.post(reverse('sign-up'), data=dict(
+            username="new_user", password1="Secret-Passw0rd", password2="Secret-Passw0rd"))
+        self.assertEqual(302, response.status_code)
+        self.assertEqual(1, self.pbkdf2.call_count)
+        self.assertEqual(str(User.objects.get().pk), self.client.session['_auth_user_id'])
+
+
+class PooledLoginTestCase(TransactionTestCase):
+    # The view runs on a pool thread with its own connection, so the user has to be committed
+
+    def test_login(self):
+        user = User.objects.create_user(username="test_user", password="test_password")
+        request = RequestFactory().post(reverse('login'), dict(username="test_user", password="test_password"))
+        request.session = SessionStore()
+        request.user = AnonymousUser()
+
+        response = async_to_sync(pooled_view(views.user_login))(request)
+        self.assertEqual(302, response.status_code)
+        self.assertEqual(str(user.pk), request.session['_auth_user_id'])
@@ -1,8 +1,14 @@
-from django.urls import path, include
+from django.conf import settings
+from django.urls import path
 
 from . import views
+from .async_views import pooled_view
+
+sign_up, user_login = views.sign_up, views.user_login
+if settings.AUTH_ASYNC_VIEWS:
+    sign_up, user_login = pooled_view(sign_up), pooled_view(user_login)
 
 urlpatterns = [
-    path('sign-up', views.sign_up, name='sign-up'),
-    path('login', views.user_login, name='login'),
-]
\ No newline at end of file
+    path('sign-up', sign_up, name='sign-up'),
+    path('login', user_login, name='login'),
+]
@@ -1,4 +1,4 @@
-from django.contrib.auth import authenticate, forms, login
+from django.contrib.auth import forms, login
 from django.contrib.auth.forms import AuthenticationForm
 from django.http import HttpResponseRedirect
 from django.shortcuts import render
@@ -12,13 +12,10 @@ def sign_up(request):
     elif request.method == 'POST':
         form = forms.UserCreationForm(request.POST)
         if form.is_valid():
-            form.save()
-            username = request.POST['username']
-            password = request.POST['password1']
-            user = authenticate(request, username=username, password=password)
-            if user is not None:
-                login(request, user)
-                return HttpResponseRedirect(reverse('Home'))
+            # Hashing the new password is the expensive part, so the user is logged in without checking it again
+            user = form.save()
+            login(request, user)
+            return HttpResponseRedirect(reverse('Home'))
     else:
         form = forms.UserCreationForm()
     context = {
@@ -41,15 +38,12 @@ def user_login(request):
 
     elif request.method == 'POST':
         form = AuthenticationForm(request=request, data=request.POST)
+        # The form authenticates the user, which checks the password hash once
         if form.is_valid():
-            username = form.cleaned_data.get('username')
-            password = form.cleaned_data.get('password')
-            user = authenticate(username=username, password=password)
-            if user is not None:
-                login(request, user)
-                if next_page is not None:
-                    redirect = next_page
-                return HttpResponseRedirect(redirect)
+            login(request, form.get_user())
+            if next_page is not None:
+                redirect = next_page
+            return HttpResponseRedirect(redirect)
 
     context = dict(login_form=form)
     if next_page:
@@ -0,0 +1,131 @@
+"""
+Throughput of the WSGI and ASGI applications under many concurrent slow clients.
+
+Both drivers call the application in-process, without a server or sockets. A WSGI server gives each request a thread
+until the client has read the whole response, so ``run_wsgi`` holds a worker thread for ``client_delay`` after each
+response. An ASGI server instead awaits the client while sending, so ``run_asgi`` sleeps in ``send``, which frees the
+event loop for other requests.
+"""
+import asyncio
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
+
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+
+from .runner import BenchmarkError, percentile
+
+HOST = 'localhost'
+
+
+def summarize(latencies, elapsed):
+    return {
+        'requests': len(latencies),
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_s': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+    }
+
+
+def run_wsgi(urls, requests, threads, client_delay):
+    application = get_wsgi_application()
+
+    def request(url):
+        url = urlsplit(url)
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            # WSGI and ASGI servers pass the path percent-decoded
+            'PATH_INFO': unquote(url.path),
+            'QUERY_STRING': url.query,
+            'SERVER_NAME': HOST,
+            'SERVER_PORT': '80',
+            'HTTP_HOST': HOST,
+            'HTTP_ACCEPT': 'application/json',
+            'REMOTE_ADDR': '127.0.0.1',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        status = []
+        started = time.perf_counter()
+        body = application(environ, lambda status_line, headers: status.append(status_line))
+        try:
+            for _ in body:
+                pass
+            # The worker thread is busy until a slow client has read the response
+            time.sleep(client_delay)
+        finally:
+            body.close()
+        if not status[0].startswith('200'):
+            raise BenchmarkError(f"GET {url.geturl()} returned {status[0]}")
+
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        latencies = list(executor.map(request, (urls[i % len(urls)] for i in range(requests))))
+
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def run_asgi(urls, requests, clients, client_delay):
+    application = get_asgi_application()
+
+    async def request(url, limit):
+        url = urlsplit(url)
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': unquote(url.path),
+            'raw_path': url.path.encode(),
+            'query_string': url.query.encode(),
+            'root_path': '',
+            'headers': [(b'host', HOST.encode()), (b'accept', b'application/json')],
+            'client': ('127.0.0.1', 0),
+            'server': (HOST, 80),
+        }
+        status = []
+        received = False
+
+        async def receive():
+            nonlocal received
+            if received:
+                # The client never disconnects
+                await asyncio.Event().wait()
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+            elif not message.get('more_body', False):
+                # The client reads the response slowly, but only this request waits for it
+                await asyncio.sleep(client_delay)
+
+        async with limit:
+            started = time.perf_counter()
+            await application(scope, receive, send)
+            if status[0] != 200:
+                raise BenchmarkError(f"GET {url.geturl()} returned {status[0]}")
+
+            return time.perf_counter() - started
+
+    async def run():
+        limit = asyncio.Semaphore(clients)
+        return await asyncio.gather(*(request(urls[i % len(urls)], limit) for i in range(requests)))
+
+    started = time.perf_counter()
+    latencies = asyncio.run(run())
+
+    return summarize(latencies, time.perf_counter() - started)
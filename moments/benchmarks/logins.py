@@ -0,0 +1,70 @@
+"""
+Throughput of the login view, which spends nearly all of its time hashing the submitted password.
+
+``run`` posts the login form from ``threads`` threads, as a threaded WSGI server would serve it, and reports logins
+per second both overall and per core in use, which is what sizing servers for login peaks needs.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import close_old_connections
+from django.test import Client
+from django.urls import reverse
+
+from .concurrency import summarize
+from .runner import BenchmarkError
+
+USERNAME_PREFIX = 'bench-login-'
+PASSWORD = 'benchmark-password'
+
+
+def create_users(count):
+    # One hash shared by every user, so that seeding does not cost as much as what is measured
+    password = make_password(PASSWORD)
+    User.objects.bulk_create(User(username=f"{USERNAME_PREFIX}{i}", password=password) for i in range(count))
+    return [f"{USERNAME_PREFIX}{i}" for i in range(count)]
+
+
+def delete_users():
+    User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+
+def run(usernames, requests, threads):
+    url = reverse('login')
+    local = threading.local()
+
+    def log_in(i):
+        if not hasattr(local, 'client'):
+            local.client = Client()
+        try:
+            started = time.perf_counter()
+            response = local.client.post(url, {'username': usernames[i % len(usernames)], 'password': PASSWORD})
+            elapsed = time.perf_counter() - started
+            if response.status_code != 302:
+                raise BenchmarkError(f"POST {url} returned {response.status_code}")
+            # Deletes the session, outside the timing
+            local.client.logout()
+        finally:
+            close_old_connections()
+        return elapsed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        latencies = list(executor.map(log_in, range(requests)))
+    result = summarize(latencies, time.perf_counter() - started)
+
+    cores = min(threads, os.cpu_count() or 1)
+    return {
+        'logins': result['requests'],
+        'elapsed_s': result['elapsed_s'],
+        'logins_per_s': result['requests_per_s'],
+        'logins_per_s_per_core': round(result['requests_per_s'] / cores, 1),
+        'p50_ms': result['p50_ms'],
+        'p95_ms': result['p95_ms'],
+        'threads': threads,
+        'cores': cores,
+    }
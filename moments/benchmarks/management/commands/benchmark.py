@@ -0,0 +1,95 @@
+import json
+import shutil
+import sys
+import tempfile
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+
+from benchmarks import runner
+from benchmarks.seed import seed
+
+
+class Command(BaseCommand):
+    help = ("Seeds users, albums and photos, times every named view against them and reports latency, SQL queries "
+            "and response size. Seeded rows are rolled back and their files written to a temporary MEDIA_ROOT, so "
+            "the database is left as it was.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help="Default: %(default)s")
+        parser.add_argument('--albums-per-user', type=int, default=20, help="Default: %(default)s")
+        parser.add_argument('--photos-per-album', type=int, default=50, help="Default: %(default)s")
+        parser.add_argument('--iterations', type=int, default=50,
+                            help="Timed requests per view (default: %(default)s)")
+        parser.add_argument('--warmup', type=int, default=3,
+                            help="Untimed requests per view before timing (default: %(default)s)")
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            choices=[scenario.name for scenario in runner.SCENARIOS],
+                            help="Only run this scenario; may be repeated")
+        parser.add_argument('--output', help="Write the results as JSON to this file ('-' for stdout)")
+        parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+
+    def handle(self, *args, users, albums_per_user, photos_per_album, iterations, warmup, scenarios=None,
+               output=None, baseline=None, **options):
+        if users < 1 or albums_per_user < 1 or iterations < 1:
+            raise CommandError("--users, --albums-per-user and --iterations must be at least 1")
+        selected = [scenario for scenario in runner.SCENARIOS if not scenarios or scenario.name in scenarios]
+
+        media_root = tempfile.mkdtemp(prefix='moments-benchmark-')
+        try:
+            with override_settings(MEDIA_ROOT=media_root, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                with transaction.atomic():
+                    data = seed(users, albums_per_user, photos_per_album)
+                    try:
+                        results = runner.run(data, iterations, warmup, selected)
+                    except runner.BenchmarkError as e:
+                        raise CommandError(e)
+                    finally:
+                        transaction.set_rollback(True)
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        report = {
+            'django': django.get_version(),
+            'python': sys.version.split()[0],
+            'seed': {'users': users, 'albums_per_user': albums_per_user, 'photos_per_album': photos_per_album},
+            'iterations': iterations,
+            'results': results,
+        }
+        self.write_table(results)
+        if baseline:
+            with open(baseline) as file:
+                self.write_changes(runner.compare(results, json.load(file)['results']))
+        if output:
+            self.write_report(report, output)
+
+        exceeded = runner.over_budget(results)
+        if exceeded:
+            raise CommandError("Query budget exceeded: " + ", ".join(
+                f"{name} ran {result['queries']} queries (budget {result['budget']})"
+                for name, result in exceeded.items()))
+
+    def write_table(self, results):
+        self.stdout.write(f"{'scenario':<20} {'p50 ms':>9} {'p95 ms':>9} {'queries':>8} {'bytes':>9}")
+        for name, result in results.items():
+            line = (f"{name:<20} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+                    f"{result['queries']:>4}/{result['budget']:<3} {result['bytes']:>9}")
+            self.stdout.write(self.style.ERROR(line) if result['queries'] > result['budget'] else line)
+
+    def write_changes(self, changes):
+        if not changes:
+            self.stdout.write("No changes from the baseline")
+        for name, metrics in changes.items():
+            self.stdout.write(f"{name}: " + ", ".join(
+                f"{metric} {previous} -> {current}" for metric, (previous, current) in metrics.items()))
+
+    def write_report(self, report, output):
+        text = json.dumps(report, indent=2, sort_keys=True)
+        if output == '-':
+            self.stdout.write(text)
+        else:
+            with open(output, 'w') as file:
+                file.write(text + '\n')
@@ -0,0 +1,112 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.urls import reverse
+
+from benchmarks import concurrency
+from benchmarks.runner import BenchmarkError
+from benchmarks.seed import seed
+
+SERVERS = ('wsgi', 'asgi')
+
+
+class Command(BaseCommand):
+    help = ("Compares the throughput of the REST album and photo reads served by WSGI with sync views and by ASGI "
+            "with async views, under many concurrent slow clients. Seeded rows are deleted afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2, help="Default: %(default)s")
+        parser.add_argument('--albums-per-user', type=int, default=20, help="Default: %(default)s")
+        parser.add_argument('--photos-per-album', type=int, default=50, help="Default: %(default)s")
+        parser.add_argument('--requests', type=int, default=500,
+                            help="Requests per server (default: %(default)s)")
+        parser.add_argument('--clients', type=int, default=100,
+                            help="Concurrent ASGI clients (default: %(default)s)")
+        parser.add_argument('--threads', type=int, default=8,
+                            help="WSGI worker threads (default: %(default)s)")
+        parser.add_argument('--client-delay', type=float, default=0.25,
+                            help="Seconds a client takes to read a response (default: %(default)s)")
+        parser.add_argument('--output', help="Write the results as JSON to this file ('-' for stdout)")
+        # Each server runs in a child process of its own so that it loads its own URL configuration
+        parser.add_argument('--serve', choices=SERVERS, help="Run one server against --url and print JSON results")
+        parser.add_argument('--url', action='append', dest='urls', help="URL requested by --serve")
+
+    def handle(self, *args, serve=None, urls=None, **options):
+        if serve:
+            return self.serve(serve, urls, **options)
+
+        if options['requests'] < 1 or options['users'] < 1 or options['albums_per_user'] < 1:
+            raise CommandError("--requests, --users and --albums-per-user must be at least 1")
+
+        media_root = tempfile.mkdtemp(prefix='moments-benchmark-')
+        data = None
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                # Committed, because the servers run in other processes
+                data = seed(options['users'], options['albums_per_user'], options['photos_per_album'])
+                urls = [
+                    reverse('rest:user-list', kwargs={'slug': data.user.username}),
+                    reverse('rest:album-detail', kwargs={'slug': data.user.username,
+                                                         'album': data.public_album.name}),
+                ]
+                results = {server: self.run_server(server, urls, options) for server in SERVERS}
+        finally:
+            if data is not None:
+                with override_settings(MEDIA_ROOT=media_root):
+                    User.objects.filter(pk__in=[user.pk for user in data.users]).delete()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        self.stdout.write(f"{'server':<8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9}")
+        for server, result in results.items():
+            self.stdout.write(f"{server:<8} {result['requests_per_s']:>9.1f} {result['p50_ms']:>9.2f} "
+                              f"{result['p95_ms']:>9.2f}")
+
+        report = {
+            'seed': {key: options[key] for key in ('users', 'albums_per_user', 'photos_per_album')},
+            'load': {key: options[key] for key in ('requests', 'clients', 'threads', 'client_delay')},
+            'results': results,
+        }
+        if options['output'] == '-':
+            self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+        elif options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(json.dumps(report, indent=2, sort_keys=True) + '\n')
+
+    def run_server(self, server, urls, options):
+        command = [
+            sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'benchmark_concurrency',
+            '--serve', server, '--requests', str(options['requests']), '--clients', str(options['clients']),
+            '--threads', str(options['threads']), '--client-delay', str(options['client_delay']),
+        ]
+        for url in urls:
+            command += ['--url', url]
+        env = {**os.environ, 'MOMENTS_ASYNC_VIEWS': '1' if server == 'asgi' else '0'}
+
+        child = subprocess.run(command, env=env, capture_output=True, text=True)
+        if child.returncode:
+            raise CommandError(f"The {server} benchmark failed:\n{child.stderr}")
+
+        return json.loads(child.stdout)
+
+    def serve(self, server, urls, requests, clients, threads, client_delay, **options):
+        if not urls:
+            raise CommandError("--serve needs at least one --url")
+
+        try:
+            with override_settings(ALLOWED_HOSTS=[concurrency.HOST]):
+                if server == 'wsgi':
+                    result = concurrency.run_wsgi(urls, requests, threads, client_delay)
+                else:
+                    result = concurrency.run_asgi(urls, requests, clients, client_delay)
+        except BenchmarkError as e:
+            raise CommandError(e)
+
+        self.stdout.write(json.dumps(result))
@@ -0,0 +1,50 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from benchmarks import logins
+from benchmarks.runner import BenchmarkError
+
+
+class Command(BaseCommand):
+    help = ("Posts the login form for seeded users from many threads at once and reports logins per second, overall "
+            "and per core. Seeded users and their sessions are deleted afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help="Default: %(default)s")
+        parser.add_argument('--requests', type=int, default=200, help="Logins (default: %(default)s)")
+        parser.add_argument('--threads', type=int, default=os.cpu_count(),
+                            help="Concurrent logins (default: %(default)s)")
+        parser.add_argument('--output', help="Write the results as JSON to this file ('-' for stdout)")
+
+    def handle(self, *args, users, requests, threads, output=None, **options):
+        if users < 1 or requests < 1 or threads < 1:
+            raise CommandError("--users, --requests and --threads must be at least 1")
+
+        # Committed, because the logins run on threads with connections of their own
+        usernames = logins.create_users(users)
+        try:
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                result = logins.run(usernames, requests, threads)
+        except BenchmarkError as e:
+            raise CommandError(e)
+        finally:
+            logins.delete_users()
+
+        self.stdout.write(f"{'logins/s':>9} {'per core':>9} {'cores':>6} {'p50 ms':>9} {'p95 ms':>9}")
+        self.stdout.write(f"{result['logins_per_s']:>9.1f} {result['logins_per_s_per_core']:>9.1f} "
+                          f"{result['cores']:>6} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f}")
+
+        report = {
+            'hasher': settings.PASSWORD_HASHERS[0],
+            'users': users,
+            'results': result,
+        }
+        if output == '-':
+            self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+        elif output:
+            with open(output, 'w') as file:
+                file.write(json.dumps(report, indent=2, sort_keys=True) + '\n')
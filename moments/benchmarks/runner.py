@@ -0,0 +1,112 @@
+"""
+Timing of the app's views against seeded data.
+
+Each scenario requests one named route through the test client and records wall-clock latency, the number of SQL
+queries and the size of the response body. Query counts must not grow with the amount of data, so each scenario has a
+budget that the run fails on exceeding.
+"""
+import math
+import time
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+
+class Scenario:
+
+    def __init__(self, name, route, budget, kwargs=lambda data: {}, login=False):
+        self.name = name
+        self.route = route
+        self.budget = budget
+        self.kwargs = kwargs
+        self.login = login
+
+    def url(self, data):
+        return reverse(self.route, kwargs=self.kwargs(data))
+
+
+SCENARIOS = [
+    Scenario('home', 'Home', budget=0),
+    Scenario('album-list', 'album-list', budget=1),
+    Scenario('create-album', 'create-album', budget=2, login=True),
+    Scenario('user-detail', 'user-detail', budget=2,
+             kwargs=lambda data: {'slug': data.user.username}),
+    Scenario('user-detail-owner', 'user-detail', budget=4, login=True,
+             kwargs=lambda data: {'slug': data.user.username}),
+    Scenario('album-detail', 'album-detail', budget=2,
+             kwargs=lambda data: {'slug': data.user.username, 'name': data.public_album.name}),
+    Scenario('rest-user-list', 'rest:user-list', budget=1,
+             kwargs=lambda data: {'slug': data.user.username}),
+    Scenario('rest-album-detail', 'rest:album-detail', budget=2,
+             kwargs=lambda data: {'slug': data.user.username, 'album': data.public_album.name}),
+]
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def percentile(samples, p):
+    """
+    Nearest-rank percentile of ``samples``
+    """
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def run_scenario(scenario, data, iterations, warmup):
+    client = Client()
+    if scenario.login:
+        client.force_login(data.user)
+    url = scenario.url(data)
+
+    timings = []
+    for i in range(warmup + iterations):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.get(url)
+            body = b''.join(response) if response.streaming else response.content
+            elapsed = time.perf_counter() - started
+
+        if response.status_code != 200:
+            raise BenchmarkError(f"{scenario.name}: GET {url} returned {response.status_code}")
+        if i >= warmup:
+            timings.append(elapsed)
+
+    return {
+        'url': url,
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+        # Queries and size of the last request, after any warm-up has filled caches
+        'queries': len(queries),
+        'bytes': len(body),
+        'budget': scenario.budget,
+    }
+
+
+def run(data, iterations, warmup, scenarios=SCENARIOS):
+    return {scenario.name: run_scenario(scenario, data, iterations, warmup) for scenario in scenarios}
+
+
+def over_budget(results):
+    return {name: result for name, result in results.items() if result['queries'] > result['budget']}
+
+
+def compare(results, baseline):
+    """
+    ``{scenario: {metric: (baseline, current)}}`` for every metric that changed
+    """
+    changes = {}
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        changed = {metric: (previous[metric], result[metric]) for metric in ('p50_ms', 'p95_ms', 'queries', 'bytes')
+                   if metric in previous and previous[metric] != result[metric]}
+        if changed:
+            changes[name] = changed
+
+    return changes
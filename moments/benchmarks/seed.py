@@ -0,0 +1,78 @@
+"""
+Synthetic users, albums and photos for benchmarking.
+
+Rows are inserted with ``bulk_create`` and a small pool of distinct images is shared between albums, so seeding tens
+of thousands of photos takes seconds. Every fourth album is private.
+"""
+import io
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from PIL import Image
+
+from albums import blobs, metadata
+from albums.models import Album, Photo
+from albums.renditions import generate_renditions
+
+USERNAME_PREFIX = 'bench-user-'
+BATCH_SIZE = 1000
+
+
+class SeededData:
+
+    def __init__(self, users, albums):
+        self.users = users
+        self.albums = albums
+
+    @property
+    def user(self):
+        """
+        The user whose pages are benchmarked
+        """
+        return self.users[0]
+
+    @property
+    def public_album(self):
+        return next(album for album in self.albums if album.owner_id == self.user.pk and album.public)
+
+
+def make_images(count):
+    """
+    Stores ``count`` distinct images with their renditions and returns ``[(name, renditions, metadata fields)]``
+    """
+    field = Photo._meta.get_field('image')
+    images = []
+    for i in range(count):
+        buffer = io.BytesIO()
+        # Solid colours close together can compress to the same bytes; a different width cannot
+        Image.new('RGB', (640 + i, 480), color=(i * 37 % 256, 96, 128)).save(buffer, 'JPEG')
+        name = field.storage.save(f"bench-{i}.jpg", ContentFile(buffer.getvalue()))
+        image = field.attr_class(None, field, name)
+        images.append((name, generate_renditions(image), metadata.read(image)))
+
+    return images
+
+
+def seed(users, albums_per_user, photos_per_album):
+    # Only PostgreSQL returns the primary keys of bulk-created rows, so they are selected again by their unique keys
+    usernames = [f"{USERNAME_PREFIX}{i}" for i in range(users)]
+    User.objects.bulk_create([User(username=username) for username in usernames], batch_size=BATCH_SIZE)
+    created_users = list(User.objects.filter(username__in=usernames).order_by('pk'))
+    Album.objects.bulk_create(
+        [Album(owner=user, name=f"Album {i}", public=i % 4 != 3)
+         for user in created_users for i in range(albums_per_user)], batch_size=BATCH_SIZE)
+    albums = list(Album.objects.filter(owner__in=created_users).order_by('owner_id', 'pk'))
+
+    # Each album gets photos_per_album distinct images, as a real album would
+    images = make_images(photos_per_album)
+    photos = (Photo(album=album, title=f"Photo {i}", image=name, renditions=renditions, **fields)
+              for album in albums for i, (name, renditions, fields) in enumerate(images))
+    Photo.objects.bulk_create(photos, batch_size=BATCH_SIZE)
+
+    # bulk_create() skips the signals that maintain blob references and album stats
+    storage = Photo._meta.get_field('image').storage
+    for name, _, _ in images:
+        blobs.acquire(name, storage, len(albums))
+    Album.objects.filter(owner__in=created_users).refresh_photo_stats()
+
+    return SeededData(created_users, albums)
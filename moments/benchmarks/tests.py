@@ -0,0 +1,111 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from albums.models import Album
+
+from . import runner
+from .seed import seed
+
+TEST_MEDIA_ROOT = os.path.join(tempfile.gettempdir(), 'moments-test-media')
+
+
+class BenchmarkCommandTestCase(TestCase):
+
+    def benchmark(self, **options):
+        output = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        output.close()
+        self.addCleanup(os.remove, output.name)
+
+        call_command('benchmark', users=2, albums_per_user=2, photos_per_album=2, iterations=2, warmup=1,
+                     output=output.name, stdout=open(os.devnull, 'w'), **options)
+        with open(output.name) as file:
+            return json.load(file)
+
+    def test_every_scenario_within_budget(self):
+        report = self.benchmark()
+
+        self.assertSetEqual({scenario.name for scenario in runner.SCENARIOS}, set(report['results']))
+        for name, result in report['results'].items():
+            self.assertLessEqual(result['queries'], result['budget'], name)
+            self.assertGreater(result['bytes'], 0, name)
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'], name)
+
+    def test_seeded_data_rolled_back(self):
+        self.benchmark(scenarios=['home'])
+
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Album.objects.exists())
+
+    def test_budget_exceeded(self):
+        with mock.patch.object(runner.SCENARIOS[1], 'budget', 0):
+            with self.assertRaisesRegex(CommandError, "album-list ran 1 queries"):
+                self.benchmark(scenarios=['album-list'])
+
+    def test_compare(self):
+        baseline = {'home': {'p50_ms': 1.0, 'p95_ms': 2.0, 'queries': 0, 'bytes': 100}}
+        results = {'home': {'p50_ms': 1.5, 'p95_ms': 2.0, 'queries': 0, 'bytes': 100}}
+
+        self.assertDictEqual({'home': {'p50_ms': (1.0, 1.5)}}, runner.compare(results, baseline))
+
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(50, runner.percentile(samples, 50))
+        self.assertEqual(95, runner.percentile(samples, 95))
+        self.assertEqual(7, runner.percentile([7], 95))
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ConcurrencyBenchmarkTestCase(TransactionTestCase):
+    # The servers query from their own threads and connections, so the seeded data has to be committed
+
+    def setUp(self) -> None:
+        data = seed(users=1, albums_per_user=1, photos_per_album=2)
+        self.urls = [
+            reverse('rest:user-list', kwargs={'slug': data.user.username}),
+            reverse('rest:album-detail', kwargs={'slug': data.user.username, 'album': data.public_album.name}),
+        ]
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_MEDIA_ROOT, ignore_errors=True)
+
+    def serve(self, server):
+        stdout = io.StringIO()
+        call_command('benchmark_concurrency', serve=server, urls=self.urls, requests=6, clients=3, threads=2,
+                     client_delay=0.01, stdout=stdout)
+        return json.loads(stdout.getvalue())
+
+    def test_wsgi(self):
+        result = self.serve('wsgi')
+        self.assertEqual(6, result['requests'])
+        self.assertGreaterEqual(result['p50_ms'], 10)
+
+    def test_asgi(self):
+        result = self.serve('asgi')
+        self.assertEqual(6, result['requests'])
+        self.assertGreaterEqual(result['p50_ms'], 10)
+
+
+class LoginBenchmarkTestCase(TransactionTestCase):
+    # The logins run on threads with connections of their own, so the seeded users have to be committed
+
+    def test_logins(self):
+        stdout = io.StringIO()
+        call_command('benchmark_logins', users=2, requests=4, threads=2, output='-', stdout=stdout)
+        result = json.loads(stdout.getvalue()[stdout.getvalue().index('{'):])['results']
+
+        self.assertEqual(4, result['logins'])
+        self.assertGreater(result['logins_per_s'], 0)
+        self.assertLessEqual(result['logins_per_s_per_core'], result['logins_per_s'])
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Session.objects.exists())
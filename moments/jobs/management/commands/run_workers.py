@@ -0,0 +1,77 @@
+import multiprocessing
+import os
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from jobs.models import QUEUES
+from jobs.queue import Worker
+from moments import processes
+
+
+def run_worker(queues, poll_interval, stop):
+    # The parent stops workers through `stop`, letting each one finish its current job
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    Worker(queues, poll_interval, stop).run()
+
+
+class Command(BaseCommand):
+    help = "Runs background jobs from the job queue until interrupted"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help="Worker processes; 0 runs one worker in this process (default: %(default)s)")
+        parser.add_argument('--queue', action='append', dest='queues', choices=QUEUES,
+                            help="Only run jobs from this lane; repeat for several (default: all, highest first)")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds an idle worker waits before looking for jobs again (default: %(default)s)")
+        parser.add_argument('--burst', action='store_true',
+                            help="Run in this process until no job is due, then exit")
+
+    def handle(self, *args, processes, queues=None, poll_interval, burst=False, **options):
+        # Lanes are served in priority order whatever order they are given in
+        queues = tuple(queue for queue in QUEUES if queue in (queues or QUEUES))
+
+        if burst or processes <= 0:
+            worker = Worker(queues, poll_interval)
+            try:
+                worker.run(burst=burst)
+            except KeyboardInterrupt:
+                pass
+            self.stdout.write(f"Ran {worker.succeeded + worker.failed} job(s): {worker.succeeded} succeeded, "
+                              f"{worker.failed} failed")
+            return
+
+        # Children must not share the parent's database connections
+        connections.close_all()
+        stop = multiprocessing.Event()
+        children = {}
+
+        def start(slot):
+            child = processes.process(run_worker, args=(queues, poll_interval, stop), daemon=True,
+                                      name=f"worker-{slot}")
+            child.start()
+            children[slot] = child
+
+        def request_stop(*args):
+            stop.set()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        for slot in range(processes):
+            start(slot)
+        self.stdout.write(f"Started {processes} worker(s) on {', '.join(queues)}")
+
+        while not stop.is_set():
+            for slot, child in list(children.items()):
+                if not child.is_alive():
+                    self.stderr.write(f"Worker {child.name} exited with code {child.exitcode}; restarting it")
+                    start(slot)
+            stop.wait(1)
+
+        for child in children.values():
+            child.join()
+        self.stdout.write("Stopped")
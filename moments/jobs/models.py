@@ -0,0 +1,44 @@
+from django.db import models
+from django.utils import timezone
+
+# Lanes in the order workers take jobs from them
+QUEUES = ('high', 'default', 'low')
+
+
+class Job(models.Model):
+    """
+    A call of a ``jobs.queue.task`` function waiting to run, running, or failed for good.
+
+    Jobs that succeed are deleted, so the table only holds outstanding work and failures.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (FAILED, 'Failed')]
+
+    task = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    queue = models.CharField(max_length=20, choices=[(queue, queue) for queue in QUEUES], default='default')
+    # Index of `queue` in QUEUES, so lanes sort in the order they are served
+    priority = models.PositiveSmallIntegerField(default=QUEUES.index('default'))
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Serves the claim query: the next due job, highest priority lane first
+            models.Index(fields=['priority', 'run_at', 'id'], name='job_queued_idx',
+                         condition=models.Q(status='queued')),
+            # Finds running jobs held longer than the lease, whose worker probably died
+            models.Index(fields=['locked_at'], name='job_running_idx', condition=models.Q(status='running')),
+        ]
+
+    def __str__(self):
+        return f"{self.task} #{self.pk}"
@@ -0,0 +1,194 @@
+"""
+A job queue in the project's database, so no broker is needed.
+
+A module-level function decorated with ``@task`` gains an ``enqueue(*args, **kwargs)`` method, which inserts a
+``Job`` row in the current transaction: workers cannot see the job until that transaction commits, and never see it
+if it rolls back, so views and signal handlers can enqueue freely without ``on_commit``. Arguments must be JSON
+serializable, so pass primary keys rather than model instances.
+
+``manage.py run_workers`` runs the workers. Each one claims the next due job, highest priority lane first, with
+``SELECT ... FOR UPDATE SKIP LOCKED`` where the database supports it, so workers never wait on each other's jobs. On
+SQLite, which has no row locks, a job is claimed by a conditional UPDATE instead; SQLite serializes writes, so only
+one worker's UPDATE can match. A failed job is retried with exponential backoff until ``max_attempts``.
+
+Jobs run at least once: a job still running after ``JOBS_LEASE`` seconds is assumed to have lost its worker and is
+run again, so tasks should be idempotent, or marked failed if that was its last attempt.
+
+With ``JOBS_EAGER`` set, each job instead runs in the process that enqueued it as soon as its transaction commits,
+for development and tests without a worker.
+"""
+import datetime
+import functools
+import os
+import random
+import socket
+import threading
+import traceback
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import QUEUES, Job
+
+DEFAULT_LEASE = 60 * 60
+DEFAULT_BACKOFF = 10
+MAX_BACKOFF = 60 * 60
+
+
+def task(function=None, *, queue='default', max_attempts=5):
+    """
+    Makes a module-level function enqueueable, on the ``queue`` lane
+    """
+    if function is None:
+        return functools.partial(task, queue=queue, max_attempts=max_attempts)
+    if function.__qualname__ != function.__name__:
+        raise ValueError(f"{function.__qualname__} is not a module-level function, which workers could import")
+    if queue not in QUEUES:
+        raise ValueError(f"Unknown queue {queue!r}, expected one of {QUEUES}")
+
+    def enqueue(*args, **kwargs):
+        return enqueue_call(function, args, kwargs, queue=queue, max_attempts=max_attempts)
+
+    function.enqueue = enqueue
+    return function
+
+
+def enqueue_call(function, args=(), kwargs=None, *, queue='default', max_attempts=5, delay=0):
+    """
+    Queues ``function(*args, **kwargs)`` to run ``delay`` seconds after the current transaction commits at the
+    earliest
+    """
+    job = Job.objects.create(
+        task=f"{function.__module__}.{function.__qualname__}", args=list(args), kwargs=kwargs or {}, queue=queue,
+        priority=QUEUES.index(queue), max_attempts=max_attempts,
+        run_at=timezone.now() + datetime.timedelta(seconds=delay))
+
+    if getattr(settings, 'JOBS_EAGER', False):
+        transaction.on_commit(lambda: run_eagerly(job.pk))
+
+    return job
+
+
+def run_eagerly(pk):
+    job = claim(worker='eager', pk=pk)
+    if job is not None:
+        execute(job)
+
+
+def lease():
+    return datetime.timedelta(seconds=getattr(settings, 'JOBS_LEASE', DEFAULT_LEASE))
+
+
+def backoff(attempts):
+    """
+    Seconds to wait before running a job again after its ``attempts``-th failure
+    """
+    delay = min(MAX_BACKOFF, getattr(settings, 'JOBS_BACKOFF', DEFAULT_BACKOFF) * 2 ** (attempts - 1))
+    # Jitter keeps jobs that failed together, say while a service was down, from all retrying together
+    return delay * random.uniform(0.75, 1.25)
+
+
+def claimable(now, queues=QUEUES):
+    due = Q(status=Job.QUEUED, run_at__lte=now)
+    abandoned = Q(status=Job.RUNNING, locked_at__lt=now - lease(), attempts__lt=F('max_attempts'))
+    return Job.objects.filter(due | abandoned, queue__in=queues).order_by('priority', 'run_at', 'id')
+
+
+def expire(now, queues=QUEUES):
+    """
+    Marks the jobs abandoned on their last attempt as failed. A job that takes its worker down every time, running it
+    out of memory say, would otherwise be run again every lease.
+    """
+    return Job.objects.filter(
+        status=Job.RUNNING, locked_at__lt=now - lease(), attempts__gte=F('max_attempts'), queue__in=queues,
+    ).update(status=Job.FAILED, locked_at=None,
+             last_error="Still running when its lease expired on its last attempt; its worker probably died.")
+
+
+def claim(worker, queues=QUEUES, pk=None):
+    """
+    Marks the next due job on ``queues`` as running by ``worker`` and returns it, or None if there is none
+    """
+    now = timezone.now()
+    expire(now, queues)
+    candidates = claimable(now, queues)
+    if pk is not None:
+        candidates = candidates.filter(pk=pk)
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = candidates.select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            job.status, job.locked_by, job.locked_at, job.attempts = Job.RUNNING, worker, now, job.attempts + 1
+            job.save(update_fields=['status', 'locked_by', 'locked_at', 'attempts'])
+            return job
+
+    while True:
+        job = candidates.first()
+        if job is None:
+            return None
+        # Only matches if no other worker claimed the job since it was read
+        claimed = Job.objects.filter(pk=job.pk, status=job.status, locked_at=job.locked_at).update(
+            status=Job.RUNNING, locked_by=worker, locked_at=now, attempts=job.attempts + 1)
+        if claimed:
+            job.status, job.locked_by, job.locked_at, job.attempts = Job.RUNNING, worker, now, job.attempts + 1
+            return job
+
+
+def execute(job):
+    """
+    Runs a claimed job, then deletes it, or schedules a retry or records its failure
+    """
+    try:
+        import_string(job.task)(*job.args, **job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+                status=Job.QUEUED, run_at=timezone.now() + datetime.timedelta(seconds=backoff(job.attempts)),
+                locked_by='', locked_at=None, last_error=error)
+        else:
+            Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+                status=Job.FAILED, locked_at=None, last_error=error)
+        return False
+
+    Job.objects.filter(pk=job.pk).delete()
+    return True
+
+
+class Worker:
+    """
+    Runs jobs from ``queues`` one at a time until ``stop`` is set
+    """
+
+    def __init__(self, queues=QUEUES, poll_interval=1.0, stop=None):
+        self.queues = queues
+        self.poll_interval = poll_interval
+        self.stop = stop or threading.Event()
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.succeeded = self.failed = 0
+
+    def run(self, burst=False):
+        """
+        With ``burst``, returns once no job is due instead of waiting for more
+        """
+        while not self.stop.is_set():
+            try:
+                job = claim(self.name, self.queues)
+                if job is not None:
+                    if execute(job):
+                        self.succeeded += 1
+                    else:
+                        self.failed += 1
+            finally:
+                # Between jobs, as request_finished would between requests
+                close_old_connections()
+
+            if job is None:
+                if burst:
+                    return
+                self.stop.wait(self.poll_interval)
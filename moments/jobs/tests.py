@@ -0,0 +1,179 @@
+import multiprocessing
+import os
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from moments import processes
+from .management.commands.run_workers import run_worker
+from .models import QUEUES, Job
+from .queue import Worker, claim, enqueue_call, task
+
+
+@task
+def create_user(username):
+    User.objects.create_user(username)
+
+
+@task(queue='high')
+def create_urgent_user(username):
+    User.objects.create_user(username)
+
+
+@task(max_attempts=2)
+def fail():
+    raise ValueError("Not today")
+
+
+class JobQueueTestCase(TransactionTestCase):
+
+    def run_workers(self):
+        call_command('run_workers', burst=True, stdout=open(os.devnull, 'w'))
+
+    def test_rolled_back_job_discarded(self):
+        with transaction.atomic():
+            create_user.enqueue("kept")
+        try:
+            with transaction.atomic():
+                create_user.enqueue("discarded")
+                raise ValueError
+        except ValueError:
+            pass
+
+        self.run_workers()
+        self.assertQuerysetEqual(User.objects.all(), ["kept"], lambda user: user.username)
+        self.assertFalse(Job.objects.exists())
+
+    def test_priority_order(self):
+        enqueue_call(create_user, ["low"], queue='low')
+        create_user.enqueue("default")
+        create_urgent_user.enqueue("high")
+
+        self.run_workers()
+        self.assertEqual(["high", "default", "low"],
+                         list(User.objects.order_by('id').values_list('username', flat=True)))
+
+    def test_queue_lanes(self):
+        create_user.enqueue("default")
+        create_urgent_user.enqueue("high")
+
+        call_command('run_workers', burst=True, queues=['high'], stdout=open(os.devnull, 'w'))
+        self.assertQuerysetEqual(User.objects.all(), ["high"], lambda user: user.username)
+        self.assertEqual('default', Job.objects.get().queue)
+
+    def test_delayed_job_waits(self):
+        enqueue_call(create_user, ["later"], delay=60)
+        self.run_workers()
+        self.assertFalse(User.objects.exists())
+
+    def test_retried_then_failed(self):
+        fail.enqueue()
+        self.run_workers()
+
+        job = Job.objects.get()
+        self.assertEqual((Job.QUEUED, 1, ''), (job.status, job.attempts, job.locked_by))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn("Not today", job.last_error)
+
+        # Not due until its backoff has passed
+        self.run_workers()
+        self.assertEqual(1, Job.objects.get().attempts)
+
+        Job.objects.update(run_at=timezone.now())
+        self.run_workers()
+        job = Job.objects.get()
+        self.assertEqual((Job.FAILED, 2), (job.status, job.attempts))
+
+        self.run_workers()
+        self.assertEqual(2, Job.objects.get().attempts)
+
+    def test_abandoned_job_reclaimed(self):
+        create_user.enqueue("reclaimed")
+        job = claim("dead worker")
+        self.assertIsNone(claim("live worker"))
+
+        Job.objects.update(locked_at=timezone.now() - timedelta(hours=2))
+        job = claim("live worker")
+        self.assertEqual(("live worker", 2), (job.locked_by, job.attempts))
+
+    def test_abandoned_last_attempt_failed(self):
+        job = enqueue_call(create_user, ["crashing"], max_attempts=1)
+        claim("dead worker")
+
+        Job.objects.update(locked_at=timezone.now() - timedelta(hours=2))
+        self.assertIsNone(claim("live worker"))
+        job.refresh_from_db()
+        self.assertEqual((Job.FAILED, 1), (job.status, job.attempts))
+        self.assertIn("lease expired", job.last_error)
+
+    def test_claimed_once(self):
+        for i in range(3):
+            create_user.enqueue(f"user_{i}")
+
+        jobs = [claim(f"worker_{i}") for i in range(4)]
+        self.assertEqual(3, len({job.pk for job in jobs[:3]}))
+        self.assertIsNone(jobs[3])
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager(self):
+        with transaction.atomic():
+            create_user.enqueue("eager")
+            self.assertFalse(User.objects.exists())
+
+        self.assertTrue(User.objects.filter(username="eager").exists())
+        self.assertFalse(Job.objects.exists())
+
+    def test_worker_processes(self):
+        self.run_worker_processes()
+
+    def test_spawned_worker_processes(self):
+        # As on macOS and Windows, where workers start without the parent's setup
+        start_method = multiprocessing.get_start_method()
+        multiprocessing.set_start_method('spawn', force=True)
+        try:
+            self.run_worker_processes()
+        finally:
+            multiprocessing.set_start_method(start_method, force=True)
+
+    def run_worker_processes(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("Worker processes cannot share an in-memory database")
+
+        for i in range(10):
+            create_user.enqueue(f"user_{i}")
+
+        connections.close_all()
+        stop = multiprocessing.Event()
+        workers = [processes.process(run_worker, args=(QUEUES, 0.1, stop)) for i in range(2)]
+        for worker in workers:
+            worker.start()
+        try:
+            deadline = timezone.now() + timedelta(seconds=30)
+            while Job.objects.exists() and timezone.now() < deadline:
+                stop.wait(0.1)
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join()
+
+        self.assertEqual(10, User.objects.count())
+        self.assertFalse(Job.objects.exists())
+
+    def test_worker_counts(self):
+        create_user.enqueue("counted")
+        Job.objects.create(task='jobs.tests.fail', max_attempts=1)
+
+        worker = Worker()
+        worker.run(burst=True)
+        self.assertEqual((1, 1), (worker.succeeded, worker.failed))
+
+    def test_nested_function_rejected(self):
+        def nested():
+            pass
+
+        with self.assertRaises(ValueError):
+            task(nested)
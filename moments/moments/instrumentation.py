@@ -0,0 +1,238 @@
+"""
+Per-request timing and SQL instrumentation.
+
+``InstrumentationMiddleware`` measures each request's wall time, the number and total duration of its SQL queries and
+the time spent rendering templates. Each response reports these in a ``Server-Timing`` header, and they are added to
+per-view histograms that ``metrics`` serves in the Prometheus text format.
+
+Histograms are kept in the memory of each server process, and ``metrics`` reports only the process that serves it.
+They are only correct with one process per scrape target: the worker processes of one gunicorn or uvicorn server share
+its port, so successive scrapes would reach different workers and read as counter resets. Run single-process servers
+on ports of their own, each scraped as a target, and let Prometheus sum them; the README shows how. Recording a request
+costs a few ``perf_counter()`` calls and a lock, so it can stay enabled.
+"""
+import asyncio
+import bisect
+import contextvars
+import hmac
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import Http404, HttpResponse
+from django.template.backends.django import DjangoTemplates
+
+from profiles import cache
+
+DURATION_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class Histogram:
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        # labels: [count per bucket..., count above the last bucket, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[bucket] += 1
+            series[-1] += value
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+
+        for labels, values in sorted(series.items()):
+            label_text = ','.join(f'{name}="{_escape(value)}"' for name, value in labels)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {values[-1]}")
+            lines.append(f"{self.name}_count{{{label_text}}} {cumulative}")
+
+        return '\n'.join(lines)
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+REQUEST_DURATION = Histogram('moments_request_duration_seconds', "Time to produce a response", DURATION_BUCKETS)
+SQL_QUERIES = Histogram('moments_request_sql_queries', "SQL queries executed per request", QUERY_BUCKETS)
+SQL_DURATION = Histogram('moments_request_sql_duration_seconds', "Time spent in SQL queries per request",
+                         DURATION_BUCKETS)
+TEMPLATE_DURATION = Histogram('moments_request_template_duration_seconds',
+                              "Time spent rendering templates per request", DURATION_BUCKETS)
+HISTOGRAMS = (REQUEST_DURATION, SQL_QUERIES, SQL_DURATION, TEMPLATE_DURATION)
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+
+    def server_timing(self, duration):
+        return (f'app;dur={duration * 1000:.1f}, '
+                f'db;dur={self.sql_time * 1000:.1f};desc="{self.queries} queries", '
+                f'tpl;dur={self.template_time * 1000:.1f}')
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.sql_time += time.perf_counter() - started
+        metrics.queries += 1
+
+
+@receiver(connection_created)
+def install_execute_wrapper(sender, connection, **kwargs):
+    # Installed on every connection rather than around each request, so that queries run on other threads (such as
+    # by sync_to_async) are still counted for the request whose context they run in
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+class InstrumentationMiddleware:
+    """
+    Records every request's timings; install it first in ``MIDDLEWARE`` so that it covers the other middleware
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Tells Django's handler to await this middleware
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+        # Connections opened before this module was imported
+        for connection in connections.all():
+            install_execute_wrapper(None, connection)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        return self.record(request, response, metrics, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        return self.record(request, response, metrics, time.perf_counter() - started)
+
+    def record(self, request, response, metrics, duration):
+        match = getattr(request, 'resolver_match', None)
+        labels = (('view', match.view_name if match else 'unresolved'), ('method', request.method))
+        REQUEST_DURATION.observe(labels, duration)
+        SQL_QUERIES.observe(labels, metrics.queries)
+        SQL_DURATION.observe(labels, metrics.sql_time)
+        TEMPLATE_DURATION.observe(labels, metrics.template_time)
+
+        response['Server-Timing'] = metrics.server_timing(duration)
+        return response
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, timing each render for ``InstrumentationMiddleware``
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class TimedTemplate:
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return self.template.render(context, request)
+
+        # A template rendered while rendering another is already being timed
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - started
+
+
+def has_metrics_token(request):
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return bool(token) and scheme.lower() == 'bearer' and hmac.compare_digest(credentials.encode(), token.encode())
+
+
+def metrics(request):
+    """
+    The histograms and page cache counters in the Prometheus text format, for staff and holders of METRICS_TOKEN only.
+    Client addresses are no proof: behind a reverse proxy on the same host, every request comes from 127.0.0.1.
+    """
+    if not request.user.is_staff and not has_metrics_token(request):
+        raise Http404
+
+    page_cache = cache.stats()
+    lines = [histogram.expose() for histogram in HISTOGRAMS]
+    for name in ('hits', 'misses'):
+        lines += [f"# HELP moments_page_cache_{name}_total Page cache {name}",
+                  f"# TYPE moments_page_cache_{name}_total counter",
+                  f"moments_page_cache_{name}_total {page_cache[name]}"]
+
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
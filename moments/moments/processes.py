@@ -0,0 +1,55 @@
+"""
+Django in the child processes of management commands.
+
+The spawn start method, the default on macOS and Windows, starts children that import the settings module afresh and
+must set Django up before they can import any model. ``pool`` and ``process`` start children that do so first, with
+the parent's ``MEDIA_ROOT`` and database names, so that they use the same files and database as the parent even where
+those were overridden, as in tests. Under fork, which copies the parent, this changes nothing.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def inherited():
+    """
+    The settings of this process that its children must share
+    """
+    return {
+        'media_root': settings.MEDIA_ROOT,
+        'database_names': {alias: database['NAME'] for alias, database in settings.DATABASES.items()},
+    }
+
+
+def setup(parent):
+    """
+    Sets Django up with the settings ``inherited()`` returned in the ``parent`` process
+    """
+    settings.MEDIA_ROOT = parent['media_root']
+    for alias, name in parent['database_names'].items():
+        settings.DATABASES[alias]['NAME'] = name
+    django.setup()
+
+
+def pool(workers):
+    """
+    A ``ProcessPoolExecutor`` of ``workers`` processes with Django set up
+    """
+    return ProcessPoolExecutor(workers, initializer=setup, initargs=(inherited(),))
+
+
+def process(target, args=(), **kwargs):
+    """
+    A ``multiprocessing.Process`` calling ``target(*args)`` with Django set up. ``target`` is passed by name, as its
+    module may import models.
+    """
+    return multiprocessing.Process(target=run, args=(inherited(), f'{target.__module__}.{target.__qualname__}', args),
+                                   **kwargs)
+
+
+def run(parent, target, args):
+    setup(parent)
+    import_string(target)(*args)
@@ -29,6 +29,21 @@ LOGIN_URL = 'login'
 MEDIA_URL = '/img/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'images')
 
+# Set to 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd) to have the web server send media files once
+# albums.views.serve_media has checked access. For nginx, MEDIA_OFFLOAD_PREFIX must be an `internal` location aliased
+# to MEDIA_ROOT.
+MEDIA_OFFLOAD = None
+MEDIA_OFFLOAD_PREFIX = '/protected-media/'
+
+# Chunked uploads are staged here until finalized, see rest.models.UploadSession
+UPLOAD_STAGING_ROOT = os.path.join(BASE_DIR, 'uploads')
+UPLOAD_MAX_SIZE = 100 * 1024 * 1024
+# Seconds an upload session is kept without being written to, see rest.views.UploadViewSet
+UPLOAD_SESSION_EXPIRY = 24 * 60 * 60
+
+# Run background jobs in the process enqueueing them, once its transaction commits, instead of in run_workers
+JOBS_EAGER = False
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -41,13 +56,30 @@ INSTALLED_APPS = [
     'crispy_forms',
     'albums.apps.AlbumsConfig',
     'profiles.apps.ProfilesConfig',
+    'rest.apps.RestConfig',
+    'benchmarks.apps.BenchmarksConfig',
+    'jobs.apps.JobsConfig',
     'rest_framework'
 ]
 
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Serve REST album and photo reads from async views (rest.async_views); moments/asgi.py turns this on
+REST_ASYNC_VIEWS = os.environ.get('MOMENTS_ASYNC_VIEWS') == '1'
+# Hash passwords for login and sign-up on the thread pool rather than ASGI's shared thread (auth.async_views)
+AUTH_ASYNC_VIEWS = os.environ.get('MOMENTS_ASYNC_VIEWS') == '1'
+
 MIDDLEWARE = [
+    'moments.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'moments.staticfiles.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -58,9 +90,16 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'moments.urls'
 
+# Per-view timings and SQL counts, served at /metrics to staff and to requests with an
+# "Authorization: Bearer <METRICS_TOKEN>" header, as Prometheus sends with its bearer_token scrape option
+METRICS_ENABLED = True
+METRICS_TOKEN = os.environ.get('MOMENTS_METRICS_TOKEN', '')
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The Django backend, timed for moments.instrumentation
+        'BACKEND': 'moments.instrumentation.InstrumentedDjangoTemplates',
+        'NAME': 'django',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -77,6 +116,44 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'moments.wsgi.application'
 
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Per process on purpose: entries expire quickly, see auth.backends
+    'users': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+# Sessions are kept in the database, and also cached when MOMENTS_SESSION_CACHE_BACKEND names a cache that every server
+# process shares (memcached, say, at MOMENTS_SESSION_CACHE_LOCATION). A per-process cache would leave a session alive
+# in the other processes after logging out in one.
+SESSION_CACHE_ALIAS = 'sessions'
+if os.environ.get('MOMENTS_SESSION_CACHE_BACKEND'):
+    # Kept apart from the default cache so that sessions are not culled to make room for pages
+    CACHES[SESSION_CACHE_ALIAS] = {
+        'BACKEND': os.environ['MOMENTS_SESSION_CACHE_BACKEND'],
+        'LOCATION': os.environ.get('MOMENTS_SESSION_CACHE_LOCATION', ''),
+    }
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+else:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+
+# Users that requests are authenticated as, see auth.backends
+AUTHENTICATION_BACKENDS = ['auth.backends.CachedModelBackend']
+USER_CACHE_ALIAS = 'users'
+USER_CACHE_TIMEOUT = 60
+
+# Rendered content of public album and profile pages, see profiles.cache
+PAGE_CACHE_ENABLED = False
+PAGE_CACHE_ALIAS = 'default'
+PAGE_CACHE_TIMEOUT = 60 * 15
+
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
@@ -126,3 +203,9 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.1/howto/static-files/
 STATICFILES_DIRS = [BASE_DIR / "static"]
 STATIC_URL = '/static/'
+# Filled by collectstatic with content-hashed names and .gz/.br variants, served by moments.staticfiles
+STATIC_ROOT = os.environ.get('MOMENTS_STATIC_ROOT', BASE_DIR / 'staticfiles')
+STATICFILES_STORAGE = 'moments.staticfiles.CompressedManifestStaticFilesStorage'
+
+# Links static files unhashed, as they are not collected before the tests
+TEST_RUNNER = 'moments.runner.TestRunner'
@@ -0,0 +1,190 @@
+"""
+Fingerprinted, precompressed static files, served with far-future caching.
+
+``collectstatic`` with ``CompressedManifestStaticFilesStorage`` writes each file to ``STATIC_ROOT`` under a name
+containing a hash of its content, as Django's ``ManifestStaticFilesStorage`` does, plus ``.gz`` and, when the
+``brotli`` package is installed, ``.br`` variants of text files compressed at the highest level once, at deploy time.
+
+``StaticFilesMiddleware`` serves ``STATIC_ROOT`` from memory-held metadata read at startup: it picks the smallest
+variant the request's ``Accept-Encoding`` allows and marks hashed names ``immutable`` for a year, so browsers do not
+request them again until a deploy changes the names in the pages. Restart the server after ``collectstatic``.
+"""
+import gzip
+import mimetypes
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from albums.media import IMMUTABLE_MAX_AGE
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('.css', '.js', '.map', '.svg', '.json', '.txt', '.html', '.xml', '.ico')
+# Below this, compression saves less than the extra header lines cost
+MIN_COMPRESS_SIZE = 256
+
+# Content-Encoding and file suffix, preferred first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def compress(content):
+    """
+    ``(suffix, compressed content)`` for each encoding available
+    """
+    if brotli is not None:
+        yield '.br', brotli.compress(content, quality=11)
+    # A fixed mtime keeps the output, and so its ETag, the same across deploys
+    yield '.gz', gzip.compress(content, compresslevel=9, mtime=0)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    ``ManifestStaticFilesStorage`` that also writes compressed variants next to the text files it collects
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+
+        # Files with references are hashed again on each pass; only the final names are kept
+        for name, hashed_name in self.hashed_files.items():
+            if name.endswith(COMPRESSIBLE):
+                self.compress(name)
+                self.compress(hashed_name)
+
+    def compress(self, name):
+        with self.open(name) as file:
+            content = file.read()
+        if len(content) < MIN_COMPRESS_SIZE:
+            return
+
+        for suffix, compressed in compress(content):
+            # Only worth a variant when it saves a meaningful share of the transfer
+            if len(compressed) < len(content) * 0.95:
+                with open(self.path(name + suffix), 'wb') as file:
+                    file.write(compressed)
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            if not settings.DEBUG:
+                raise
+            # Not collected yet, as under runserver: link the file under its own name, which the middleware does not
+            # cache
+            return name
+
+
+class StaticFile:
+
+    def __init__(self, path, immutable):
+        self.immutable = immutable
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        # Content-Encoding (None for the file itself): path, ETag, Last-Modified
+        self.variants = {}
+        for encoding, suffix in [*ENCODINGS, (None, '')]:
+            try:
+                stat = os.stat(path + suffix)
+            except FileNotFoundError:
+                continue
+            self.variants[encoding] = (path + suffix, f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"', int(stat.st_mtime))
+
+    def variant(self, accept_encoding):
+        """
+        The preferred variant ``accept_encoding`` allows
+        """
+        accepted = accepted_encodings(accept_encoding)
+        for encoding, variant in self.variants.items():
+            if encoding is None or encoding in accepted or '*' in accepted:
+                return encoding, variant
+
+
+def accepted_encodings(header):
+    """
+    The content codings an ``Accept-Encoding`` header allows, leaving out those it gives a quality of 0
+    """
+    accepted = set()
+    for item in (header or '').split(','):
+        coding, *params = item.split(';')
+        coding = coding.strip().lower()
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    pass
+        if coding and quality > 0:
+            accepted.add(coding)
+    return accepted
+
+
+def index(root, immutable_names):
+    """
+    ``{name: StaticFile}`` for the files under ``root``, not counting the compressed variants
+    """
+    files = {}
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+                continue
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, root).replace(os.sep, '/')
+            files[name] = StaticFile(path, name in immutable_names)
+    return files
+
+
+class StaticFilesMiddleware:
+    """
+    Serves collected static files before the rest of the middleware and URL resolution
+    """
+
+    def __init__(self, get_response):
+        # Without a collected STATIC_ROOT, runserver's own handler serves the source files
+        if (not settings.STATIC_ROOT or not os.path.isdir(settings.STATIC_ROOT)
+                or not settings.STATIC_URL.startswith('/')):
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL
+        self.files = index(settings.STATIC_ROOT, set(getattr(staticfiles_storage, 'hashed_files', {}).values()))
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD') and request.path.startswith(self.prefix):
+            file = self.files.get(request.path[len(self.prefix):])
+            if file is not None:
+                return self.serve(request, file)
+
+        return self.get_response(request)
+
+    def serve(self, request, file):
+        encoding, (path, etag, last_modified) = file.variant(request.META.get('HTTP_ACCEPT_ENCODING'))
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = FileResponse(open(path, 'rb'), content_type=file.content_type)
+            # FileResponse names the variant, which would be misleading
+            del response['Content-Disposition']
+            if encoding is not None:
+                response['Content-Encoding'] = encoding
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        if len(file.variants) > 1:
+            patch_vary_headers(response, ['Accept-Encoding'])
+        if file.immutable:
+            patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+        else:
+            patch_cache_control(response, public=True, max_age=0)
+
+        return response
@@ -0,0 +1,180 @@
+import gzip
+import os
+import re
+import shutil
+import tempfile
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from albums.models import Album
+from . import instrumentation
+from .staticfiles import accepted_encodings, brotli
+
+SERVER_TIMING = re.compile(r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="(?P<queries>\d+) queries", tpl;dur=(?P<tpl>[\d.]+)$')
+
+
+class InstrumentationTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user("test_user")
+        Album.objects.create(owner=cls.user, name="test_album")
+
+    def setUp(self) -> None:
+        for histogram in instrumentation.HISTOGRAMS:
+            histogram.clear()
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('user-detail', args=[self.user.username]))
+
+        match = SERVER_TIMING.match(response['Server-Timing'])
+        self.assertIsNotNone(match, response['Server-Timing'])
+        self.assertEqual(2, int(match['queries']))
+        self.assertGreater(float(match['tpl']), 0)
+
+    def test_metrics(self):
+        self.client.get(reverse('album-list'))
+        self.client.get(reverse('album-list'))
+        self.client.force_login(User.objects.create_user("staff_user", is_staff=True))
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual('text/plain; version=0.0.4; charset=utf-8', response['Content-Type'])
+        body = response.content.decode()
+        self.assertIn('# TYPE moments_request_duration_seconds histogram', body)
+        self.assertIn('moments_request_sql_queries_bucket{view="album-list",method="GET",le="1"} 2', body)
+        self.assertIn('moments_request_sql_queries_count{view="album-list",method="GET"} 2', body)
+        self.assertIn('moments_page_cache_hits_total 0', body)
+
+    def test_metrics_restricted(self):
+        # Requests through a local reverse proxy all come from 127.0.0.1
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(404, response.status_code)
+
+        self.client.force_login(User.objects.create_user("staff_user", is_staff=True))
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.1')
+        self.assertEqual(200, response.status_code)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_metrics_token(self):
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(200, response.status_code)
+
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(404, response.status_code)
+
+    def test_metrics_without_token_configured(self):
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer ')
+        self.assertEqual(404, response.status_code)
+
+    def test_histogram(self):
+        histogram = instrumentation.Histogram('test_seconds', "Test", (1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe((('view', 'a"b'),), value)
+
+        self.assertListEqual([
+            '# HELP test_seconds Test',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{view="a\\"b",le="1"} 2',
+            'test_seconds_bucket{view="a\\"b",le="5"} 3',
+            'test_seconds_bucket{view="a\\"b",le="+Inf"} 4',
+            'test_seconds_sum{view="a\\"b"} 14.5',
+            'test_seconds_count{view="a\\"b"} 4',
+        ], histogram.expose().split('\n'))
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        response = self.client.get(reverse('album-list'))
+        self.assertNotIn('Server-Timing', response)
+
+
+class StaticFilesTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.static_root = tempfile.mkdtemp()
+        cls.settings = override_settings(
+            STATIC_ROOT=cls.static_root,
+            STATICFILES_STORAGE='moments.staticfiles.CompressedManifestStaticFilesStorage')
+        cls.settings.enable()
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+        shutil.rmtree(cls.static_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def stylesheet_url(self):
+        response = self.client.get(reverse('album-list'))
+        return re.search(r'href="(/static/css/bootstrap\.min\.[0-9a-f]{12}\.css)"', response.content.decode())[1]
+
+    def test_hashed_names_linked(self):
+        self.assertTrue(os.path.exists(os.path.join(self.static_root, self.stylesheet_url()[len('/static/'):])))
+
+    def test_precompressed_variant(self):
+        url = self.stylesheet_url()
+        plain = self.client.get(url)
+        compressed = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertEqual('gzip', compressed['Content-Encoding'])
+        self.assertEqual('text/css', compressed['Content-Type'])
+        self.assertEqual(b''.join(plain.streaming_content), gzip.decompress(b''.join(compressed.streaming_content)))
+        self.assertLess(int(compressed['Content-Length']), int(plain['Content-Length']))
+        self.assertEqual('Accept-Encoding', compressed['Vary'])
+        self.assertNotEqual(plain['ETag'], compressed['ETag'])
+
+        refused = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertNotIn('Content-Encoding', refused)
+
+    @skipUnless(brotli, "brotli is not installed")
+    def test_brotli_variant(self):
+        url = self.stylesheet_url()
+        plain = self.client.get(url)
+        compressed = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+
+        self.assertEqual('br', compressed['Content-Encoding'])
+        self.assertEqual(b''.join(plain.streaming_content),
+                         brotli.decompress(b''.join(compressed.streaming_content)))
+        gzipped = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertLess(int(compressed['Content-Length']), int(gzipped['Content-Length']))
+
+    def test_immutable_caching(self):
+        response = self.client.get(self.stylesheet_url())
+        self.assertEqual('public, max-age=31536000, immutable', response['Cache-Control'])
+        # Served before the session middleware could make it vary by cookie
+        self.assertEqual('Accept-Encoding', response['Vary'])
+
+        unhashed = self.client.get('/static/css/bootstrap.min.css')
+        self.assertEqual('public, max-age=0', unhashed['Cache-Control'])
+
+    def test_not_modified(self):
+        url = self.stylesheet_url()
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(304, response.status_code)
+
+    def test_missing_file(self):
+        self.assertEqual(404, self.client.get('/static/css/missing.css').status_code)
+
+    def test_uncollected_file(self):
+        with self.assertRaises(ValueError):
+            staticfiles_storage.url('css/missing.css')
+        with override_settings(DEBUG=True):
+            self.assertEqual('/static/css/missing.css', staticfiles_storage.url('css/missing.css'))
+
+
+class AcceptEncodingTestCase(SimpleTestCase):
+
+    def test_accepted_encodings(self):
+        self.assertEqual(set(), accepted_encodings(None))
+        self.assertEqual({'gzip', 'deflate', 'br'}, accepted_encodings('gzip, deflate, br'))
+        self.assertEqual({'gzip', 'identity'}, accepted_encodings('br;q=0, gzip;q=0.5, identity ; q=1'))
+        self.assertEqual({'*'}, accepted_encodings('*'))
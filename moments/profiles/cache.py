@@ -0,0 +1,97 @@
+"""
+Opt-in cache of the rendered content of public album and profile pages.
+
+Only the ``content`` block is cached; the surrounding page (navbar, CSRF token, breadcrumbs) is still rendered per
+request. What the content shows depends on who is looking, so each page is cached once per viewer class. Entries are
+deleted by the signal handlers in ``profiles.signals`` whenever an album or photo changes.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+ANONYMOUS = 'anonymous'
+OWNER = 'owner'
+OTHER = 'other'
+VIEWER_CLASSES = (ANONYMOUS, OWNER, OTHER)
+
+ALBUM_PAGE = 'album'
+PROFILE_PAGE = 'profile'
+
+HITS_KEY = 'moments.page:hits'
+MISSES_KEY = 'moments.page:misses'
+
+
+def is_enabled():
+    return getattr(settings, 'PAGE_CACHE_ENABLED', False)
+
+
+def get_cache():
+    return caches[getattr(settings, 'PAGE_CACHE_ALIAS', 'default')]
+
+
+def viewer_class(request, owner_username):
+    if not request.user.is_authenticated:
+        return ANONYMOUS
+
+    return OWNER if request.user.username == owner_username else OTHER
+
+
+def page_key(page, viewer, slug, name=''):
+    # Usernames and album names are user input; hash them into something every cache backend accepts as a key
+    digest = hashlib.md5(f"{slug}\0{name}".encode()).hexdigest()
+    return f"moments.page:{page}:{digest}:{viewer}"
+
+
+def _count(key):
+    cache = get_cache()
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, 1, timeout=None)
+
+
+def render_fragment(request, key, template_name, context, cacheable=True):
+    """
+    Renders ``template_name``, or returns the cached rendering stored under ``key``.
+
+    Returns the HTML and whether it came from the cache.
+    """
+    if not (cacheable and is_enabled()):
+        return mark_safe(render_to_string(template_name, context, request)), False
+
+    cache = get_cache()
+    html = cache.get(key)
+    if html is not None:
+        _count(HITS_KEY)
+        return mark_safe(html), True
+
+    _count(MISSES_KEY)
+    html = render_to_string(template_name, context, request)
+    cache.set(key, html, getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 15))
+
+    return mark_safe(html), False
+
+
+def invalidate_album(username, name):
+    """
+    Drops the album's page and its owner's profile page, which shows the album's cover and photo count
+    """
+    if not is_enabled():
+        return
+
+    keys = [page_key(ALBUM_PAGE, viewer, username, name) for viewer in VIEWER_CLASSES]
+    keys += [page_key(PROFILE_PAGE, viewer, username) for viewer in VIEWER_CLASSES]
+    get_cache().delete_many(keys)
+
+
+def stats():
+    counts = get_cache().get_many([HITS_KEY, MISSES_KEY])
+    return {
+        'hits': counts.get(HITS_KEY, 0),
+        'misses': counts.get(MISSES_KEY, 0),
+    }
@@ -0,0 +1,23 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from albums.models import Album, Photo
+from . import cache
+
+
+@receiver(post_save, sender=Album)
+@receiver(post_delete, sender=Album)
+def invalidate_album_pages(sender, instance, **kwargs):
+    if cache.is_enabled():
+        cache.invalidate_album(instance.owner.username, instance.name)
+
+
+@receiver(post_save, sender=Photo)
+@receiver(post_delete, sender=Photo)
+def invalidate_photo_pages(sender, instance, **kwargs):
+    if not cache.is_enabled() or instance.album_id is None:
+        return
+
+    album = Album.objects.filter(pk=instance.album_id).values_list('owner__username', 'name').first()
+    if album is not None:
+        cache.invalidate_album(*album)
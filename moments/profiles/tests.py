@@ -1,14 +1,29 @@
+import io
+import os
 import shutil
+import tempfile
+import zipfile
+from unittest import mock
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase, Client
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from PIL import Image
 
+from albums import archive
 from albums.models import Album, Photo
-from moments.settings import MEDIA_ROOT
+from . import cache as page_cache
+from .views import ALBUM_PAGE_SIZE, EAGER_PHOTOS
 
+TEST_MEDIA_ROOT = os.path.join(tempfile.gettempdir(), 'moments-test-media')
 
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
 class UserDetailTestCase(TestCase):
 
     @staticmethod
@@ -36,7 +51,7 @@ class UserDetailTestCase(TestCase):
         cls.image = SimpleUploadedFile(name='test_image.jpg', content=open('profiles/data/tuckie.jpg', 'rb').read(),
                                        content_type='image/jpeg')
         cls.photo = Photo.objects.create(title="Tuckie", album=cls.public_album, image=cls.image)
-        cls.photo_link = f"background-image: url('{cls.photo.image.url}')"
+        cls.photo_link = f"background-image: url('{cls.photo.rendition_urls['card']['jpeg']}')"
 
         cls.private_album = Album.objects.create(name="private_album", owner=cls.user, public=False)
         cls.private_page = cls.get_album_page_url(cls.private_album)
@@ -47,7 +62,7 @@ class UserDetailTestCase(TestCase):
 
     @classmethod
     def tearDownClass(cls):
-        shutil.rmtree(f"{MEDIA_ROOT}/{cls.user.username}")
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
         super().tearDownClass()
 
     def tearDown(self) -> None:
@@ -102,6 +117,25 @@ class UserDetailTestCase(TestCase):
             self.assertNotContains(response, self.private_page_link)
             self.assertNotContains(response, self.new_album_link)
 
+    def test_get_profile_query_count_constant(self):
+        """
+        Tests that the number of queries for a profile does not grow with the number of albums
+        """
+        self.client.force_login(self.user)
+        # Loads the user into the user cache, so both counts leave it out
+        self.client.get(self.user_page)
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(self.user_page)
+
+        for i in range(5):
+            album = Album.objects.create(name=f"album_{i}", owner=self.user)
+            Photo.objects.create(title=f"photo_{i}", album=album, image=self.image)
+
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(self.user_page)
+
+        self.assertEqual(len(before), len(after))
+
 
 class GetAlbumTestCase(TestCase):
 
@@ -144,3 +178,240 @@ class GetAlbumTestCase(TestCase):
         Album.objects.create(owner=self.user, name=self.album_name, public=False)
         response = self.client.get(self.album_page)
         self.assertEqual(401, response.status_code)
+
+
+class AlbumPagesTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.client = Client()
+        cls.user = User.objects.create_user("test_user")
+        cls.album = Album.objects.create(owner=cls.user, name="big album")
+        cls.album_page = reverse('album-detail', args=[cls.user.username, cls.album.name])
+        Photo.objects.bulk_create([Photo(title=f"photo {i}", album=cls.album, image=f"photo-{i}.jpg")
+                                   for i in range(ALBUM_PAGE_SIZE * 2 + 3)])
+        cls.titles = list(cls.album.photos.order_by('id').values_list('title', flat=True))
+
+    def test_first_page_rendered(self):
+        response = self.client.get(self.album_page)
+        self.assertEqual(ALBUM_PAGE_SIZE, response.content.decode().count('class="card"'))
+        self.assertEqual(ALBUM_PAGE_SIZE - EAGER_PHOTOS, response.content.decode().count('loading="lazy"'))
+        self.assertContains(response, 'data-fragment=')
+
+    def test_fragments_cover_album(self):
+        response = self.client.get(self.album_page)
+        titles = [photo.title for photo in response.context['page_obj']]
+        page, query_counts = response.context['page_obj'], []
+        while page.has_next():
+            url = reverse('album-photos', args=[self.user.username, self.album.name])
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'after': page.next_cursor})
+            query_counts.append(len(queries))
+            self.assertTemplateNotUsed(response, 'base.html')
+            page = response.context['page_obj']
+            titles += [photo.title for photo in page]
+
+        self.assertListEqual(self.titles, titles)
+        self.assertEqual(1, len(set(query_counts)))
+        self.assertNotContains(response, 'data-fragment=')
+
+    def test_fragment_images_lazy(self):
+        response = self.client.get(self.album_page)
+        url = reverse('album-photos', args=[self.user.username, self.album.name])
+        response = self.client.get(url, {'after': response.context['page_obj'].next_cursor})
+        self.assertEqual(ALBUM_PAGE_SIZE, response.content.decode().count('loading="lazy"'))
+
+    def test_later_page_without_javascript(self):
+        response = self.client.get(self.album_page)
+        response = self.client.get(self.album_page, {'after': response.context['page_obj'].next_cursor})
+        self.assertTemplateUsed(response, 'albums/album_detail.html')
+        self.assertEqual(self.titles[ALBUM_PAGE_SIZE:ALBUM_PAGE_SIZE * 2],
+                         [photo.title for photo in response.context['page_obj']])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.album_page, {'after': 'not-a-cursor'})
+        self.assertEqual(404, response.status_code)
+
+    def test_private_album_fragment(self):
+        album = Album.objects.create(owner=self.user, name="private album", public=False)
+        response = self.client.get(reverse('album-photos', args=[self.user.username, album.name]))
+        self.assertEqual(404, response.status_code)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class DownloadAlbumTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.client = Client()
+        cls.user = User.objects.create_user("test_user")
+        cls.album = Album.objects.create(owner=cls.user, name="holidays")
+        cls.content = open('profiles/data/tuckie.jpg', 'rb').read()
+        # Identical content would share a blob, which an album cannot hold twice
+        for title in ("beach", "hills/sea"):
+            Photo.objects.create(title=title, album=cls.album,
+                                 image=SimpleUploadedFile(name='photo.jpg', content=cls.content + title.encode()))
+        bitmap = io.BytesIO()
+        Image.new('RGB', (64, 64), 'yellow').save(bitmap, 'BMP')
+        Photo.objects.create(title="scan", album=cls.album,
+                             image=SimpleUploadedFile(name='scan.bmp', content=bitmap.getvalue()))
+        cls.download = reverse('album-download', args=[cls.user.username, cls.album.name])
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def tearDown(self) -> None:
+        self.client.logout()
+
+    def get_archive(self, url):
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        self.assertIsInstance(response, StreamingHttpResponse)
+        return response, zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_download_album(self):
+        response, zip_file = self.get_archive(self.download)
+        self.assertEqual('application/zip', response['Content-Type'])
+        self.assertEqual('attachment; filename="holidays.zip"', response['Content-Disposition'])
+        self.assertIsNone(zip_file.testzip())
+        self.assertListEqual(['holidays/beach.jpg', 'holidays/hills_sea.jpg', 'holidays/scan.bmp'],
+                             zip_file.namelist())
+        self.assertEqual(self.content + b'beach', zip_file.read('holidays/beach.jpg'))
+
+    def test_compressed_images_stored(self):
+        _, zip_file = self.get_archive(self.download)
+        self.assertEqual(zipfile.ZIP_STORED, zip_file.getinfo('holidays/beach.jpg').compress_type)
+        scan = zip_file.getinfo('holidays/scan.bmp')
+        self.assertEqual(zipfile.ZIP_DEFLATED, scan.compress_type)
+        self.assertLess(scan.compress_size, scan.file_size)
+
+    def test_streamed_in_chunks(self):
+        with mock.patch.object(archive, 'CHUNK_SIZE', 1024):
+            chunks = list(self.client.get(self.download).streaming_content)
+        self.assertGreater(len(chunks), len(self.content) // 1024)
+        self.assertLessEqual(max(len(chunk) for chunk in chunks), 1024 + 1024)
+
+    def test_missing_file_left_out(self):
+        photo = Photo.objects.create(title="dunes", album=self.album,
+                                     image=SimpleUploadedFile(name='dunes.jpg', content=self.content + b'dunes'))
+        os.remove(photo.image.path)
+        _, zip_file = self.get_archive(self.download)
+        self.assertNotIn('holidays/dunes.jpg', zip_file.namelist())
+        self.assertIn('holidays/beach.jpg', zip_file.namelist())
+
+    def test_unicode_album_name(self):
+        album = Album.objects.create(owner=self.user, name="été")
+        response, zip_file = self.get_archive(reverse('album-download', args=[self.user.username, album.name]))
+        self.assertEqual("attachment; filename*=utf-8''%C3%A9t%C3%A9.zip", response['Content-Disposition'])
+        self.assertListEqual([], zip_file.namelist())
+
+    async def test_download_under_asgi(self):
+        response = await self.async_client.get(self.download)
+        self.assertEqual(200, response.status_code)
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertEqual('no', response['X-Accel-Buffering'])
+        self.assertEqual('attachment; filename="holidays.zip"', response['Content-Disposition'])
+        zip_file = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIsNone(zip_file.testzip())
+        self.assertEqual(self.content + b'beach', zip_file.read('holidays/beach.jpg'))
+
+    def test_private_album(self):
+        album = Album.objects.create(owner=self.user, name="private album", public=False)
+        url = reverse('album-download', args=[self.user.username, album.name])
+        self.assertEqual(401, self.client.get(url).status_code)
+
+        self.client.force_login(User.objects.create_user("other_user"))
+        self.assertEqual(401, self.client.get(url).status_code)
+
+        self.client.force_login(self.user)
+        self.get_archive(url)
+
+    def test_album_does_not_exist(self):
+        response = self.client.get(reverse('album-download', args=[self.user.username, "missing"]))
+        self.assertEqual(404, response.status_code)
+
+
+@override_settings(PAGE_CACHE_ENABLED=True)
+class PageCacheTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.client = Client()
+        cls.user = User.objects.create_user(username="test_user")
+        cls.other_user = User.objects.create_user(username="other_user")
+        cls.album = Album.objects.create(owner=cls.user, name="public album")
+        cls.album_page = reverse('album-detail', args=[cls.user.username, cls.album.name])
+        cls.user_page = reverse('user-detail', args=[cls.user.username])
+
+    def setUp(self) -> None:
+        page_cache.get_cache().clear()
+
+    def tearDown(self) -> None:
+        self.client.logout()
+
+    def assertCacheStatus(self, expected, url):
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(expected, response['X-Page-Cache'])
+        return response
+
+    def test_album_page_cached(self):
+        self.assertCacheStatus('miss', self.album_page)
+        with self.assertNumQueries(1):
+            self.assertCacheStatus('hit', self.album_page)
+        self.assertDictEqual({'hits': 1, 'misses': 1}, page_cache.stats())
+
+    def test_profile_page_cached(self):
+        self.assertCacheStatus('miss', self.user_page)
+        self.assertCacheStatus('hit', self.user_page)
+
+    def test_viewer_classes_cached_separately(self):
+        self.assertCacheStatus('miss', self.user_page)
+
+        self.client.force_login(self.user)
+        response = self.assertCacheStatus('miss', self.user_page)
+        self.assertContains(response, reverse('create-album'))
+
+        self.client.force_login(self.other_user)
+        response = self.assertCacheStatus('miss', self.user_page)
+        self.assertNotContains(response, reverse('create-album'))
+
+    def test_photo_change_invalidates(self):
+        self.assertCacheStatus('miss', self.album_page)
+        self.assertCacheStatus('miss', self.user_page)
+
+        photo = Photo.objects.create(title="new photo", album=self.album)
+        response = self.assertCacheStatus('miss', self.album_page)
+        self.assertContains(response, photo.title)
+        self.assertCacheStatus('miss', self.user_page)
+
+        photo.delete()
+        response = self.assertCacheStatus('miss', self.album_page)
+        self.assertNotContains(response, photo.title)
+
+    def test_album_change_invalidates(self):
+        self.assertCacheStatus('miss', self.album_page)
+        self.album.save()
+        self.assertCacheStatus('miss', self.album_page)
+
+    def test_private_album_not_cached(self):
+        album = Album.objects.create(owner=self.user, name="private album", public=False)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('album-detail', args=[self.user.username, album.name]))
+        self.assertNotIn('X-Page-Cache', response)
+
+
+@override_settings(CACHES={
+    **settings.CACHES,
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'moments-page-cache-test'),
+    },
+})
+class FileBasedPageCacheTestCase(PageCacheTestCase):
+    pass
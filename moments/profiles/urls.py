@@ -1,9 +1,10 @@
 from django.urls import path
 
-from .views import UserDetailView, get_album
+from .views import UserDetailView, download_album, get_album, get_album_photos
 
 urlpatterns = [
     path('', UserDetailView.as_view(), name='user-detail'),
     path('albums/<name>', get_album, name='album-detail'),
-
+    path('albums/<name>/photos', get_album_photos, name='album-photos'),
+    path('albums/<name>/download', download_album, name='album-download'),
 ]
@@ -1,34 +1,97 @@
+import functools
+from urllib.parse import quote
+
 from django.contrib.auth.models import User
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.functional import SimpleLazyObject
 from django.views.generic import DetailView
 
+from albums.archive import album_archive
 from albums.models import Album
+from albums.pagination import InvalidCursor, KeysetPaginator
+from . import cache
+
+# Photos per server-rendered page of an album, and how many at the top of the first page load without waiting to
+# scroll into view
+ALBUM_PAGE_SIZE = 48
+EAGER_PHOTOS = 6
 
 
 class UserDetailView(DetailView):
     model = User
     slug_field = 'username'
     context_object_name = 'current_user'
+    content_template_name = 'auth/user_detail_content.html'
+
+    def get_albums(self):
+        albums = self.object.albums.select_related('cover_photo').order_by('pk')
+        if self.object.username != self.request.user.username:
+            albums = albums.filter(public=True)
+
+        return albums
 
     def get_context_data(self, **kwargs):
-        return {
+        context = {
             **super(UserDetailView, self).get_context_data(),
+            'albums': self.get_albums(),
             'breadcrumbs': {
                 'Home': reverse('Home'),
                 'User Profile': None
             }
         }
 
+        username = self.object.username
+        key = cache.page_key(cache.PROFILE_PAGE, cache.viewer_class(self.request, username), username)
+        context['content'], self.page_cache_hit = cache.render_fragment(self.request, key,
+                                                                         self.content_template_name, context)
 
-def get_album(request, slug, name):
-    album = get_object_or_404(Album, name=name, owner__username=slug)
+        return context
+
+    def render_to_response(self, context, **response_kwargs):
+        response = super(UserDetailView, self).render_to_response(context, **response_kwargs)
+        if cache.is_enabled():
+            response['X-Page-Cache'] = 'hit' if self.page_cache_hit else 'miss'
 
+        return response
+
+
+def get_visible_album(request, slug, name):
+    """
+    The album, or None if ``request``'s user may not see it
+    """
+    album = get_object_or_404(Album, name=name, owner__username=slug)
     if not album.public and (slug != request.user.username):
+        return None
+
+    return album
+
+
+def get_photo_page(request, album):
+    """
+    One page of the album's photos, after the ``after`` cursor. Only that page's rows are loaded, however large the
+    album.
+    """
+    paginator = KeysetPaginator(album.photos.all(), ('id',), ALBUM_PAGE_SIZE)
+    try:
+        return paginator.page(request.GET.get('after'))
+    except InvalidCursor:
+        raise Http404("Invalid page cursor")
+
+
+def get_album(request, slug, name):
+    album = get_visible_album(request, slug, name)
+    if album is None:
         return render(request, 'base.html', status=401, context={"error_msg": '401: Unauthorized'})
 
     context = {
         'album': album,
+        'slug': slug,
+        # Not queried when the content comes from the cache
+        'page_obj': SimpleLazyObject(functools.partial(get_photo_page, request, album)),
+        'eager_photos': EAGER_PHOTOS,
         'breadcrumbs': {
             'Home': reverse('Home'),
             'User Profile': reverse('user-detail', args=[slug]),
@@ -36,4 +99,49 @@ def get_album(request, slug, name):
         }
     }
 
-    return render(request, 'albums/album_detail.html', context)
+    # Later pages are reached by following the "More photos" link without JavaScript, and are not cached
+    cacheable = album.public and 'after' not in request.GET
+    key = cache.page_key(cache.ALBUM_PAGE, cache.viewer_class(request, slug), slug, name)
+    context['content'], hit = cache.render_fragment(request, key, 'albums/album_detail_content.html', context,
+                                                    cacheable=cacheable)
+
+    response = render(request, 'albums/album_detail.html', context)
+    if cache.is_enabled() and cacheable:
+        response['X-Page-Cache'] = 'hit' if hit else 'miss'
+
+    return response
+
+
+def get_album_photos(request, slug, name):
+    """
+    The next page of an album's photo cards as an HTML fragment, which the album page appends as the reader scrolls
+    """
+    album = get_visible_album(request, slug, name)
+    if album is None:
+        raise Http404("No such album")
+
+    context = {'album': album, 'slug': slug, 'page_obj': get_photo_page(request, album), 'eager_photos': 0}
+    return render(request, 'albums/album_photos_page.html', context)
+
+
+def download_album(request, slug, name):
+    """
+    A zip archive of an album's photos, streamed as it is generated
+    """
+    album = get_visible_album(request, slug, name)
+    if album is None:
+        return render(request, 'base.html', status=401, context={"error_msg": '401: Unauthorized'})
+
+    filename = f"{album.name}.zip"
+    response = StreamingHttpResponse(album_archive(album), content_type='application/zip')
+    try:
+        filename.encode('ascii')
+        file_expr = 'filename="{}"'.format(filename.replace('\\', '\\\\').replace('"', r'\"'))
+    except UnicodeEncodeError:
+        file_expr = f"filename*=utf-8''{quote(filename)}"
+    response['Content-Disposition'] = f"attachment; {file_expr}"
+    # Otherwise nginx holds the archive back until its proxy buffers fill
+    response['X-Accel-Buffering'] = 'no'
+    patch_cache_control(response, private=True, no_store=True)
+
+    return response
@@ -0,0 +1,51 @@
+"""
+Async entry points for the REST API's album and photo reads, used in place of the viewsets' own views when
+``REST_ASYNC_VIEWS`` is on, as it is under ``moments/asgi.py``.
+
+Django 3.1 has no async ORM, and an ASGI server runs every sync view on a single shared thread. These views run the
+viewset, serialization and rendering included, in the default thread pool instead, so reads proceed concurrently and
+an event loop rather than a thread waits on slow clients. Writes stay on the shared thread like any sync view.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def respond(view, request, *args, **kwargs):
+    try:
+        response = view(request, *args, **kwargs)
+        response.render()
+        return response
+    finally:
+        # Pool threads keep their own connections; release them as request_finished would
+        close_old_connections()
+
+
+def async_view(view):
+    """
+    Wraps the sync view of a viewset in an async view that runs reads on the thread pool
+    """
+    pooled = sync_to_async(respond, thread_sensitive=False)
+    shared = sync_to_async(view, thread_sensitive=True)
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method in READ_METHODS:
+            return await pooled(view, request, *args, **kwargs)
+        return await shared(request, *args, **kwargs)
+
+    return wrapper
+
+
+def async_urls(urls, viewsets):
+    """
+    ``urls`` with the views of ``viewsets`` replaced by async views
+    """
+    return [
+        type(url)(url.pattern, async_view(url.callback), url.default_args, url.name)
+        if getattr(url.callback, 'cls', None) in viewsets else url
+        for url in urls
+    ]
@@ -0,0 +1,54 @@
+import os
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rest.models import UploadSession, expiry_cutoff
+
+
+class Command(BaseCommand):
+    help = ("Deletes upload sessions not written to for UPLOAD_SESSION_EXPIRY seconds, along with their staged files "
+            "and any staged file left without a session")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be deleted")
+
+    def handle(self, *args, dry_run=False, **options):
+        cutoff = expiry_cutoff()
+        expired = UploadSession.objects.filter(updated__lt=cutoff)
+        sessions = 0
+        for session in expired.iterator():
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{session.pk} {session.filename}")
+            if not dry_run:
+                session.discard()
+            sessions += 1
+
+        # Files of sessions deleted without going through discard(), such as with their album
+        orphans = 0
+        if os.path.isdir(settings.UPLOAD_STAGING_ROOT):
+            staged = {}
+            with os.scandir(settings.UPLOAD_STAGING_ROOT) as entries:
+                for entry in entries:
+                    # Sessions are recorded before anything is staged, so only old files can be orphans
+                    if (entry.name.endswith('.part') and entry.is_file(follow_symlinks=False)
+                            and entry.stat().st_mtime < cutoff.timestamp()):
+                        try:
+                            staged[uuid.UUID(entry.name[:-len('.part')])] = entry.path
+                        except ValueError:
+                            continue
+            live = set(UploadSession.objects.filter(pk__in=list(staged)).values_list('pk', flat=True))
+            for pk, path in staged.items():
+                if pk in live:
+                    continue
+                if not dry_run:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                orphans += 1
+
+        verb = "Would delete" if dry_run else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {sessions} expired upload session(s) and {orphans} orphaned staged file(s)"))
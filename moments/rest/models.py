@@ -1,3 +1,85 @@
-from django.db import models
+import datetime
+import os
+import uuid
+import zlib
 
-# Create your models here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import models, transaction
+from django.utils import timezone
+
+from albums.models import Album
+
+# Bytes read from the request and written to disk at a time
+COPY_BUFFER_SIZE = 64 * 1024
+
+
+def expiry_cutoff():
+    """
+    Sessions last written to before this have expired
+    """
+    return timezone.now() - datetime.timedelta(seconds=settings.UPLOAD_SESSION_EXPIRY)
+
+
+class UploadSession(models.Model):
+    """
+    A photo upload sent in byte ranges, staged on disk under ``UPLOAD_STAGING_ROOT`` until it is finalized
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, related_name='upload_sessions', on_delete=models.CASCADE)
+    album = models.ForeignKey(Album, related_name='upload_sessions', on_delete=models.CASCADE)
+    title = models.CharField(max_length=140)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    # Running CRC-32 of bytes [0, offset); unlike a hashlib digest it can be resumed from its stored value
+    checksum = models.BigIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    @property
+    def path(self):
+        return os.path.join(settings.UPLOAD_STAGING_ROOT, f"{self.pk}.part")
+
+    @property
+    def complete(self):
+        return self.offset == self.size
+
+    def write_chunk(self, stream, start, length):
+        """
+        Streams ``length`` bytes from ``stream`` into the staged file at ``start``, which must be the current offset.
+
+        Whatever arrives is kept, so a dropped connection can be resumed from the new offset. Returns whether the
+        session was still at ``start``; if not, another request got there first and nothing is written.
+        """
+        os.makedirs(settings.UPLOAD_STAGING_ROOT, exist_ok=True)
+
+        with transaction.atomic():
+            # Holds back another request for the same range, such as a retry while this one still streams, until this
+            # one is recorded; it then finds the offset moved on, rather than writing over these bytes
+            session = UploadSession.objects.select_for_update().filter(pk=self.pk, offset=start).first()
+            if session is None:
+                return False
+
+            checksum = session.checksum
+            written = 0
+            with open(self.path, 'r+b' if os.path.exists(self.path) else 'wb') as staged:
+                staged.seek(start)
+                while written < length:
+                    chunk = stream.read(min(COPY_BUFFER_SIZE, length - written))
+                    if not chunk:
+                        break
+                    staged.write(chunk)
+                    checksum = zlib.crc32(chunk, checksum)
+                    written += len(chunk)
+
+            UploadSession.objects.filter(pk=self.pk).update(offset=start + written, checksum=checksum,
+                                                            updated=timezone.now())
+            self.offset, self.checksum = start + written, checksum
+
+        return True
+
+    def discard(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.delete()
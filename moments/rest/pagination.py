@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class AlbumCursorPagination(CursorPagination):
+    ordering = ('-created', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class PhotoCursorPagination(CursorPagination):
+    ordering = ('id',)
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 500
@@ -0,0 +1,34 @@
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    ``JSONRenderer`` using orjson when it is installed.
+
+    The output is byte-for-byte the same as ``JSONRenderer``'s with the default ``COMPACT_JSON`` and ``UNICODE_JSON``
+    settings, except for floats: orjson spells some exponents differently and writes NaN as null instead of failing.
+    None of this API's responses contain floats. Indented output, other settings and anything orjson cannot encode
+    fall back to ``JSONRenderer``.
+    """
+    # Types JSONRenderer's encoder formats differently from orjson go through the encoder
+    options = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+               if orjson is not None else None)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or not api_settings.COMPACT_JSON or not api_settings.UNICODE_JSON
+                or self.get_indent(accepted_media_type, renderer_context or {})):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+        except (TypeError, ValueError):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Like JSONRenderer, escape the two characters that are valid JSON but not valid JavaScript
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -1,24 +1,190 @@
+from django.conf import settings
 from rest_framework import serializers
 
 from albums.models import Album, Photo
+from albums.renditions import rendition_urls
+from rest.models import UploadSession
 
 
-class AlbumSerializer(serializers.HyperlinkedModelSerializer):
+class SparseFieldsetMixin:
+    """
+    Limits the serialized fields to those named in the request's ``?fields=`` parameter.
+
+    Nested fields are selected with dotted names, e.g. ``?fields=photos.title``. A serializer none of whose fields are
+    named keeps all of them.
+    """
+    fields_query_param = 'fields'
+
+    @property
+    def field_path(self):
+        names = []
+        field = self
+        while field.parent is not None:
+            if field.field_name:
+                names.append(field.field_name)
+            field = field.parent
+
+        return ''.join(f"{name}." for name in reversed(names))
+
+    def get_fields(self):
+        fields = super().get_fields()
+
+        request = self.context.get('request')
+        requested = request.query_params.get(self.fields_query_param) if request is not None else None
+        if not requested:
+            return fields
+
+        prefix = self.field_path
+        selected = {name[len(prefix):].split('.', 1)[0] for name in requested.split(',') if name.startswith(prefix)}
+        if not selected & set(fields):
+            return fields
+
+        return {name: field for name, field in fields.items() if name in selected}
+
+
+class ValuesRepresentationMixin:
+    """
+    A read-only fast path: ``represent_values`` turns ``values()`` rows into the same dicts ``to_representation``
+    makes from instances, without running DRF's field machinery for every value.
+
+    Values are copied from the row as they are, except where a field's representation differs from the database value
+    (dates, decimals, UUIDs), which go through the field. A ``SerializerMethodField`` is computed by
+    ``get_<name>_from_values(row)`` from the columns listed for it in ``value_sources``.
+    """
+    converted_fields = (serializers.DateTimeField, serializers.DateField, serializers.TimeField,
+                        serializers.DurationField, serializers.DecimalField, serializers.UUIDField)
+    value_sources = {}
+
+    def value_names(self, *extra):
+        """
+        The columns ``represent_values`` needs from each row, followed by ``extra`` ones such as the ordering
+        """
+        names = []
+        for name, field in self.fields.items():
+            names += self.value_sources.get(name, [field.source])
+
+        return list(dict.fromkeys([*names, *extra]))
+
+    def represent_values(self, rows):
+        fields = []
+        for name, field in self.fields.items():
+            if name in self.value_sources:
+                fields.append((name, None, getattr(self, f"get_{name}_from_values")))
+            else:
+                fields.append((name, field.source, field.to_representation
+                               if isinstance(field, self.converted_fields) else None))
+
+        represented = []
+        for row in rows:
+            item = {}
+            for name, source, convert in fields:
+                if source is None:
+                    item[name] = convert(row)
+                else:
+                    value = row[source]
+                    item[name] = value if convert is None or value is None else convert(value)
+            represented.append(item)
+
+        return represented
+
+
+class AlbumSerializer(SparseFieldsetMixin, ValuesRepresentationMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Album
         fields = ['name', 'created']
         lookup_field = 'owner'
 
 
-class PhotoSerializer(serializers.HyperlinkedModelSerializer):
+class PhotoSerializer(SparseFieldsetMixin, ValuesRepresentationMixin, serializers.HyperlinkedModelSerializer):
+    images = serializers.SerializerMethodField()
+    value_sources = {'images': ['image', 'renditions']}
+
+    class Meta:
+        model = Photo
+        fields = ['title', 'images', 'placeholder']
+
+    def get_images(self, photo):
+        """
+        Rendition URLs by size and format so clients can request only the size they draw
+        """
+        request = self.context.get('request')
+        urls = photo.rendition_urls
+        if request is not None:
+            urls = {size: {fmt: url and request.build_absolute_uri(url) for fmt, url in formats.items()}
+                    for size, formats in urls.items()}
+
+        return urls
+
+    def get_images_from_values(self, row):
+        if not row['image']:
+            return {}
+
+        urls = rendition_urls(Photo._meta.get_field('image').storage, row['image'], row['renditions'])
+        request = self.context.get('request')
+        if request is not None:
+            urls = {size: {fmt: url and self.absolute_url(request, url) for fmt, url in formats.items()}
+                    for size, formats in urls.items()}
+
+        return urls
+
+    def absolute_url(self, request, url):
+        # build_absolute_uri() validates the host on every call; a site-relative URL only needs the origin prepended
+        if url.startswith('/') and not url.startswith('//') and '/.' not in url:
+            if not hasattr(self, '_origin'):
+                self._origin = request.build_absolute_uri('/')[:-1]
+            return self._origin + url
+
+        return request.build_absolute_uri(url)
+
+
+class AlbumSearchResultSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    owner = serializers.CharField(source='owner.username')
+
+    class Meta:
+        model = Album
+        fields = ['name', 'owner', 'created', 'photo_count']
+
+
+class PhotoSearchResultSerializer(PhotoSerializer):
+    album = serializers.CharField(source='album.name')
+    owner = serializers.CharField(source='album.owner.username')
+
     class Meta:
         model = Photo
-        fields = ['title']
+        fields = ['title', 'album', 'owner', 'images', 'placeholder']
 
 
-class PhotoAlbumSerializer(serializers.HyperlinkedModelSerializer):
-    photos = PhotoSerializer(many=True, read_only=True)
+class PhotoAlbumSerializer(SparseFieldsetMixin, serializers.HyperlinkedModelSerializer):
+    # Views attach the (paginated or prefetched) photos to be serialized as `photo_page`
+    photos = PhotoSerializer(many=True, read_only=True, source='photo_page')
 
     class Meta:
         model = Album
         fields = ['photos']
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    album = serializers.SlugRelatedField(slug_field='name', queryset=Album.objects.none())
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'album', 'title', 'filename', 'size', 'offset', 'created']
+        read_only_fields = ['id', 'offset', 'created']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is not None and request.user.is_authenticated:
+            self.fields['album'].queryset = Album.objects.filter(owner=request.user)
+
+    def validate_size(self, size):
+        if size > settings.UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f"Uploads are limited to {settings.UPLOAD_MAX_SIZE} bytes.")
+
+        return size
+
+    def validate(self, attrs):
+        if Photo.objects.filter(album=attrs['album'], title=attrs['title']).exists():
+            raise serializers.ValidationError({'title': "A photo with this title already exists in the album."})
+
+        return attrs
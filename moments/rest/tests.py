@@ -1,10 +1,39 @@
-from datetime import datetime
-
-from django.contrib.auth.models import User
-from django.test import TestCase, Client
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from unittest import skipUnless
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework import routers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request as DRFRequest
 
 from albums.models import Album, Photo
+from rest.async_views import async_urls, async_view
+from rest.models import UploadSession
+from rest.renderers import FastJSONRenderer
+from rest.serializers import AlbumSerializer, PhotoSerializer
+from rest.views import AlbumViewSet, PhotoViewSet, SearchView, UploadViewSet
+
+TEST_MEDIA_ROOT = os.path.join(tempfile.gettempdir(), 'moments-test-media')
 
 
 class RESTUserDetailTestCase(TestCase):
@@ -20,7 +49,7 @@ class RESTUserDetailTestCase(TestCase):
         cls.user = User.objects.create_user(username="test_user")
         cls.public_album = Album.objects.create(name="public_album", owner=cls.user)
         cls.private_album = Album.objects.create(name="private_album", owner=cls.user, public=False)
-        cls.user_albums = Album.objects.filter(owner=cls.user).values('created', 'name')
+        cls.user_albums = Album.objects.filter(owner=cls.user).order_by('-created', '-id').values('created', 'name')
 
         cls.other_user = User.objects.create_user(username="other_user")
 
@@ -38,7 +67,7 @@ class RESTUserDetailTestCase(TestCase):
         expected = list(self.user_albums.filter(public=True))
         for album in expected:
             album['created'] = self.toisostring(album['created'])
-        actual = response.json()
+        actual = response.json()['results']
 
         self.assertListEqual(expected, actual)
 
@@ -53,7 +82,7 @@ class RESTUserDetailTestCase(TestCase):
         expected = list(self.user_albums.filter(public=True))
         for album in expected:
             album['created'] = self.toisostring(album['created'])
-        actual = response.json()
+        actual = response.json()['results']
 
         self.assertListEqual(expected, actual)
 
@@ -68,7 +97,7 @@ class RESTUserDetailTestCase(TestCase):
         expected = list(self.user_albums)
         for album in expected:
             album['created'] = self.toisostring(album['created'])
-        actual = response.json()
+        actual = response.json()['results']
 
         self.assertListEqual(expected, actual)
 
@@ -87,11 +116,11 @@ class GetPhotosTestCase(TestCase):
         cls.user = User.objects.create_user(username="test_user")
         cls.public_album = Album.objects.create(name="public_album", owner=cls.user)
         Photo.objects.create(title='test_photo_public', album=cls.public_album)
-        cls.public_photos = Photo.objects.filter(album=cls.public_album).values('title')
+        cls.public_photos = Photo.objects.filter(album=cls.public_album).values('title', 'placeholder')
 
         cls.private_album = Album.objects.create(name="private_album", owner=cls.user, public=False)
         Photo.objects.create(title='test_photo_private', album=cls.private_album)
-        cls.private_photos = Photo.objects.filter(album=cls.private_album).values('title')
+        cls.private_photos = Photo.objects.filter(album=cls.private_album).values('title', 'placeholder')
 
         cls.other_user = User.objects.create_user(username="other_user")
         other_album = Album.objects.create(name=cls.public_album.name, owner=cls.other_user)
@@ -104,8 +133,8 @@ class GetPhotosTestCase(TestCase):
         endpoint = self.get_api_endpoint(self.user.username, self.public_album.name)
         response = self.client.get(endpoint)
 
-        expected_photos = list(self.public_photos)
-        expected = dict(photos=expected_photos)
+        expected_photos = [dict(photo, images={}) for photo in self.public_photos]
+        expected = dict(photos=expected_photos, next=None, previous=None)
         actual = response.json()
 
         self.assertDictEqual(expected, actual)
@@ -136,8 +165,445 @@ class GetPhotosTestCase(TestCase):
         response = self.client.get(endpoint)
         self.assertEqual(200, response.status_code)
 
-        expected_photos = list(self.private_photos)
-        expected = dict(photos=expected_photos)
+        expected_photos = [dict(photo, images={}) for photo in self.private_photos]
+        expected = dict(photos=expected_photos, next=None, previous=None)
         actual = response.json()
 
         self.assertDictEqual(expected, actual)
+
+
+class RESTPaginationTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.client = Client()
+
+        cls.user = User.objects.create_user(username="test_user")
+        Album.objects.bulk_create(Album(name=f"album_{i}", owner=cls.user) for i in range(5))
+        cls.album = Album.objects.get(name="album_0")
+        # bulk_create skips rendition generation, so the photos need no files on disk
+        Photo.objects.bulk_create(Photo(title=f"photo_{i}", album=cls.album, image=f"test/photo_{i}.jpg")
+                                  for i in range(7))
+
+        cls.album_list_api_endpoint = reverse('rest:user-list', current_app='rest', kwargs={'slug': cls.user.username})
+        cls.album_api_endpoint = reverse('rest:album-detail', current_app='rest',
+                                         kwargs={'slug': cls.user.username, 'album': cls.album.name})
+
+    def get_all_pages(self, url, key, **params):
+        items, query_counts = [], []
+        data = params
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, data=data)
+            query_counts.append(len(queries))
+            body = response.json()
+            items += body[key]
+            url, data = body['next'], None
+
+        return items, query_counts
+
+    def test_album_pages(self):
+        albums, query_counts = self.get_all_pages(self.album_list_api_endpoint, 'results', page_size=2)
+
+        expected = list(Album.objects.filter(owner=self.user).order_by('-created', '-id').values_list('name', flat=True))
+        self.assertListEqual(expected, [album['name'] for album in albums])
+        self.assertEqual(3, len(query_counts))
+        self.assertEqual(1, len(set(query_counts)))
+
+    def test_nested_photo_pages(self):
+        photos, query_counts = self.get_all_pages(self.album_api_endpoint, 'photos', page_size=3)
+
+        expected = list(self.album.photos.order_by('id').values_list('title', flat=True))
+        self.assertListEqual(expected, [photo['title'] for photo in photos])
+        self.assertEqual(3, len(query_counts))
+        self.assertEqual(1, len(set(query_counts)))
+
+    def test_sparse_fields(self):
+        response = self.client.get(self.album_list_api_endpoint, data={'fields': 'name'})
+        for album in response.json()['results']:
+            self.assertListEqual(['name'], list(album))
+
+    def test_sparse_nested_fields(self):
+        response = self.client.get(self.album_api_endpoint, data={'fields': 'photos.title'})
+        for photo in response.json()['photos']:
+            self.assertListEqual(['title'], list(photo))
+
+    def test_unknown_fields_ignored(self):
+        response = self.client.get(self.album_list_api_endpoint, data={'fields': 'bogus'})
+        for album in response.json()['results']:
+            self.assertListEqual(['name', 'created'], list(album))
+
+    def test_album_list_nested_photos_prefetched(self):
+        endpoint = reverse('rest:album-list', current_app='rest', kwargs={'slug': self.user.username})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(endpoint)
+
+        albums = response.json()['results']
+        self.assertEqual(5, len(albums))
+        self.assertEqual(7, sum(len(album['photos']) for album in albums))
+        self.assertFalse(any(album['photos_next'] for album in albums))
+        self.assertEqual(2, len(queries))
+
+    @patch.object(PhotoViewSet, 'nested_photo_limit', 3)
+    def test_album_list_nested_photos_limited(self):
+        endpoint = reverse('rest:album-list', current_app='rest', kwargs={'slug': self.user.username})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(endpoint)
+        self.assertEqual(2, len(queries))
+
+        album = next(album for album in response.json()['results'] if album['photos'])
+        self.assertEqual(3, len(album['photos']))
+        # The rest of the album's photos follow on retrieve's cursor pages
+        rest, _ = self.get_all_pages(album['photos_next'], 'photos')
+        expected = list(self.album.photos.order_by('id').values_list('title', flat=True))
+        self.assertListEqual(expected, [photo['title'] for photo in album['photos'] + rest])
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT,
+                   UPLOAD_STAGING_ROOT=os.path.join(tempfile.gettempdir(), 'moments-upload-test'))
+class ChunkedUploadTestCase(TransactionTestCase):
+    """
+    Finalized uploads are published once their transaction commits, so each test commits its own
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.content = open('profiles/data/tuckie.jpg', 'rb').read()
+        cls.upload_endpoint = reverse('rest:upload-list', current_app='rest', kwargs={'slug': "test_user"})
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test_user")
+        self.other_user = User.objects.create_user(username="other_user")
+        self.album = Album.objects.create(name="public_album", owner=self.user)
+        self.client.force_login(self.user)
+
+    def tearDown(self) -> None:
+        self.client.logout()
+
+    def open_session(self, title="Tuckie", size=None):
+        response = self.client.post(self.upload_endpoint, data={
+            'album': self.album.name,
+            'title': title,
+            'filename': 'tuckie.jpg',
+            'size': len(self.content) if size is None else size,
+        })
+        self.assertEqual(201, response.status_code)
+        return response.json()
+
+    def session_endpoint(self, session, action=None):
+        name = 'rest:upload-finalize' if action else 'rest:upload-detail'
+        return reverse(name, current_app='rest', kwargs={'slug': self.user.username, 'pk': session['id']})
+
+    def put_range(self, session, start, end, content=None):
+        content = self.content if content is None else content
+        return self.client.put(self.session_endpoint(session), data=content[start:end + 1],
+                               content_type='application/octet-stream',
+                               HTTP_CONTENT_RANGE=f"bytes {start}-{end}/{len(content)}")
+
+    def test_upload_in_chunks(self):
+        session = self.open_session()
+        middle = len(self.content) // 2
+
+        response = self.put_range(session, 0, middle - 1)
+        self.assertEqual(middle, response.json()['offset'])
+
+        # Resuming starts from the offset the server reports
+        response = self.client.get(self.session_endpoint(session))
+        self.assertEqual(middle, response.json()['offset'])
+
+        response = self.put_range(session, middle, len(self.content) - 1)
+        self.assertEqual(len(self.content), response.json()['offset'])
+
+        response = self.client.post(self.session_endpoint(session, 'finalize'),
+                                    data={'crc32': zlib.crc32(self.content)})
+        self.assertEqual(201, response.status_code)
+        self.assertEqual("Tuckie", response.json()['title'])
+
+        photo = Photo.objects.get(album=self.album, title="Tuckie")
+        with photo.image.open('rb'):
+            self.assertEqual(self.content, photo.image.read())
+        self.assertFalse(UploadSession.objects.filter(pk=session['id']).exists())
+
+    def test_out_of_order_range(self):
+        session = self.open_session(title="Out of order")
+        response = self.put_range(session, 100, 199)
+        self.assertEqual(409, response.status_code)
+        self.assertEqual(0, response.json()['offset'])
+
+    def test_range_beyond_size(self):
+        session = self.open_session(title="Too big", size=10)
+        response = self.put_range(session, 0, 19)
+        self.assertEqual(416, response.status_code)
+
+    def test_finalize_incomplete(self):
+        session = self.open_session(title="Incomplete")
+        self.put_range(session, 0, 99)
+        response = self.client.post(self.session_endpoint(session, 'finalize'))
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(100, response.json()['offset'])
+
+    def test_finalize_checksum_mismatch(self):
+        session = self.open_session(title="Corrupt")
+        self.put_range(session, 0, len(self.content) - 1)
+        response = self.client.post(self.session_endpoint(session, 'finalize'), data={'crc32': 0})
+        self.assertEqual(400, response.status_code)
+
+    def test_finalize_not_an_image(self):
+        content = b'not an image' * 10
+        session = self.open_session(title="Not an image", size=len(content))
+        self.put_range(session, 0, len(content) - 1, content=content)
+        response = self.client.post(self.session_endpoint(session, 'finalize'))
+        self.assertEqual(400, response.status_code)
+
+    def test_finalize_duplicate_title_keeps_shared_file(self):
+        first, second = self.open_session(title="Twice"), self.open_session(title="Twice")
+        for session in (first, second):
+            self.put_range(session, 0, len(self.content) - 1)
+
+        response = self.client.post(self.session_endpoint(first, 'finalize'))
+        self.assertEqual(201, response.status_code)
+        response = self.client.post(self.session_endpoint(second, 'finalize'))
+        self.assertEqual(409, response.status_code)
+
+        # The rejected upload stored the same blob, which the saved photo still uses
+        photo = Photo.objects.get(album=self.album, title="Twice")
+        with photo.image.open('rb'):
+            self.assertEqual(self.content, photo.image.read())
+
+    @skipUnless(connection.vendor == 'postgresql', "Needs row locks that wait")
+    def test_concurrent_writes_to_same_range(self):
+        session = UploadSession.objects.get(pk=self.open_session(title="Retried")['id'])
+        streaming, release = threading.Event(), threading.Event()
+
+        class SlowStream(io.BytesIO):
+            # A request whose body is still arriving
+            def read(self, size=-1):
+                streaming.set()
+                release.wait(5)
+                return super().read(size)
+
+        results = {}
+
+        def write(name, stream):
+            try:
+                results[name] = UploadSession.objects.get(pk=session.pk).write_chunk(stream, 0, 100)
+            finally:
+                connection.close()
+
+        first = threading.Thread(target=write, args=('first', SlowStream(self.content[:100])))
+        first.start()
+        # The retry arrives while the first request streams, and waits for it
+        retry = threading.Thread(target=write, args=('retry', io.BytesIO(b'x' * 100)))
+        try:
+            self.assertTrue(streaming.wait(5))
+            retry.start()
+            with connection.cursor() as cursor:
+                for _ in range(500):
+                    cursor.execute("SELECT 1 FROM pg_locks WHERE NOT granted")
+                    if cursor.fetchone():
+                        break
+                    time.sleep(0.01)
+        finally:
+            release.set()
+            first.join()
+            retry.join()
+
+        self.assertEqual({'first': True, 'retry': False}, results)
+        session.refresh_from_db()
+        with open(session.path, 'rb') as staged:
+            self.assertEqual(self.content[:100], staged.read())
+        self.assertEqual(zlib.crc32(self.content[:100]), session.checksum)
+
+    def test_finalize_decompression_bomb(self):
+        session = self.open_session(title="Bomb")
+        self.put_range(session, 0, len(self.content) - 1)
+        with patch.object(Image, 'MAX_IMAGE_PIXELS', 10):
+            response = self.client.post(self.session_endpoint(session, 'finalize'))
+        self.assertEqual(400, response.status_code)
+        self.assertFalse(Photo.objects.filter(album=self.album, title="Bomb").exists())
+
+    def test_expired_session(self):
+        session = self.open_session(title="Expired")
+        self.put_range(session, 0, 99)
+        stale = timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_EXPIRY + 60)
+        UploadSession.objects.filter(pk=session['id']).update(updated=stale)
+
+        response = self.client.get(self.session_endpoint(session))
+        self.assertEqual(404, response.status_code)
+
+    def test_expire_uploads(self):
+        expired, live = self.open_session(title="Expired"), self.open_session(title="Live")
+        self.put_range(expired, 0, 99)
+        self.put_range(live, 0, 99)
+        stale = timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_EXPIRY + 60)
+        UploadSession.objects.filter(pk=expired['id']).update(updated=stale)
+        expired_path = UploadSession.objects.get(pk=expired['id']).path
+        live_path = UploadSession.objects.get(pk=live['id']).path
+        # Left behind by a session deleted along with its album
+        orphan_path = os.path.join(settings.UPLOAD_STAGING_ROOT, f"{uuid.uuid4()}.part")
+        with open(orphan_path, 'wb') as orphan:
+            orphan.write(b'orphan')
+        os.utime(orphan_path, (stale.timestamp(), stale.timestamp()))
+
+        call_command('expire_uploads', stdout=open(os.devnull, 'w'))
+
+        self.assertFalse(UploadSession.objects.filter(pk=expired['id']).exists())
+        self.assertFalse(os.path.exists(expired_path))
+        self.assertFalse(os.path.exists(orphan_path))
+        self.assertTrue(UploadSession.objects.filter(pk=live['id']).exists())
+        self.assertTrue(os.path.exists(live_path))
+
+    def test_other_user_session_hidden(self):
+        session = self.open_session(title="Private")
+        self.client.force_login(self.other_user)
+        response = self.client.get(self.session_endpoint(session))
+        self.assertEqual(404, response.status_code)
+
+    def test_open_session_for_other_user(self):
+        self.client.force_login(self.other_user)
+        response = self.client.post(self.upload_endpoint, data={
+            'album': self.album.name, 'title': "Theirs", 'filename': 'tuckie.jpg', 'size': 1,
+        })
+        self.assertIn(response.status_code, (400, 403))
+
+    def test_anonymous_rejected(self):
+        self.client.logout()
+        response = self.client.post(self.upload_endpoint, data={})
+        self.assertEqual(403, response.status_code)
+
+
+class AsyncReadViewTestCase(TransactionTestCase):
+    # The async views query from a pool thread with its own connection, so the data has to be committed
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="test_user")
+        self.album = Album.objects.create(name="public_album", owner=self.user)
+        Album.objects.create(name="private_album", owner=self.user, public=False)
+        Photo.objects.bulk_create(Photo(title=f"photo_{i}", album=self.album, image=f"photo_{i}.jpg")
+                                  for i in range(3))
+
+    def get_async(self, url, view, user=None, **kwargs):
+        request = AsyncRequestFactory().get(url)
+        request.user = user or AnonymousUser()
+        return async_to_sync(view)(request, **kwargs)
+
+    def test_album_list_matches_sync(self):
+        url = reverse('rest:user-list', current_app='rest', kwargs={'slug': self.user.username})
+        view = async_view(AlbumViewSet.as_view({'get': 'list', 'post': 'create'}))
+
+        response = self.get_async(url, view, slug=self.user.username)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.client.get(url).json(), json.loads(response.content))
+
+        self.client.force_login(self.user)
+        response = self.get_async(url, view, user=self.user, slug=self.user.username)
+        self.assertEqual(2, len(json.loads(response.content)['results']))
+
+    def test_album_detail_matches_sync(self):
+        url = reverse('rest:album-detail', current_app='rest', kwargs={'slug': self.user.username,
+                                                                       'album': self.album.name})
+        view = async_view(PhotoViewSet.as_view({'get': 'retrieve'}))
+
+        response = self.get_async(url, view, slug=self.user.username, album=self.album.name)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.client.get(url).json(), json.loads(response.content))
+
+    def test_async_urls(self):
+        router = routers.DefaultRouter()
+        router.register('', AlbumViewSet, basename='user')
+        router.register('.*/uploads', UploadViewSet, basename='upload')
+
+        for url in async_urls(router.urls, (AlbumViewSet,)):
+            is_async = asyncio.iscoroutinefunction(url.callback)
+            self.assertEqual(url.name.startswith('user-'), is_async, url.name)
+            self.assertTrue(url.callback.csrf_exempt, url.name)
+
+
+class FastPathTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="test_user")
+        cls.album = Album.objects.create(name="Ünïcödé   \"album\"", owner=cls.user)
+        Album.objects.create(name="second_album", owner=cls.user)
+        renditions = {size: {'webp': f"photo.{size}.webp", 'jpeg': f"photo.{size}.jpg"} for size in ('thumb', 'card')}
+        Photo.objects.bulk_create([
+            Photo(title="with_renditions", album=cls.album, image="photo.jpg", renditions=renditions),
+            Photo(title="without_renditions", album=cls.album, image="other photo.jpg"),
+            Photo(title="without_image", album=cls.album),
+        ])
+
+    def request(self, **params):
+        return DRFRequest(RequestFactory().get('/', params))
+
+    def assertSameJSON(self, serializer, rows):
+        expected = JSONRenderer().render(serializer.data)
+        self.assertEqual(expected, FastJSONRenderer().render(serializer.child.represent_values(rows)))
+
+    def test_albums(self):
+        albums = Album.objects.order_by('pk')
+        serializer = AlbumSerializer(albums, many=True, context={'request': self.request()})
+
+        self.assertSameJSON(serializer, albums.values(*serializer.child.value_names()))
+
+    def test_photos(self):
+        photos = Photo.objects.order_by('pk')
+        serializer = PhotoSerializer(photos, many=True, context={'request': self.request()})
+
+        self.assertSameJSON(serializer, photos.values(*serializer.child.value_names()))
+
+    def test_sparse_fields(self):
+        photos = Photo.objects.order_by('pk')
+        serializer = PhotoSerializer(photos, many=True, context={'request': self.request(fields='title')})
+
+        self.assertListEqual(['title'], serializer.child.value_names())
+        self.assertSameJSON(serializer, photos.values(*serializer.child.value_names()))
+
+    def test_renderer_fallbacks(self):
+        data = {'name': "Ünïcödé  ", 'created': timezone.now(), 'id': uuid.uuid4(), 1: None}
+        for media_type in ('application/json', 'application/json; indent=2'):
+            self.assertEqual(JSONRenderer().render(data, media_type), FastJSONRenderer().render(data, media_type))
+
+
+class SearchApiTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.client = Client()
+        cls.search_url = reverse('rest-search')
+        cls.user = User.objects.create_user(username="test_user")
+        album = Album.objects.create(name="Sunset beach", owner=cls.user)
+        Album.objects.create(name="Sunset private", owner=cls.user, public=False)
+        Photo.objects.create(title="Sunset over the pier", album=album)
+
+    def test_albums(self):
+        response = self.client.get(self.search_url, {'q': "sunset"})
+        self.assertEqual(200, response.status_code)
+        self.assertListEqual([{'name': "Sunset beach", 'owner': "test_user"}],
+                             [{key: album[key] for key in ('name', 'owner')} for album in response.json()['results']])
+        self.assertIsNone(response.json()['next'])
+
+    def test_photos(self):
+        response = self.client.get(self.search_url, {'q': "sunset", 'kind': 'photos'})
+        self.assertListEqual([{'title': "Sunset over the pier", 'album': "Sunset beach", 'owner': "test_user",
+                               'images': {}, 'placeholder': ''}], response.json()['results'])
+
+    def test_next_page(self):
+        with patch.object(SearchView, 'page_size', 1):
+            self.client.force_login(self.user)
+            response = self.client.get(self.search_url, {'q': "sunset"})
+        self.assertEqual("http://testserver/rest/search/?page=2&q=sunset", response.json()['next'])
+
+    def test_invalid_query(self):
+        response = self.client.get(self.search_url, {'q': "s"})
+        self.assertEqual(400, response.status_code)
+        self.assertIn('q', response.json())
@@ -1,12 +1,20 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework import routers
 
-from rest.views import AlbumViewSet, PhotoViewSet
+from rest.async_views import async_urls
+from rest.views import AlbumViewSet, PhotoViewSet, SearchView, UploadViewSet
 
 router = routers.DefaultRouter()
 router.register('', AlbumViewSet, basename='user')
 router.register('.*/albums', PhotoViewSet, basename='album')
+router.register('.*/uploads', UploadViewSet, basename='upload')
+
+urls = router.urls
+if settings.REST_ASYNC_VIEWS:
+    urls = async_urls(urls, (AlbumViewSet, PhotoViewSet))
 
 urlpatterns = (
-    path('<slug>', include((router.urls, 'rest'))),
+    path('search/', SearchView.as_view(), name='rest-search'),
+    path('<slug>', include((urls, 'rest'))),
 )
@@ -1,11 +1,33 @@
-from rest_framework import viewsets
+import re
+from functools import reduce
+from operator import or_
 
+from django.core.files import File
+from django.db import IntegrityError
+from django.db.models import OuterRef, Q, Subquery
+from PIL import Image
+from rest_framework import generics, mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.pagination import Cursor
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from albums.forms import SearchForm
 from albums.models import Album, Photo
-from rest.serializers import AlbumSerializer, PhotoAlbumSerializer
+from albums.storage import staged_writes
+from rest.models import UploadSession, expiry_cutoff
+from rest.pagination import AlbumCursorPagination, PhotoCursorPagination
+from rest.serializers import (AlbumSearchResultSerializer, AlbumSerializer, PhotoAlbumSerializer, PhotoSearchResultSerializer,
+                              PhotoSerializer, UploadSessionSerializer)
+
+CONTENT_RANGE = re.compile(r'^bytes (?P<start>\d+)-(?P<end>\d+)/(?P<total>\d+|\*)$')
 
 
 class AlbumViewSet(viewsets.ModelViewSet):
     serializer_class = AlbumSerializer
+    pagination_class = AlbumCursorPagination
     lookup_field = 'owner'
 
     def get_queryset(self):
@@ -16,17 +38,205 @@ class AlbumViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        """
+        Serializes ``values()`` rows rather than model instances, see ``ValuesRepresentationMixin``
+        """
+        serializer = self.get_serializer()
+        ordering = [name.lstrip('-') for name in self.paginator.ordering]
+        rows = self.filter_queryset(self.get_queryset()).values(*serializer.value_names(*ordering))
+
+        page = self.paginate_queryset(rows)
+        return self.get_paginated_response(serializer.represent_values(page))
+
 
 class PhotoViewSet(viewsets.ModelViewSet):
     serializer_class = PhotoAlbumSerializer
+    pagination_class = AlbumCursorPagination
+    photo_pagination_class = PhotoCursorPagination
+    # Photos nested in each album of the list; the rest are paged through with retrieve
+    nested_photo_limit = 20
     lookup_url_kwarg = 'album'
     lookup_field = 'name'
 
     def get_queryset(self):
         username = self.kwargs['slug']
-        name = self.kwargs['album']
-        album = Album.objects.filter(owner__username=username, name=name)
+        name = self.kwargs.get('album')
+        album = Album.objects.filter(owner__username=username)
+        if name is not None:
+            album = album.filter(name=name)
         if not username == self.request.user.username:
             album = album.filter(public=True)
 
         return album
+
+    def list(self, request, *args, **kwargs):
+        """
+        The first ``nested_photo_limit`` photos of each album, serialized from ``values()`` rows fetched in one query
+        for the whole page of albums, and a link to the album's next page of photos when it has more
+        """
+        limit = self.nested_photo_limit
+        ordering = [name.lstrip('-') for name in self.paginator.ordering]
+        # The first photo past the limit, which the album's photos are cut off at
+        cutoff = Photo.objects.filter(album=OuterRef('pk')).order_by('id').values('id')[limit:limit + 1]
+        albums = self.paginate_queryset(self.filter_queryset(self.get_queryset()).annotate(
+            photo_cutoff=Subquery(cutoff)).values('pk', 'name', 'photo_cutoff', *ordering))
+
+        photo_serializer = self.get_serializer().fields['photos'].child
+        photos = {album['pk']: [] for album in albums}
+        if albums:
+            shown = reduce(or_, (Q(album=album['pk'], id__lt=album['photo_cutoff']) if album['photo_cutoff']
+                                 else Q(album=album['pk']) for album in albums))
+            rows = Photo.objects.filter(shown).order_by('id').values(*photo_serializer.value_names('album', 'id'))
+            for row in rows:
+                photos[row['album']].append(row)
+
+        return self.get_paginated_response([{
+            'photos': photo_serializer.represent_values(photos[album['pk']]),
+            'photos_next': self.photos_next_link(album['name'], photos[album['pk']][-1]['id'])
+            if album['photo_cutoff'] else None,
+        } for album in albums])
+
+    def photos_next_link(self, name, last_id):
+        """
+        The page of ``retrieve`` that follows the photo ``last_id`` of the album ``name``
+        """
+        paginator = self.photo_pagination_class()
+        paginator.base_url = self.reverse_action('detail', kwargs={'slug': self.kwargs['slug'], 'album': name})
+
+        return paginator.encode_cursor(Cursor(offset=0, reverse=False, position=str(last_id)))
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Returns the album's photos one cursor page at a time
+        """
+        album = self.get_object()
+        photo_serializer = self.get_serializer().fields['photos'].child
+
+        paginator = self.photo_pagination_class()
+        rows = album.photos.values(*photo_serializer.value_names(*(name.lstrip('-') for name in paginator.ordering)))
+        data = {
+            'photos': photo_serializer.represent_values(paginator.paginate_queryset(rows, request, view=self)),
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
+        }
+
+        return Response(data)
+
+
+class UploadViewSet(mixins.CreateModelMixin,
+                    mixins.RetrieveModelMixin,
+                    mixins.DestroyModelMixin,
+                    viewsets.GenericViewSet):
+    """
+    Resumable photo uploads.
+
+    ``POST`` opens a session for a photo of ``size`` bytes, each ``PUT`` sends the next byte range with a
+    ``Content-Range`` header, ``GET`` reports the offset to resume from, and ``POST .../finalize/`` turns the
+    completed upload into a ``Photo``. Sessions not written to for ``UPLOAD_SESSION_EXPIRY`` seconds are gone, and
+    ``manage.py expire_uploads`` deletes them and their staged files.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(owner=self.request.user, owner__username=self.kwargs['slug'],
+                                            updated__gte=expiry_cutoff())
+
+    def perform_create(self, serializer):
+        if self.kwargs['slug'] != self.request.user.username:
+            raise PermissionDenied()
+
+        serializer.save(owner=self.request.user)
+
+    def perform_destroy(self, instance):
+        instance.discard()
+
+    def update(self, request, *args, **kwargs):
+        session = self.get_object()
+
+        content_range = CONTENT_RANGE.match(request.META.get('HTTP_CONTENT_RANGE', ''))
+        if content_range is None:
+            return Response({'detail': "A 'Content-Range: bytes start-end/total' header is required."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        start, end = int(content_range['start']), int(content_range['end'])
+        length = end - start + 1
+        if content_range['total'] not in ('*', str(session.size)) or end < start or end >= session.size:
+            return Response({'detail': f"Range must fall within the upload's {session.size} bytes."},
+                            status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        if int(request.META.get('CONTENT_LENGTH') or 0) != length:
+            return Response({'detail': "Content-Length does not match Content-Range."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Ranges must arrive in order; a client that lost track resumes from the offset in the response
+        if start != session.offset or not session.write_chunk(request.stream, start, length):
+            session.refresh_from_db()
+            return Response(self.get_serializer(session).data, status=status.HTTP_409_CONFLICT)
+
+        return Response(self.get_serializer(session).data)
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, *args, **kwargs):
+        session = self.get_object()
+
+        if not session.complete:
+            return Response({'detail': "Upload is incomplete.", 'offset': session.offset},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        expected_checksum = request.data.get('crc32')
+        if expected_checksum is not None and str(expected_checksum) != str(session.checksum):
+            return Response({'detail': "Checksum mismatch.", 'crc32': session.checksum},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with Image.open(session.path) as image:
+                image.verify()
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+            return Response({'detail': "Upload is not a valid image."}, status=status.HTTP_400_BAD_REQUEST)
+
+        photo = Photo(title=session.title, album=session.album)
+        try:
+            # A new file is only published if the photo is saved; an existing blob, which other photos may share, is
+            # left as it is
+            with staged_writes(), open(session.path, 'rb') as staged:
+                photo.image.save(session.filename, File(staged), save=False)
+                photo.save()
+        except IntegrityError:
+            return Response({'detail': "A photo with this title already exists in the album."},
+                            status=status.HTTP_409_CONFLICT)
+
+        session.discard()
+
+        return Response(PhotoSerializer(photo, context=self.get_serializer_context()).data,
+                        status=status.HTTP_201_CREATED)
+
+
+class SearchView(generics.GenericAPIView):
+    """
+    Albums (``?kind=albums``, the default) or photos (``?kind=photos``) matching ``?q=``, best first, a ``?page=``
+    at a time
+    """
+    page_size = 50
+
+    def get_serializer_class(self):
+        if self.request.query_params.get('kind') == 'photos':
+            return PhotoSearchResultSerializer
+        return AlbumSearchResultSerializer
+
+    def get(self, request, *args, **kwargs):
+        form = SearchForm(request.query_params)
+        if not form.is_valid():
+            raise ValidationError(form.errors)
+
+        page = form.results(request.user, self.page_size)
+        data = {
+            'results': self.get_serializer(page.object_list, many=True).data,
+            'next': self.page_link(page.next_page_number()) if page.has_next() else None,
+            'previous': self.page_link(page.previous_page_number()) if page.has_previous() else None,
+        }
+
+        return Response(data)
+
+    def page_link(self, number):
+        return replace_query_param(self.request.build_absolute_uri(), 'page', number)